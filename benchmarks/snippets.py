@@ -0,0 +1,57 @@
+'''Assembles many small snippets with new instances, reset() and assemble_many()
+
+usage: python benchmarks/snippets.py [number_of_snippets]
+'''
+import sys
+import time
+from necroassembler.cpu.z80 import AssemblerZ80
+
+
+def snippets(count):
+    return ['start:\nLD A, {0}\nLD (HL), A\nINC HL\nDJNZ start\nRET'.format(index & 0xFF)
+            for index in range(0, count)]
+
+
+def new_instances(codes):
+    results = []
+    for code in codes:
+        asm = AssemblerZ80()
+        asm.assemble(code)
+        asm.link()
+        results.append(bytes(asm.assembled_bytes))
+    return results
+
+
+def reset_instance(codes):
+    results = []
+    asm = AssemblerZ80()
+    for code in codes:
+        asm.reset()
+        asm.assemble(code)
+        asm.link()
+        results.append(bytes(asm.assembled_bytes))
+    return results
+
+
+def assemble_many(codes):
+    return AssemblerZ80().assemble_many(codes)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    codes = snippets(count)
+    expected = None
+    for function in (new_instances, reset_instance, assemble_many):
+        start = time.perf_counter()
+        results = function(codes)
+        elapsed = time.perf_counter() - start
+        if expected is None:
+            expected = results
+        elif results != expected:
+            raise Exception('{0} generated different bytes'.format(function.__name__))
+        print('{0}: {1:.3f}s ({2:.1f} us per snippet)'.format(
+            function.__name__, elapsed, elapsed * 1000000 / count))
+
+
+if __name__ == '__main__':
+    main()
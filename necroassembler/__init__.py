@@ -1,2 +1,3 @@
+__version__ = '0.8'
 
-from necroassembler.assembler import Assembler, opcode, directive, pre_link, post_link
+from necroassembler.assembler import Assembler, opcode, directive, pre_link, post_link, asset
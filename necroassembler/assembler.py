@@ -1,15 +1,32 @@
-from necroassembler.tokenizer import Tokenizer
+import os
+import sys
+import mmap
+import types
+from collections import OrderedDict
+from array import array
+from bisect import bisect_left, bisect_right
+from necroassembler.tokenizer import Tokenizer, split_operands, split_conditionals, CONDITIONAL_DIRECTIVES
+from necroassembler.statements import Instruction, Directive, Label
 from necroassembler.utils import (pack_byte, pack_le32u, pack_le16u,
                                   pack_be32u, pack_be16u, in_bit_range,
-                                  in_bit_range_decimal, pack_bits, is_valid_name)
+                                  in_bit_range_decimal, pack_bits, is_valid_name, substitute_with_dict)
 from necroassembler.exceptions import (UnknownLabel, UnsupportedNestedMacro, NotInMacroRecordingMode,
                                        AddressOverlap, NegativeSignNotAllowed, NotInRepeatMode,
                                        UnsupportedNestedRepeat,
                                        AlignmentError, NotInBitRange, OnlyForwardAddressesAllowed,
                                        InvalidArgumentsForDirective, LabelNotAllowed, InvalidDefine,
-                                       SectionAlreadyDefined, SymbolAlreadyExported)
+                                       SectionAlreadyDefined, SymbolAlreadyExported, AssemblerException,
+                                       NotInConditionalBlock, UnterminatedConditionalBlock,
+                                       ConditionalNotAllowedInMacro)
 from necroassembler.macros import Macro
-from necroassembler.linker import Dummy
+from necroassembler.linker import Dummy, write_parts
+from necroassembler.trace import TraceBuffer
+from necroassembler.checksum import Checksum
+from necroassembler.cache import AssetCache, BuildCache, TokenCache, asset_converter, converter_id
+from necroassembler.compression import CODECS, convert_compressed
+
+# array typecodes for the .inccsv/.incjson element sizes
+PACK_TYPECODES = {1: 'B', 2: 'H', 4: 'I' if array('I').itemsize == 4 else 'L', 8: 'Q'}
 
 
 def opcode(*name):
@@ -26,6 +43,13 @@ def directive(*name):
     return wrapper
 
 
+def asset(*name):
+    def wrapper(f):
+        f.asset = name
+        return f
+    return wrapper
+
+
 def pre_link(f):
     f.pre_link = True
     return f
@@ -68,26 +92,28 @@ class Assembler:
 
     big_endian = False
 
+    # boolean attributes (set by directives) stored in object files
+    object_attributes = ()
+
     defines = {}
 
     def __init__(self):
         self.instructions = {}
         self.directives = {}
-        self.assembled_bytes = bytearray()
-        self.labels = {}
+        self.assets = {}
+        self.asset_cache = None
+        self.token_cache = None
+        self.asset_workers = 0
+        self.asset_pool = None
+        self.pending_assets = {}
+        self.mapped_files = {}
         self.pre_link_passes = []
         self.post_link_passes = []
-        self.current_org = 0x00
-        self.current_org_end = 0
-        self.org_counter = 0
-        self.labels_addresses = {}
-        self.macros = {}
-        self.macro_recording = None
-        self.repeat = None
-        self.log = False
-        self.sections = {}
-        self.current_section = None
-        self.exports = []
+        # base directory of relative input paths (None for the working directory)
+        self.directory = None
+        # number of statements between reassemble() checkpoints (0 disables them)
+        self.checkpoint_interval = 0
+        self._init_state()
 
         # avoid subclasses to overwrite parent
         # class variables by making a copy
@@ -108,15 +134,96 @@ class Assembler:
         self.register_directives()
         self.register_instructions()
 
+        # snapshot for reset()
+        self._initial_defines = self.defines.copy()
+        self._initial_attributes = frozenset(list(self.__dict__) + ['_initial_attributes'])
+
+    def _init_state(self):
+        # every file read during assembly (used as an ordered set)
+        self.input_files = OrderedDict()
+        self.assembled_bytes = bytearray()
+        # ordered tables, checkpoints truncate them to their previous size
+        self.labels = OrderedDict()
+        self._symbols_addresses = None
+        self._symbols_names = None
+        self._symbols_offsets = None
+        self._symbols_offsets_names = None
+        self.current_org = 0x00
+        self.current_org_end = 0
+        self.org_counter = 0
+        # set by .org and by the directives padding up to an address (objects using them cannot be moved)
+        self.address_dependent = False
+        self.labels_addresses = OrderedDict()
+        self.macros = {}
+        self.macro_recording = None
+        self.repeat = None
+        # enabled by .log
+        self.log = False
+        self.trace = None
+        self.checksum = None
+        self.linker = None
+        self.sections = {}
+        self.current_section = None
+        # used as an ordered set
+        self.exports = OrderedDict()
+        self.spans = []
+        self.current_context = None
+        self.current_macro = None
+        self.conditions = []
+        # real paths of the included files (used as an ordered set)
+        self.included_files = OrderedDict()
+        # text and statements of the included files, read only once per run
+        self.include_sources = {}
+        self.include_tokens = TokenCache()
+        self.checkpoints = []
+        self._assemble_depth = 0
+        self._unlinked_bytes = None
+
+    def reset(self):
+        """Clears the state of the previous assembly, so the instance can assemble another source
+
+        Assembled bytes, labels, macros, sections, exports, the org and the
+        defines added by the code are cleared, while the instructions and
+        directives tables (and the link passes and caches) are kept.
+        Attributes set by the directives of subclasses are restored to
+        their class value.
+        """
+        self.close_mapped_files()
+        self.pending_assets = {}
+        for name in list(self.__dict__):
+            if name not in self._initial_attributes:
+                delattr(self, name)
+        self._init_state()
+        self.defines = self._initial_defines.copy()
+
+    def assemble_many(self, snippets, link=True):
+        """Assembles (and links) multiple independent sources with the same instance
+
+        :param list snippets: the sources
+        :param bool link: link each snippet
+        :return: the assembled bytes of each snippet
+        :rtype: list
+        """
+        results = []
+        for code in snippets:
+            self.reset()
+            self.assemble(code)
+            if link:
+                self.link()
+            results.append(bytes(self.assembled_bytes))
+        return results
+
     def _register_internal_directives(self):
         self.register_directive('macro', self.macro_start)
         self.register_directive('endmacro', self.macro_end)
         self.register_directive('org', self.directive_org)
         self.register_directive('include', self.directive_include)
+        self.register_directive('include_once', self.directive_include_once)
         self.register_directive('incbin', self.directive_incbin)
-        self.register_directive('inccsv', self.directive_inccsv)
-        self.register_directive('inccsv_le16', self.directive_inccsv_le16)
-        self.register_directive('incjson', self.directive_incjson)
+        self.register_asset('inccsv', self.asset_inccsv)
+        self.register_asset('inccsv_le16', self.asset_inccsv_le16)
+        self.register_asset('incjson', self.asset_incjson)
+        self.register_asset('incbin_compressed', self.asset_incbin_compressed)
         self.register_directive('define', self.directive_define)
         self.register_directive('db', self.directive_db)
         self.register_directive('byte', self.directive_db)
@@ -157,6 +264,9 @@ class Assembler:
                 if hasattr(attr, 'directive'):
                     for symbol in attr.directive:
                         self.register_directive(symbol, attr)
+                if hasattr(attr, 'asset'):
+                    for symbol in attr.asset:
+                        self.register_asset(symbol, attr)
                 if hasattr(attr, 'pre_link'):
                     if attr.pre_link:
                         self.pre_link_passes.append(attr)
@@ -182,20 +292,198 @@ class Assembler:
         self.macro_recording = None
 
     def assemble(self, code, context=None):
-        tokenizer = Tokenizer(context=context)
-        tokenizer.parse(code)
+        if self._assemble_depth == 0 and self.checkpoint_interval > 0:
+            self.checkpoints = []
 
-        for statement in tokenizer.statements:
-            current_index = len(self.assembled_bytes)
-            statement.assemble(self)
-            if self.log:
-                new_index = len(self.assembled_bytes)
-                if new_index == current_index:
-                    print('not assembled {0}'.format(statement))
-                else:
-                    print('assembled {0} -> ({1}) at 0x{2:x}'.format(statement,
-                                                                     ','.join(['0x{0:02x}'.format(x) for x in self.assembled_bytes[current_index:]]), current_index))
+        self._assemble_statements(self._statements(code, context), context)
+
+    def _tokenize(self, code, context, line, token_cache=None):
+        if self.token_cache is not None:
+            token_cache = self.token_cache
+        if token_cache is not None:
+            statements = token_cache.tokenize(code, context, line)
+        else:
+            tokenizer = Tokenizer(context=context)
+            tokenizer.line = line
+            tokenizer.parse(code)
+            statements = tokenizer.statements
+        if self.asset_workers > 1:
+            self.prefetch_assets(statements)
+        return statements
+
+    def _statements(self, code, context, line=1, token_cache=None):
+        # blocks disabled by conditional directives are never tokenized
+        for block_line, block, is_conditional in split_conditionals(code, line):
+            if not is_conditional and self.conditions and not self.conditions[-1][0]:
+                continue
+            yield from self._tokenize(block, context, block_line, token_cache)
 
+    def _assemble_statements(self, statements, context):
+        previous_context = self.current_context
+        self.current_context = context
+
+        # checkpoints are recorded only for the top level code
+        record = self._assemble_depth == 0 and self.checkpoint_interval > 0 and not self.log
+        since_checkpoint = self.checkpoint_interval
+        previous_line = None
+        self._assemble_depth += 1
+        try:
+            for statement in statements:
+                # a checkpoint must be the first statement of its line (labels can precede instructions)
+                if record and since_checkpoint >= self.checkpoint_interval and statement.line != previous_line and \
+                        self.macro_recording is None and self.repeat is None:
+                    self.checkpoints.append(self._checkpoint(statement.line))
+                    since_checkpoint = 0
+                since_checkpoint += 1
+                previous_line = statement.line
+                self._assemble_statement(statement)
+        finally:
+            self._assemble_depth -= 1
+
+        self.current_context = previous_context
+
+        self._close_assembly()
+
+    def _checkpoint(self, line):
+        return {'line': line,
+                'size': len(self.assembled_bytes),
+                'org': (self.current_org, self.current_org_end, self.org_counter),
+                'address_dependent': self.address_dependent,
+                'log': self.log,
+                'labels': len(self.labels),
+                'labels_addresses': len(self.labels_addresses),
+                'exports': len(self.exports),
+                'spans': len(self.spans),
+                'input_files': len(self.input_files),
+                'included_files': len(self.included_files),
+                'sections': {name: dict(section) for name, section in self.sections.items()},
+                'current_section': self.current_section,
+                'macros': self.macros.copy(),
+                'defines': self.defines.copy(),
+                'conditions': [list(condition) for condition in self.conditions],
+                # attributes set by the directives of subclasses
+                'attributes': {name: value for name, value in self.__dict__.items()
+                               if name not in self._initial_attributes}}
+
+    def _restore_checkpoint(self, checkpoint):
+        # link() patches the bytes, restart from the unlinked ones
+        blob = self._unlinked_bytes if self._unlinked_bytes is not None else self.assembled_bytes
+        self.assembled_bytes = bytearray(blob[0:checkpoint['size']])
+        self._unlinked_bytes = None
+        self.current_org, self.current_org_end, self.org_counter = checkpoint['org']
+        self.address_dependent = checkpoint['address_dependent']
+        self.log = checkpoint['log']
+        for name in ('labels', 'labels_addresses', 'exports', 'input_files', 'included_files'):
+            table = getattr(self, name)
+            for key in list(table)[checkpoint[name]:]:
+                del table[key]
+        del self.spans[checkpoint['spans']:]
+        self.sections = {name: dict(section) for name, section in checkpoint['sections'].items()}
+        self.current_section = checkpoint['current_section']
+        self.macros = checkpoint['macros'].copy()
+        self.defines = checkpoint['defines'].copy()
+        self.conditions = [list(condition) for condition in checkpoint['conditions']]
+        # included files could have been modified since the previous run
+        self.include_sources = {}
+        for name in list(self.__dict__):
+            if name not in self._initial_attributes:
+                delattr(self, name)
+        self.__dict__.update(checkpoint['attributes'])
+        self.invalidate_symbols()
+        self.checksum = None
+        self.linker = None
+
+    def reassemble(self, code, line, context=None):
+        """Assembles an edited version of the code passed to the last (top level) assemble() call
+
+        Assembly resumes from the last checkpoint before the first modified
+        line, so only the following statements are assembled again.
+        Checkpoints are recorded every checkpoint_interval statements (0 disables
+        them, and the whole code is assembled again after a reset()).
+        Call link() again after it.
+
+        :param str code: the new version of the code
+        :param int line: the first modified line (starting from 1)
+        :param str context: the context of the code
+        """
+        if not self.checkpoints:
+            self.reset()
+            self.assemble(code, context)
+            return
+        # the first checkpoint is valid for any edit (no statements before it)
+        index = 0
+        for checkpoint_index, checkpoint in enumerate(self.checkpoints):
+            if checkpoint['line'] <= line:
+                index = checkpoint_index
+        checkpoint = self.checkpoints[index]
+        del self.checkpoints[index:]
+        self._restore_checkpoint(checkpoint)
+        code = '\n'.join(code.split('\n')[checkpoint['line'] - 1:])
+        self._assemble_statements(self._statements(code, context, checkpoint['line']), context)
+
+    def _assemble_statement(self, statement):
+        if isinstance(statement, Directive) and statement.tokens[0][1:].lower() in CONDITIONAL_DIRECTIVES:
+            self._conditional(statement)
+            return
+        if self.conditions and not self.conditions[-1][0]:
+            # statements generated by emit() or on the line of a label
+            return
+        current_index = len(self.assembled_bytes)
+        statement.assemble(self)
+        if self.log:
+            self.get_trace().statement(statement.context, statement.line, current_index,
+                                       bytes(self.assembled_bytes[current_index:]), tuple(statement.tokens))
+
+    def _conditional(self, instr):
+        # macros record only instructions, a condition would be evaluated when defining the macro
+        if self.macro_recording is not None:
+            raise ConditionalNotAllowedInMacro(instr)
+        # conditions entries are [enabled, a branch has been enabled, in .else, the opening directive]
+        name = instr.tokens[0][1:].lower()
+        if name in ('if', 'ifdef', 'ifndef'):
+            parent_enabled = not self.conditions or self.conditions[-1][0]
+            # conditions in disabled blocks are not evaluated
+            value = parent_enabled and self._evaluate_condition(name, instr)
+            self.conditions.append([value, value or not parent_enabled, False, instr])
+            return
+        if len(instr.tokens) != 1:
+            raise InvalidArgumentsForDirective(instr)
+        if not self.conditions:
+            raise NotInConditionalBlock(instr)
+        if name == 'endif':
+            self.conditions.pop()
+            return
+        condition = self.conditions[-1]
+        if condition[2]:
+            raise NotInConditionalBlock(instr)
+        condition[0] = not condition[1]
+        condition[1] = True
+        condition[2] = True
+
+    def _evaluate_condition(self, name, instr):
+        if name in ('ifdef', 'ifndef'):
+            if len(instr.tokens) != 2:
+                raise InvalidArgumentsForDirective(instr)
+            return (instr.tokens[1] in self.defines) == (name == 'ifdef')
+        tokens = list(instr.tokens)
+        substitute_with_dict(tokens, self.defines, 1)
+        if len(tokens) not in (2, 4):
+            raise InvalidArgumentsForDirective(instr)
+        values = []
+        for token in tokens[1::2]:
+            value = self.parse_integer(token, 64, True)
+            if value is None:
+                raise InvalidArgumentsForDirective(instr)
+            values.append(value)
+        if len(values) == 1:
+            return values[0] != 0
+        operators = {'==': int.__eq__, '!=': int.__ne__, '<': int.__lt__,
+                     '>': int.__gt__, '<=': int.__le__, '>=': int.__ge__}
+        if tokens[2] not in operators:
+            raise InvalidArgumentsForDirective(instr)
+        return operators[tokens[2]](values[0], values[1])
+
+    def _close_assembly(self):
         # check if we need to fill something
         if self.current_org_end > 0:
             if self.current_org + self.org_counter < self.current_org_end:
@@ -209,19 +497,110 @@ class Assembler:
             self.sections[self.current_section]['size'] = len(
                 self.assembled_bytes) - self.sections[self.current_section]['offset']
 
+    def _emit_statement(self, statement):
+        previous_context = self.current_context
+        self.current_context = statement.context
+        try:
+            self._assemble_statement(statement)
+        finally:
+            self.current_context = previous_context
+
+    def emit(self, *operands, line=0, context=None):
+        """Assembles an instruction (or a macro) without tokenizing source code
+
+        Operands are split only around brackets and spaces, so
+        emit('LD', 'A', '(HL)') is equivalent to 'LD A, (HL)'.
+        Non-string operands (like integers) are converted with str().
+        Call link() when the code is complete (org fills and sections are closed there).
+
+        :param str operands: the instruction name followed by the operands
+        :param int line: the line reported in errors and traces
+        :param str context: the context (the file name) reported in errors, traces and reports
+        """
+        self._emit_statement(Instruction(split_operands(operands), line, context))
+
+    def emit_label(self, name, line=0, context=None):
+        """Defines a label at the current address (like 'name:')
+
+        :param str name: the label
+        :param int line: the line reported in errors and traces
+        :param str context: the context reported in errors, traces and reports
+        """
+        self._emit_statement(Label([name], line, context))
+
+    def emit_directive(self, name, *operands, line=0, context=None):
+        """Assembles a directive without tokenizing source code (see emit())
+
+        String operands must be quoted, like emit_directive('incbin', '"data.bin"').
+
+        :param str name: the directive name (the leading dot is optional)
+        :param str operands: the operands
+        :param int line: the line reported in errors and traces
+        :param str context: the context reported in errors, traces and reports
+        """
+        if not name.startswith('.'):
+            name = '.' + name
+        self._emit_statement(Directive(split_operands((name,) + operands), line, context))
+
     def assemble_file(self, filename):
-        with open(filename) as f:
+        with self.open_input(filename) as f:
             self.assemble(f.read(), filename)
 
+    def open_input(self, filename, mode='r'):
+        """Opens a file required by the assembly (sources, includes, assets), every file is recorded in input_files
+
+        :param str filename: the file to open
+        :param str mode: the open() mode
+        :rtype: file
+        """
+        filename = self.input_path(filename)
+        self.input_files[filename] = None
+        return open(filename, mode)
+
+    def input_path(self, filename):
+        """Returns the path of an input file, relative paths are relative to the directory attribute (when set)
+
+        :param str filename: the file
+        :rtype: str
+        """
+        if self.directory is None:
+            return filename
+        return os.path.join(self.directory, filename)
+
+    def get_trace(self):
+        # events are only formatted when the trace is dumped
+        if self.trace is None:
+            self.trace = TraceBuffer()
+        return self.trace
+
+    def get_checksum(self):
+        """Returns the checksum service of the assembled bytes (post link passes should patch bytes with its write() method)
+
+        :rtype: checksum.Checksum
+        """
+        if self.checksum is None or self.checksum.buffer is not self.assembled_bytes:
+            self.checksum = Checksum(self.assembled_bytes)
+        return self.checksum
+
+    def symbol_writers(self, destination):
+        """Returns the platform specific debug symbols writers
+
+        :param str destination: the output file of the assembler
+        :rtype: list
+        """
+        return []
+
     def save(self, filename):
         with open(filename, 'wb') as handle:
             handle.write(self.assembled_bytes)
 
     def _resolve_labels(self, linker):
+        # resolve_symbol() is optional, linkers only need resolve_unknown_symbol() and link()
+        resolve_symbol = getattr(linker, 'resolve_symbol', None)
         for address in self.labels_addresses:
             data = self.labels_addresses[address]
             label = data.label
-            is_relative = data.relative != 0
+            is_relative = data.relative is not None
 
             absolute_address = self.get_label_absolute_address_by_name(label)
             if not is_relative:
@@ -234,6 +613,9 @@ class Assembler:
                 true_address = linker.resolve_unknown_symbol(
                     self, address, data)
                 absolute_address = true_address
+            elif resolve_symbol is not None:
+                true_address = resolve_symbol(
+                    self, address, data, true_address)
 
             if data.hook:
                 data.hook(address, true_address)
@@ -265,15 +647,48 @@ class Assembler:
                     self.assembled_bytes[address + i] |= value
 
             if self.log:
-                print('label "{0}" translated to ({1}) at address {2}'.format(
-                    label, ','.join(['0x{0:02x}'.format(x) for x in self.assembled_bytes[address:address+size]]), hex(address)))
-
+                self.get_trace().fixup(label, address, bytes(
+                    self.assembled_bytes[address:address+size]))
 
     def link(self, linker=None):
+        linker = self._link(linker)
+        self.assembled_bytes = linker.link(self)
+
+    def link_to_file(self, filename, linker=None):
+        """Links the assembled code and writes the output file
+
+        The parts of linkers implementing link_parts() (like ELF) are written
+        with gathered writes without joining them in memory, assembled_bytes
+        keeps the linked code (without headers and tables) in that case.
 
+        :param str filename: the output file
+        :param linker: the linker (None for the Dummy one)
+        """
+        linker = self._link(linker)
+        if not hasattr(linker, 'link_parts'):
+            self.assembled_bytes = linker.link(self)
+            self.save(filename)
+            return
+        with open(filename, 'wb') as handle:
+            write_parts(handle, linker.link_parts(self))
+
+    def _link(self, linker):
+        # everything but the output generation of the linker
         if not linker:
             linker = Dummy()
 
+        # code generated with emit() is not closed by assemble()
+        self._close_assembly()
+
+        # binary files are not needed anymore
+        self.close_mapped_files()
+
+        if self.conditions:
+            raise UnterminatedConditionalBlock(self.conditions[-1][3])
+
+        if self.checkpoints:
+            self._unlinked_bytes = bytes(self.assembled_bytes)
+
         for _pass in self.pre_link_passes:
             if hasattr(_pass, '__self__') and _pass.__self__ == self:
                 _pass()
@@ -288,7 +703,8 @@ class Assembler:
             else:
                 _pass(self)
 
-        self.assembled_bytes = linker.link(self)
+        self.linker = linker
+        return linker
 
     @property
     def pc(self):
@@ -297,7 +713,7 @@ class Assembler:
     def add_label_translation(self, label,
                               size, bits_size,
                               offset=0, alignment=1, bits=None, filter=None,
-                              relative=0, hook=None):
+                              relative=None, hook=None):
         index = len(self.assembled_bytes) + offset
         label_data = LabelData(label, size, bits_size, relative)
         label_data.offset = offset
@@ -381,10 +797,10 @@ class Assembler:
         return value
 
     def parse_integer_or_label(self, label,
-                               size, bits_size, relative=0,
+                               size, bits_size, relative=None,
                                offset=0, alignment=1, bits=None, filter=None,
                                hook=None, signed=False):
-        if relative != 0:
+        if relative is not None:
             signed = True
         value = self.parse_integer(label, bits_size, signed)
         # label ?
@@ -465,6 +881,77 @@ class Assembler:
             return None
         return self.apply_math_formula(pre_formula, post_formula, self.get_label_absolute_address(self.labels[name]))
 
+    def add_label(self, name, label):
+        """Adds (or replaces) a label, always change labels with it (or call invalidate_symbols())
+
+        :param str name: the label name
+        :param dict label: the label data
+        """
+        replaced = name in self.labels
+        self.labels[name] = label
+        if replaced:
+            self.invalidate_symbols()
+        elif self._symbols_names is not None:
+            # keep the address and offset indexes (if already built) in sync
+            address = self.get_label_absolute_address(label)
+            index = bisect_right(self._symbols_addresses, address)
+            self._symbols_addresses.insert(index, address)
+            self._symbols_names.insert(index, name)
+            index = bisect_right(self._symbols_offsets, label['offset'])
+            self._symbols_offsets.insert(index, label['offset'])
+            self._symbols_offsets_names.insert(index, name)
+
+    def invalidate_symbols(self):
+        """Drops the address index of the labels (call it after modifying labels directly)"""
+        self._symbols_addresses = None
+        self._symbols_names = None
+        self._symbols_offsets = None
+        self._symbols_offsets_names = None
+
+    def _get_symbols_index(self):
+        if self._symbols_names is None:
+            symbols = sorted((self.get_label_absolute_address(label), name)
+                             for name, label in self.labels.items())
+            self._symbols_addresses = [address for address, _ in symbols]
+            self._symbols_names = [name for _, name in symbols]
+            symbols = sorted((label['offset'], self.get_label_absolute_address(label), name)
+                             for name, label in self.labels.items())
+            self._symbols_offsets = [offset for offset, _, _ in symbols]
+            self._symbols_offsets_names = [name for _, _, name in symbols]
+        return self._symbols_addresses, self._symbols_names
+
+    def get_symbols_by_offset(self):
+        """Returns the (offset, name) symbols sorted by offset in the output
+
+        :rtype: list
+        """
+        self._get_symbols_index()
+        return list(zip(self._symbols_offsets, self._symbols_offsets_names))
+
+    def get_symbol_at(self, address):
+        """Returns the nearest (address, name) symbol at or before address
+
+        :param int address: the absolute address
+        :rtype: tuple or None
+        """
+        addresses, names = self._get_symbols_index()
+        index = bisect_right(addresses, address)
+        if index == 0:
+            return None
+        return addresses[index - 1], names[index - 1]
+
+    def get_symbols_in_range(self, start, end):
+        """Returns the (address, name) symbols between start and end (included), sorted by address
+
+        :param int start: the first absolute address
+        :param int end: the last absolute address
+        :rtype: list
+        """
+        addresses, names = self._get_symbols_index()
+        first = bisect_left(addresses, start)
+        last = bisect_right(addresses, end)
+        return list(zip(addresses[first:last], names[first:last]))
+
     def get_label_relative_address(self, label, start):
         return self.get_label_absolute_address(label) - start
 
@@ -475,6 +962,7 @@ class Assembler:
         return self.apply_math_formula(pre_formula, post_formula, self.get_label_relative_address(self.labels[name], start))
 
     def change_org(self, start, end=0):
+        self.address_dependent = True
 
         if end > 0 and end < start:
             raise AddressOverlap()
@@ -525,6 +1013,10 @@ class Assembler:
         self.defines[instr.tokens[1]] = instr.tokens[2]
 
     def append_assembled_bytes(self, blob):
+        # track which file/macro generated the bytes (for size reports)
+        if not self.spans or self.spans[-1][1:] != (self.current_context, self.current_macro):
+            self.spans.append((len(self.assembled_bytes),
+                               self.current_context, self.current_macro))
         self.assembled_bytes += blob
         self.org_counter += len(blob)
 
@@ -587,7 +1079,7 @@ class Assembler:
             elif instr.tokens[1].upper() == 'OFF':
                 self.log = False
             else:
-                InvalidArgumentsForDirective()
+                raise InvalidArgumentsForDirective(instr)
         else:
             self.log = True
 
@@ -619,6 +1111,7 @@ class Assembler:
             if value is None:
                 raise InvalidArgumentsForDirective(instr)
         blob = bytes([value] * (offset - self.pc))
+        self.address_dependent = True
         self.append_assembled_bytes(blob)
 
     def directive_upto(self, instr):
@@ -635,6 +1128,7 @@ class Assembler:
             if value is None:
                 raise InvalidArgumentsForDirective(instr)
         blob = bytes([value] * (offset - (self.pc - self.current_org)))
+        self.address_dependent = True
         self.append_assembled_bytes(blob)
 
     def directive_ram(self, instr):
@@ -653,6 +1147,7 @@ class Assembler:
             raise InvalidArgumentsForDirective(instr)
 
         mod = (self.current_org + self.org_counter) % size
+        self.address_dependent = True
         if mod != 0:
             blob = bytes([self.fill_value]) * (size - mod)
             self.append_assembled_bytes(blob)
@@ -730,19 +1225,84 @@ class Assembler:
         return value
 
     def directive_include(self, instr):
+        if len(instr.tokens) != 2:
+            raise InvalidArgumentsForDirective(instr)
+        self.include(self.stringify(instr.tokens[1]))
+
+    def directive_include_once(self, instr):
         if len(instr.tokens) != 2:
             raise InvalidArgumentsForDirective(instr)
         filename = self.stringify(instr.tokens[1])
-        with open(filename) as f:
-            self.assemble(f.read(), context=filename)
+        if os.path.realpath(self.input_path(filename)) not in self.included_files:
+            self.include(filename)
+
+    def include(self, filename):
+        """Assembles a source file, every file is read and tokenized only once per run
+
+        :param str filename: the file to include
+        """
+        path = os.path.realpath(self.input_path(filename))
+        self.included_files[path] = None
+        if path in self.include_sources:
+            self.input_files[self.input_path(filename)] = None
+        else:
+            with self.open_input(filename) as f:
+                self.include_sources[path] = f.read()
+        self._assemble_statements(self._statements(
+            self.include_sources[path], filename, token_cache=self.include_tokens), filename)
+
+    def map_file(self, filename):
+        """Returns a read-only memoryview of a file, every file is mapped only once per run
+
+        Release the view (or use it as a context manager) when done.
+
+        :param str filename: the file to map
+        :rtype: memoryview
+        """
+        filename = self.input_path(filename)
+        path = os.path.realpath(filename)
+        self.input_files[filename] = None
+        if path not in self.mapped_files:
+            with open(path, 'rb') as handle:
+                try:
+                    mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    # empty files cannot be mapped
+                    mapped = b''
+            self.mapped_files[path] = mapped
+        return memoryview(self.mapped_files[path])
+
+    def close_mapped_files(self):
+        for mapped in self.mapped_files.values():
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+        self.mapped_files = {}
 
     def directive_incbin(self, instr):
-        if len(instr.tokens) != 2:
+        if len(instr.tokens) not in (2, 3, 4, 5):
             raise InvalidArgumentsForDirective(instr)
         filename = self.stringify(instr.tokens[1])
-        with open(filename, 'rb') as f:
-            blob = f.read()
-            self.append_assembled_bytes(blob)
+        values = []
+        for token in instr.tokens[2:]:
+            value = self.parse_integer(token, 64, False)
+            if value is None:
+                raise InvalidArgumentsForDirective(instr)
+            values.append(value)
+        with self.map_file(filename) as view:
+            offset = values[0] if len(values) > 0 else 0
+            length = values[1] if len(values) > 1 else max(len(view) - offset, 0)
+            stride = values[2] if len(values) > 2 else 1
+            if stride < 1 or offset > len(view):
+                raise InvalidArgumentsForDirective(instr)
+            if length > 0 and offset + (length - 1) * stride >= len(view):
+                raise InvalidArgumentsForDirective(instr)
+            if stride == 1:
+                self.append_assembled_bytes(view[offset:offset + length])
+            else:
+                # a strided memoryview slice is copied in C
+                blob = bytearray(length)
+                blob[:] = view[offset:offset + length * stride:stride]
+                self.append_assembled_bytes(blob)
 
     def directive_section(self, instr):
         if len(instr.tokens) not in (3, 4):
@@ -772,62 +1332,221 @@ class Assembler:
         name = self.stringify(instr.tokens[1])
         if name in self.exports:
             raise SymbolAlreadyExported(instr)
-        self.exports.append(name)
+        self.exports[name] = None
+
+    def convert_asset(self, instr, filename, converter, *args):
+        """Converts an asset file, using the asset cache (if enabled)
+
+        :param statements.Directive instr: the directive requiring the asset
+        :param str filename: the asset file
+        :param callable converter: the converter (see cache.asset_converter)
+        :rtype: bytes
+        """
+        name = instr.tokens[0].lower()
+        pending = self.pending_assets.pop(
+            (name, filename, converter_id(converter), args), None)
+        if pending is not None:
+            data, future = pending
+            self.input_files[self.input_path(filename)] = None
+        else:
+            with self.open_input(filename, 'rb') as handle:
+                data = handle.read()
+        key = None
+        if self.asset_cache is not None:
+            key = self.asset_cache.key(data, name, converter, args)
+            blob = self.asset_cache.get(key)
+            if blob is not None:
+                return blob
+        try:
+            blob = None
+            if pending is not None:
+                try:
+                    blob = future.result()
+                except Exception:
+                    # run it again locally for getting a meaningful exception
+                    pass
+            if blob is None:
+                blob = converter(data, *args)
+        except AssemblerException as exc:
+            # trick for adding more infos to the exception
+            exc.args = (exc.args[0] + ' ' + str(instr),)
+            raise exc from None
+        if key is not None:
+            self.asset_cache.put(key, blob)
+        return blob
 
-    def directive_inccsv(self, instr):
-        if len(instr.tokens) != 2:
+    def prefetch_assets(self, statements):
+        """Starts the conversion of the assets required by the statements in a process pool
+
+        Results are collected (in order) by convert_asset() when the related directive is assembled.
+        Only converters defined as module functions can be run in the pool.
+
+        :param list statements: the statements to scan
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        for statement in statements:
+            if not isinstance(statement, Directive):
+                continue
+            key = statement.tokens[0][1:]
+            if not self.case_sensitive:
+                key = key.upper()
+            if key not in self.assets:
+                continue
+            # work on a copy, defines could change before the directive is assembled
+            instr = Directive(list(statement.tokens),
+                              statement.line, statement.context)
+            substitute_with_dict(instr.tokens, self.defines, 1)
+            try:
+                filename, converter, args = self.assets[key](instr)
+                if not isinstance(converter, types.FunctionType):
+                    continue
+                with open(self.input_path(filename), 'rb') as handle:
+                    data = handle.read()
+            except (AssemblerException, OSError):
+                # errors will be reported when assembling the directive
+                continue
+            name = instr.tokens[0].lower()
+            if self.asset_cache is not None and self.asset_cache.contains(
+                    self.asset_cache.key(data, name, converter, args)):
+                continue
+            pending_key = (name, filename, converter_id(converter), args)
+            if pending_key in self.pending_assets:
+                continue
+            if self.asset_pool is None:
+                self.asset_pool = ProcessPoolExecutor(self.asset_workers)
+            self.pending_assets[pending_key] = (
+                data, self.asset_pool.submit(converter, data, *args))
+
+    def shutdown_asset_pool(self):
+        if self.asset_pool is not None:
+            self.asset_pool.shutdown()
+            self.asset_pool = None
+        self.pending_assets = {}
+
+    def directive_asset(self, instr, logic):
+        filename, converter, args = logic(instr)
+        self.append_assembled_bytes(self.convert_asset(
+            instr, filename, converter, *args))
+
+    def asset_incbin_compressed(self, instr):
+        if len(instr.tokens) != 3:
             raise InvalidArgumentsForDirective(instr)
-        import csv
-        filename = self.stringify(instr.tokens[1])
-        blob = b''
-        with open(filename, 'r') as f:
-            csv_reader = csv.reader(f)
-            for row in csv_reader:
-                for column in row:
-                    value = self.parse_integer(column, 8, False)
-                    if value is None:
-                        raise LabelNotAllowed(instr)
-                    blob += bytes((value,))
+        codec = instr.tokens[2].lower()
+        if codec not in CODECS:
+            raise InvalidArgumentsForDirective(instr)
+        return self.stringify(instr.tokens[1]), convert_compressed, (codec,)
+
+    def _parse_pack_arguments(self, instr, first):
+        # [size[, le|be]] tokens shared by .inccsv and .incjson
+        size = 1
+        big_endian = self.big_endian
+        if len(instr.tokens) > first:
+            size = self.parse_integer(instr.tokens[first], 8, False)
+            if size not in PACK_TYPECODES:
+                raise InvalidArgumentsForDirective(instr)
+        if len(instr.tokens) > first + 1:
+            endianness = instr.tokens[first + 1].lower()
+            if endianness not in ('le', 'be'):
+                raise InvalidArgumentsForDirective(instr)
+            big_endian = endianness == 'be'
+        return size, big_endian
 
-        self.append_assembled_bytes(blob)
+    def asset_inccsv(self, instr):
+        # .inccsv "file"[, size[, le|be]][, columns, column...] (the keyword can be omitted after le|be)
+        if len(instr.tokens) < 2:
+            raise InvalidArgumentsForDirective(instr)
+        tokens = [token.lower() for token in instr.tokens]
+        if 'columns' in tokens:
+            keyword = tokens.index('columns')
+            if keyword > 4 or keyword + 1 == len(tokens):
+                raise InvalidArgumentsForDirective(instr)
+            pack_tokens, column_tokens = instr.tokens[0:keyword], instr.tokens[keyword + 1:]
+        else:
+            # columns after both size and endianness
+            pack_tokens, column_tokens = instr.tokens[0:4], instr.tokens[4:]
+        size, big_endian = self._parse_pack_arguments(Directive(pack_tokens, instr.line, instr.context), 2)
+        columns = []
+        for token in column_tokens:
+            column = self.parse_integer(token, 32, False)
+            if column is None:
+                raise InvalidArgumentsForDirective(instr)
+            columns.append(column)
+        return self.stringify(instr.tokens[1]), self._convert_csv, (size, big_endian, tuple(columns))
 
-    def directive_inccsv_le16(self, instr):
+    def asset_inccsv_le16(self, instr):
         if len(instr.tokens) != 2:
             raise InvalidArgumentsForDirective(instr)
-        import csv
-        filename = self.stringify(instr.tokens[1])
-        blob = b''
-        with open(filename, 'r') as f:
-            csv_reader = csv.reader(f)
-            for row in csv_reader:
-                for column in row:
-                    value = self.parse_integer(column, 16, False)
+        return self.stringify(instr.tokens[1]), self._convert_csv, (2, False, ())
+
+    def _pack_values(self, values, size, big_endian):
+        # a whole row/list is converted in C, parse_integer() is used only
+        # for rows with non decimal (or out of range) values
+        packed = array(PACK_TYPECODES[size])
+        # int() is applied only to strings (CSV cells), it would truncate floats
+        types = set(map(type, values))
+        try:
+            if types == {str}:
+                packed.extend(array(packed.typecode, map(int, values)))
+            elif types - {int}:
+                # floats, booleans and nested values (JSON) are rejected by the slow path
+                raise TypeError()
+            else:
+                packed.extend(array(packed.typecode, values))
+        except (ValueError, TypeError, OverflowError):
+            parsed = []
+            for value in values:
+                if isinstance(value, str):
+                    value = self.parse_integer(value, size * 8, False)
                     if value is None:
-                        raise LabelNotAllowed(instr)
-                    blob += pack_le16u(value)
-
-        self.append_assembled_bytes(blob)
-
-    def directive_incjson(self, instr):
-        if len(instr.tokens) != 3:
+                        raise LabelNotAllowed()
+                elif not isinstance(value, int) or isinstance(value, bool):
+                    raise InvalidArgumentsForDirective(value)
+                elif not in_bit_range(value, size * 8):
+                    raise NotInBitRange(value, size * 8)
+                parsed.append(value)
+            packed.extend(parsed)
+        if big_endian != (sys.byteorder == 'big'):
+            packed.byteswap()
+        return packed
+
+    @asset_converter(2)
+    def _convert_csv(self, data, size, big_endian, columns):
+        import csv
+        import io
+        chunks = []
+        # rows are decoded and packed one by one (no decoded copy of the whole file)
+        csv_reader = csv.reader(io.TextIOWrapper(io.BytesIO(data), newline=''))
+        for row in csv_reader:
+            # empty lines are skipped before selecting columns
+            if not any([cell.strip() for cell in row]):
+                continue
+            if columns:
+                try:
+                    row = [row[column] for column in columns]
+                except IndexError:
+                    raise InvalidArgumentsForDirective() from None
+            # empty cells (like trailing commas) are ignored
+            row = [column for column in row if column.strip()]
+            chunks.append(self._pack_values(row, size, big_endian).tobytes())
+        return b''.join(chunks)
+
+    def asset_incjson(self, instr):
+        if len(instr.tokens) < 3:
             raise InvalidArgumentsForDirective(instr)
-        import json
-        filename = self.stringify(instr.tokens[1])
-        key = self.stringify(instr.tokens[2])
-        blob = b''
-        with open(filename, 'rb') as f:
-            parsed = json.load(f)
-            keys = key.split('.')
-            for key_part in keys:
-                parsed = parsed[key_part]
-            for item in parsed:
-                if not isinstance(item, int):
-                    item = self.parse_integer(item, 8, False)
-                    if item is None:
-                        raise LabelNotAllowed(instr)
-                blob += bytes((item,))
+        size, big_endian = self._parse_pack_arguments(instr, 3)
+        if len(instr.tokens) > 5:
+            raise InvalidArgumentsForDirective(instr)
+        return (self.stringify(instr.tokens[1]), self._convert_json,
+                (self.stringify(instr.tokens[2]), size, big_endian))
 
-        self.append_assembled_bytes(blob)
+    @asset_converter(2)
+    def _convert_json(self, data, key, size=1, big_endian=False):
+        import json
+        parsed = json.loads(data)
+        keys = key.split('.')
+        for key_part in keys:
+            parsed = parsed[key_part]
+        return self._pack_values(parsed, size, big_endian).tobytes()
 
     def _get_math_formula(self, token):
         pre_formula = ''
@@ -869,6 +1588,14 @@ class Assembler:
             key = key.upper()
         self.directives[key] = logic
 
+    def register_asset(self, name, logic):
+        key = name
+        if not self.case_sensitive:
+            key = key.upper()
+        self.assets[key] = logic
+        self.register_directive(
+            name, lambda instr: self.directive_asset(instr, logic))
+
     def register_define(self, name, value):
         if not is_valid_name(name):
             raise InvalidDefine()
@@ -878,16 +1605,106 @@ class Assembler:
     def main(cls, pre_link_passes=[], post_link_passes=[], linker=None):
         import sys
         import os
-        try:
-            *sources, destination = sys.argv[1:]
-        except ValueError:
-            print('usage: {0} <sources> <destination>'.format(
-                os.path.basename(sys.argv[0])))
-            return
+        import argparse
+        parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]))
+        parser.add_argument('sources', nargs='+', help='assembly source files')
+        parser.add_argument('destination', help='output file')
+        parser.add_argument('--size-report', metavar='FILE',
+                            help='write the size attribution report to FILE (JSON if ending with .json)')
+        parser.add_argument('--symbols', metavar='FILE',
+                            help='write the symbols map to FILE (JSON if ending with .json, CSV otherwise)')
+        parser.add_argument('--asset-cache', metavar='DIR',
+                            help='cache converted assets (images, csv, json...) in DIR')
+        parser.add_argument('-j', '--jobs', type=int, default=0, metavar='N',
+                            help='convert assets using N processes')
+        parser.add_argument('-c', '--compile', action='store_true',
+                            help='generate an object file (to be linked with necro_link) instead of the final output')
+        parser.add_argument('-MD', dest='depfile', action='store_const', const='',
+                            help='write the dependency file (for make and ninja) to the destination with .d extension')
+        parser.add_argument('--depfile', metavar='FILE',
+                            help='write the dependency file (for make and ninja) to FILE')
+        parser.add_argument('--cache', metavar='DIR',
+                            help='reuse the outputs of previous builds with the same inputs stored in DIR')
+        parser.add_argument('--cache-size', type=int, default=1024, metavar='MB',
+                            help='maximum size of the build cache (default 1024)')
+        parser.add_argument('--watch', action='store_true',
+                            help='build again every time one of the files read by the build changes')
+        args = parser.parse_args(sys.argv[1:])
         asm = cls()
         asm.pre_link_passes += pre_link_passes
         asm.post_link_passes += post_link_passes
-        for source in sources:
-            asm.assemble_file(source)
-        asm.link(linker=linker)
-        asm.save(destination)
+        if args.asset_cache:
+            asm.asset_cache = AssetCache(args.asset_cache)
+        asm.asset_workers = args.jobs
+        if args.watch:
+            import copy
+            from necroassembler.watch import watch
+            # linkers keep the state of the previous link
+            watch(asm, lambda: cls._build(asm, args, copy.deepcopy(linker)))
+            return
+        build_cache = None
+        if args.cache:
+            build_cache = BuildCache(args.cache, args.cache_size * 1024 * 1024)
+            build_key = build_cache.key(asm, sys.argv[1:])
+            inputs = build_cache.restore(build_key)
+            if inputs is not None:
+                print(build_cache.stats())
+                cls._write_depfile(args, inputs)
+                return
+        outputs = cls._build(asm, args, linker)
+        if build_cache is not None:
+            build_cache.store(build_key, asm.input_files, outputs)
+            print(build_cache.stats())
+        if asm.asset_cache is not None:
+            print(asm.asset_cache.stats())
+        if asm.trace is not None:
+            asm.trace.dump()
+
+    @classmethod
+    def _build(cls, asm, args, linker):
+        try:
+            for source in args.sources:
+                asm.assemble_file(source)
+        finally:
+            asm.shutdown_asset_pool()
+            asm.close_mapped_files()
+        if args.compile:
+            from necroassembler.objects import save_object
+            save_object(asm, args.destination)
+            outputs = [args.destination]
+        else:
+            outputs = asm.write_outputs(args.destination, args.size_report, args.symbols, linker)
+        cls._write_depfile(args, asm.input_files)
+        return outputs
+
+    @staticmethod
+    def _write_depfile(args, inputs):
+        if args.depfile is None:
+            return
+        from necroassembler.depfile import write_depfile
+        write_depfile(args.depfile or os.path.splitext(args.destination)[0] + '.d',
+                      args.destination, inputs)
+
+    def write_outputs(self, destination, size_report=None, symbols=None, linker=None):
+        """Links the assembled code and writes the output file, the optional reports and the symbols files
+
+        :param str destination: the output file
+        :param str size_report: the size report file (or None)
+        :param str symbols: the generic symbols map file (or None)
+        :param linker: the linker (None for the Dummy one)
+        :return: the written files
+        :rtype: list
+        """
+        outputs = []
+        if size_report:
+            from necroassembler.report import write_size_report
+            write_size_report(self, size_report)
+            outputs.append(size_report)
+        self.link_to_file(destination, linker=linker)
+        outputs.append(destination)
+        from necroassembler.symbols import export_symbols, map_writer
+        writers = self.symbol_writers(destination)
+        if symbols:
+            writers.append(map_writer(symbols))
+        export_symbols(self, writers)
+        return outputs + [writer.filename for writer in writers]
@@ -0,0 +1,355 @@
+'''Caches for converted assets, tokenized code and whole builds'''
+import os
+import sys
+import json
+import hashlib
+import tempfile
+from abc import ABC, abstractmethod
+from necroassembler.tokenizer import Tokenizer
+
+# default size limit of the build cache
+BUILD_CACHE_SIZE = 1024 * 1024 * 1024
+
+
+def asset_converter(version):
+    """Marks a function as an asset converter
+
+    Converters receive the content of the asset file followed by the
+    directive arguments and return the bytes to assemble.
+    Bump the version whenever the output of the converter changes,
+    so that old cache entries are ignored.
+
+    :param int version: the version of the converter
+    """
+    def wrapper(f):
+        f.converter_version = version
+        return f
+    return wrapper
+
+
+def write_atomic(path, blob):
+    """Writes a file using a temporary file and a rename, so concurrent builds never see a partial file
+
+    :param str path: the destination file
+    :param bytes blob: the content
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as tmp:
+            tmp.write(blob)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def file_digest(filename):
+    """Returns the sha256 of the content of a file
+
+    :param str filename: the file
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def converter_id(converter):
+    """Returns a string identifying a converter (bound methods include the class of the instance)
+
+    :param callable converter: the converter
+    :rtype: str
+    """
+    name = '{0}.{1}'.format(converter.__module__, converter.__qualname__)
+    if hasattr(converter, '__self__'):
+        owner = type(converter.__self__)
+        name += '@{0}.{1}'.format(owner.__module__, owner.__qualname__)
+    return '{0}:{1}'.format(name, getattr(converter, 'converter_version', 0))
+
+
+class BaseAssetCache(ABC):
+    '''Base class of the asset caches, converted assets are keyed by content hash and conversion parameters'''
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, data, name, converter, args):
+        """Builds the cache key of an asset
+
+        :param bytes data: the content of the asset file
+        :param str name: the directive name
+        :param callable converter: the converter
+        :param tuple args: the converter arguments
+        :rtype: str
+        """
+        digest = hashlib.sha256(data)
+        digest.update(repr((name, converter_id(converter), args)).encode())
+        return digest.hexdigest()
+
+    @abstractmethod
+    def contains(self, key):
+        """Checks if a converted asset is in the cache
+
+        :param str key: the cache key
+        :rtype: bool
+        """
+
+    @abstractmethod
+    def get(self, key):
+        """Returns a converted asset (or None), updating hits and misses
+
+        :param str key: the cache key
+        :rtype: bytes
+        """
+
+    @abstractmethod
+    def put(self, key, blob):
+        """Stores a converted asset
+
+        :param str key: the cache key
+        :param bytes blob: the converted asset
+        """
+
+    def stats(self):
+        return 'asset cache: {0} hits, {1} misses'.format(self.hits, self.misses)
+
+
+class AssetCache(BaseAssetCache):
+    '''Stores converted assets in a directory'''
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[0:2], key)
+
+    def contains(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as handle:
+                blob = handle.read()
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return blob
+
+    def put(self, key, blob):
+        write_atomic(self._path(key), blob)
+
+
+class MemoryAssetCache(BaseAssetCache):
+    '''Keeps converted assets in memory (for long running processes, like the watch mode)'''
+
+    def __init__(self):
+        super().__init__()
+        self.blobs = {}
+
+    def contains(self, key):
+        return key in self.blobs
+
+    def get(self, key):
+        if key not in self.blobs:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.blobs[key]
+
+    def put(self, key, blob):
+        self.blobs[key] = blob
+
+
+class TokenCache:
+    '''Keeps the tokenized statements of source code, so unchanged code is not tokenized again'''
+
+    def __init__(self):
+        self.entries = {}
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+
+    def tokenize(self, code, context=None, line=1):
+        """Returns new statements for the code
+
+        :param str code: the source code
+        :param str context: the context of the statements
+        :param int line: the line number of the first line of code
+        :rtype: list
+        """
+        key = (context, line, code)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            tokenizer = Tokenizer(context=context)
+            tokenizer.line = line
+            tokenizer.parse(code)
+            entry = [(type(statement), tuple(statement.tokens), statement.line)
+                     for statement in tokenizer.statements]
+            self.entries[key] = entry
+        else:
+            self.hits += 1
+        self.used.add(key)
+        # tokens are modified while assembling (defines), always build new statements
+        return [cls(list(tokens), line, context) for cls, tokens, line in entry]
+
+    def prune(self):
+        """Removes the code not tokenized since the previous call"""
+        self.entries = {key: self.entries[key] for key in self.used}
+        self.used = set()
+
+    def stats(self):
+        return 'token cache: {0} hits, {1} misses'.format(self.hits, self.misses)
+
+
+class BuildCache:
+    '''Stores the outputs of whole builds in a directory
+
+    Builds are looked up in two steps: a manifest, keyed by the assembler
+    code, the command line arguments and the defines, lists the input
+    files (with their content hash) read by previous builds and the
+    content hash of their outputs, that are stored only once in the objects
+    directory. Least recently used files are removed when the directory
+    grows over max_size. Files are written atomically and a file removed by a
+    concurrent build is just a cache miss.
+    '''
+
+    # entries (different inputs) stored for each manifest
+    max_entries = 16
+
+    def __init__(self, directory, max_size=BUILD_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, assembler, args):
+        """Builds the manifest key of a build
+
+        :param assembler.Assembler assembler: the (not yet used) assembler
+        :param list args: the command line arguments
+        :rtype: str
+        """
+        import necroassembler
+        digest = hashlib.sha256()
+        digest.update(repr((necroassembler.__version__, args,
+                            sorted(assembler.defines.items()))).encode())
+        # the installed version does not change with development checkouts,
+        # so the code of the assembler is part of the key too
+        modules = set([cls.__module__ for cls in type(assembler).__mro__])
+        modules.update([name for name in sys.modules if name.split('.')[0] == 'necroassembler'])
+        for name in sorted(modules):
+            filename = getattr(sys.modules.get(name), '__file__', None)
+            if filename:
+                digest.update(name.encode())
+                digest.update(file_digest(filename).encode())
+        return digest.hexdigest()
+
+    def _path(self, kind, key):
+        return os.path.join(self.directory, kind, key[0:2], key)
+
+    def _read(self, path):
+        with open(path, 'rb') as handle:
+            blob = handle.read()
+        # refresh the LRU time
+        os.utime(path)
+        return blob
+
+    def _load_manifest(self, key):
+        try:
+            return json.loads(self._read(self._path('manifests', key)).decode())
+        except (OSError, ValueError):
+            return []
+
+    def restore(self, key):
+        """Copies the outputs of a previous build with the same inputs
+
+        :param str key: the manifest key
+        :return: the input files of the build (None on cache miss)
+        :rtype: list
+        """
+        digests = {}
+        for entry in self._load_manifest(key):
+            try:
+                for filename, digest in entry['inputs']:
+                    if filename not in digests:
+                        digests[filename] = file_digest(filename)
+                    if digests[filename] != digest:
+                        break
+                else:
+                    blobs = [(filename, self._read(self._path('objects', digest)))
+                             for filename, digest in entry['outputs']]
+                    for filename, blob in blobs:
+                        with open(filename, 'wb') as handle:
+                            handle.write(blob)
+                    self.hits += 1
+                    return [filename for filename, _ in entry['inputs']]
+            except OSError:
+                # missing input file or evicted object
+                continue
+        self.misses += 1
+        return None
+
+    def store(self, key, inputs, outputs):
+        """Records a build
+
+        :param str key: the manifest key
+        :param list inputs: the files read by the build
+        :param list outputs: the files generated by the build
+        """
+        entry = {'inputs': [[filename, file_digest(filename)] for filename in inputs],
+                 'outputs': []}
+        for filename in outputs:
+            with open(filename, 'rb') as handle:
+                blob = handle.read()
+            digest = hashlib.sha256(blob).hexdigest()
+            path = self._path('objects', digest)
+            if os.path.exists(path):
+                os.utime(path)
+            else:
+                write_atomic(path, blob)
+            entry['outputs'].append([filename, digest])
+        entries = [entry] + [old for old in self._load_manifest(key) if old['inputs'] != entry['inputs']]
+        write_atomic(self._path('manifests', key),
+                     json.dumps(entries[0:self.max_entries]).encode())
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used files until the cache is smaller than max_size"""
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.startswith('.'):
+                    # temporary files of running builds
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_size:
+            return
+        files.sort()
+        for _, size, path in files:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+            if total <= self.max_size:
+                break
+
+    def stats(self):
+        return 'build cache: {0} hits, {1} misses'.format(self.hits, self.misses)
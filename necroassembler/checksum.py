@@ -0,0 +1,115 @@
+'''Incremental checksums of the assembled bytes (used by post link passes)'''
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BLOCK_SIZE = 0x4000
+
+
+def _sum8(view):
+    if numpy is not None:
+        return int(numpy.frombuffer(view, dtype=numpy.uint8).sum(dtype=numpy.uint64))
+    return sum(view)
+
+
+def _sum16_be(view):
+    if len(view) % 2:
+        view = bytes(view) + b'\x00'
+    if numpy is not None:
+        return int(numpy.frombuffer(view, dtype='>u2').sum(dtype=numpy.uint64))
+    words = array('H')
+    words.frombytes(view)
+    if sys.byteorder != 'big':
+        words.byteswap()
+    return sum(words)
+
+
+class Checksum:
+    '''Sums of a buffer, computed per block and cached until the block is modified
+
+    Modify the buffer with write() (or call invalidate() after changing it
+    directly), so that only the dirty blocks are summed again.
+    Ranges passed to the 16 bit functions must start at an even offset.
+    '''
+
+    def __init__(self, buffer, block_size=BLOCK_SIZE):
+        self.buffer = buffer
+        self.block_size = block_size
+        self.size = len(buffer)
+        self.blocks = {}
+
+    def invalidate(self, start=0, end=None):
+        """Marks a range of the buffer as modified
+
+        :param int start: the first modified offset
+        :param int end: the end (exclusive) of the modified range (None for the end of the buffer)
+        """
+        if end is None:
+            end = max(len(self.buffer), self.size)
+        first = start // self.block_size
+        last = (end - 1) // self.block_size
+        for key in list(self.blocks):
+            if first <= key[1] <= last:
+                del self.blocks[key]
+
+    def write(self, offset, blob):
+        """Patches the buffer and invalidates the modified blocks
+
+        :param int offset: the offset in the buffer
+        :param bytes blob: the new bytes
+        """
+        if offset < 0 or offset + len(blob) > len(self.buffer):
+            raise IndexError('checksum write outside of the buffer')
+        self.buffer[offset:offset + len(blob)] = blob
+        self.invalidate(offset, offset + len(blob))
+
+    def _check_size(self):
+        if len(self.buffer) != self.size:
+            # the last (partial) block and everything after it changed
+            self.invalidate(min(len(self.buffer), self.size) // self.block_size * self.block_size)
+            self.size = len(self.buffer)
+
+    def _sum(self, function, start, end):
+        self._check_size()
+        if end is None:
+            end = len(self.buffer)
+        total = 0
+        with memoryview(self.buffer) as view:
+            while start < end:
+                index = start // self.block_size
+                block_start = index * self.block_size
+                block_end = min(block_start + self.block_size, len(self.buffer))
+                if start == block_start and end >= block_end:
+                    key = (function, index)
+                    if key not in self.blocks:
+                        self.blocks[key] = function(view[block_start:block_end])
+                    total += self.blocks[key]
+                    start = block_end
+                else:
+                    # partial block, not cached
+                    partial_end = min(end, block_start + self.block_size)
+                    total += function(view[start:partial_end])
+                    start = partial_end
+        return total
+
+    def sum8(self, start=0, end=None):
+        """Returns the sum of the bytes in a range
+
+        :param int start: the first offset
+        :param int end: the end (exclusive) of the range (None for the end of the buffer)
+        :rtype: int
+        """
+        return self._sum(_sum8, start, end)
+
+    def sum16_be(self, start=0, end=None):
+        """Returns the sum of the big endian 16 bit words in a range (a trailing odd byte is the high part of a word)
+
+        :param int start: the first offset (must be even)
+        :param int end: the end (exclusive) of the range (None for the end of the buffer)
+        :rtype: int
+        """
+        return self._sum(_sum16_be, start, end)
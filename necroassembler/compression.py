@@ -0,0 +1,229 @@
+'''Data compression codecs for the .incbin_compressed directive'''
+from necroassembler.cache import asset_converter
+from necroassembler.exceptions import DataTooLargeForCodec
+
+# maximum number of previous occurrences checked for each match
+MAX_CHAIN = 256
+
+
+def _lz_tokens(data, min_distance, max_distance, max_length):
+    # greedy LZ parsing, previous occurrences of each 3 bytes
+    # sequence are tracked with hash chains
+    # yields (length, distance) for matches and (0, byte) for literals
+    data = bytes(data)
+    chains = {}
+    position = 0
+    size = len(data)
+    while position < size:
+        best_length = 0
+        best_distance = 0
+        limit = min(max_length, size - position)
+        if limit >= 3:
+            candidates = chains.get(data[position:position + 3], ())
+            for candidate in reversed(candidates[-MAX_CHAIN:]):
+                distance = position - candidate
+                if distance > max_distance:
+                    break
+                if distance < min_distance:
+                    continue
+                length = 3
+                while length < limit and data[candidate + length] == data[position + length]:
+                    length += 1
+                if length > best_length:
+                    best_length = length
+                    best_distance = distance
+                    if length == limit:
+                        break
+        step = best_length if best_length >= 3 else 1
+        for index in range(position, min(position + step, size - 2)):
+            chains.setdefault(data[index:index + 3], []).append(index)
+        if step > 1:
+            yield best_length, best_distance
+        else:
+            yield 0, data[position]
+        position += step
+
+
+def _gba_header(codec_type, data):
+    if len(data) > 0xFFFFFF:
+        raise DataTooLargeForCodec()
+    return bytearray((codec_type, len(data) & 0xFF, (len(data) >> 8) & 0xFF, len(data) >> 16))
+
+
+def _pad32(blob):
+    blob.extend(bytes(-len(blob) % 4))
+    return bytes(blob)
+
+
+def _pack_flagged(tokens, literal_flag, msb_first, pack_match):
+    # groups tokens in blocks of 8, each block is preceded by a flags byte
+    blob = bytearray()
+    flags_offset = 0
+    bit = 8
+    for length, value in tokens:
+        if bit == 8:
+            flags_offset = len(blob)
+            blob.append(0)
+            bit = 0
+        is_flagged = (length == 0) == literal_flag
+        if is_flagged:
+            blob[flags_offset] |= (0x80 >> bit) if msb_first else (1 << bit)
+        bit += 1
+        if length == 0:
+            blob.append(value)
+        else:
+            blob.extend(pack_match(length, value))
+    return blob
+
+
+def compress_lz77_gba(data):
+    """Compresses data in the GBA BIOS LZ77 format (LZ77UnCompVram compatible)
+
+    :param bytes data: the data to compress
+    :rtype: bytes
+    """
+    blob = _gba_header(0x10, data)
+    # distance 1 is not allowed by the 16 bit VRAM writes
+    tokens = _lz_tokens(data, 2, 0x1000, 18)
+    blob += _pack_flagged(tokens, False, True, lambda length, distance: (
+        ((length - 3) << 4) | ((distance - 1) >> 8), (distance - 1) & 0xFF))
+    return _pad32(blob)
+
+
+def decompress_lz77_gba(blob):
+    size = int.from_bytes(blob[1:4], 'little')
+    data = bytearray()
+    position = 4
+    while len(data) < size:
+        flags = blob[position]
+        position += 1
+        for bit in range(0, 8):
+            if len(data) >= size:
+                break
+            if flags & (0x80 >> bit):
+                length = (blob[position] >> 4) + 3
+                distance = (((blob[position] & 0x0F) << 8) | blob[position + 1]) + 1
+                position += 2
+                for _ in range(0, length):
+                    data.append(data[-distance])
+            else:
+                data.append(blob[position])
+                position += 1
+    return bytes(data)
+
+
+def compress_rle_gba(data):
+    """Compresses data in the GBA BIOS RLE format (RLUnCompVram compatible)
+
+    :param bytes data: the data to compress
+    :rtype: bytes
+    """
+    blob = _gba_header(0x30, data)
+    literals = bytearray()
+
+    def _flush():
+        if literals:
+            blob.append(len(literals) - 1)
+            blob.extend(literals)
+            literals.clear()
+
+    position = 0
+    size = len(data)
+    while position < size:
+        run = 1
+        while run < 130 and position + run < size and data[position + run] == data[position]:
+            run += 1
+        if run >= 3:
+            _flush()
+            blob.append(0x80 | (run - 3))
+            blob.append(data[position])
+            position += run
+            continue
+        literals.append(data[position])
+        position += 1
+        if len(literals) == 128:
+            _flush()
+    _flush()
+    return _pad32(blob)
+
+
+def decompress_rle_gba(blob):
+    size = int.from_bytes(blob[1:4], 'little')
+    data = bytearray()
+    position = 4
+    while len(data) < size:
+        flag = blob[position]
+        if flag & 0x80:
+            data.extend(blob[position + 1:position + 2] * ((flag & 0x7F) + 3))
+            position += 2
+        else:
+            data.extend(blob[position + 1:position + 2 + (flag & 0x7F)])
+            position += 2 + (flag & 0x7F)
+    return bytes(data[:size])
+
+
+def compress_lzss(data):
+    """Compresses data in a simple LZSS format suitable for 8 bit decompressors
+
+    The stream starts with the uncompressed size (16 bit little endian),
+    followed by blocks of 8 items each preceded by a flags byte (LSB first,
+    1 for literal bytes, 0 for matches). Matches are 2 bytes: the low 8 bits
+    of distance - 1, then the high 4 bits of distance - 1 ORed with
+    (length - 3) << 4.
+
+    :param bytes data: the data to compress
+    :rtype: bytes
+    """
+    if len(data) > 0xFFFF:
+        raise DataTooLargeForCodec()
+    blob = bytearray((len(data) & 0xFF, len(data) >> 8))
+    tokens = _lz_tokens(data, 1, 0x1000, 18)
+    blob += _pack_flagged(tokens, True, False, lambda length, distance: (
+        (distance - 1) & 0xFF, ((distance - 1) >> 8) | ((length - 3) << 4)))
+    return bytes(blob)
+
+
+def decompress_lzss(blob):
+    size = blob[0] | (blob[1] << 8)
+    data = bytearray()
+    position = 2
+    while len(data) < size:
+        flags = blob[position]
+        position += 1
+        for bit in range(0, 8):
+            if len(data) >= size:
+                break
+            if flags & (1 << bit):
+                data.append(blob[position])
+                position += 1
+            else:
+                distance = (blob[position] | ((blob[position + 1] & 0x0F) << 8)) + 1
+                length = (blob[position + 1] >> 4) + 3
+                position += 2
+                for _ in range(0, length):
+                    data.append(data[-distance])
+    return bytes(data)
+
+
+CODECS = {'lz77': compress_lz77_gba, 'rle': compress_rle_gba, 'lzss': compress_lzss}
+DECOMPRESSORS = {'lz77': decompress_lz77_gba, 'rle': decompress_rle_gba, 'lzss': decompress_lzss}
+
+
+def register_codec(name, compress, decompress=None):
+    """Adds a codec for .incbin_compressed
+
+    Codecs are looked up by name in worker processes too, so register
+    them at import time of the module defining the assembler.
+
+    :param str name: the name used in the directive
+    :param callable compress: function taking bytes and returning the compressed bytes
+    :param callable decompress: the inverse function (optional)
+    """
+    CODECS[name] = compress
+    if decompress is not None:
+        DECOMPRESSORS[name] = decompress
+
+
+@asset_converter(1)
+def convert_compressed(data, codec):
+    return CODECS[codec](data)
@@ -1,5 +1,5 @@
 from necroassembler import Assembler, opcode
-from necroassembler.utils import pack_bits, pack_le32u, pack_be32u
+from necroassembler.utils import pack_bits, pack_le32u, pack_be32u, LabelFilter
 from necroassembler.exceptions import LabelNotAllowed, NotInBitRange
 
 REGS_BASE = ('$0', '$1', '$2', '$3', '$4', '$5',
@@ -56,15 +56,14 @@ class AssemblerMIPS32(Assembler):
         return self.parse_integer_or_label(label=token,
                                            bits=(25, 0),
                                            bits_size=32,
-                                           filter=lambda x: (
-                                               x & 0x0fffffff) >> 2,
+                                           filter=LabelFilter(2, 0x03ffffff),
                                            size=4) >> 2
 
     def _rel_label(self, token):
         return self.parse_integer_or_label(label=token,
                                            bits_size=18,
                                            bits=(15, 0),
-                                           filter=lambda x: x >> 2,
+                                           filter=LabelFilter(2),
                                            relative=self.pc + 4,
                                            size=4) >> 2
 
@@ -74,14 +73,14 @@ class AssemblerMIPS32(Assembler):
                                                bits_size=32,
                                                bits=(15, 0),
                                                size=4,
-                                               filter=lambda x: x >> 16) >> 16
+                                               filter=LabelFilter(16)) >> 16
 
         def _low(token):
             return self.parse_integer_or_label(label=token,
                                                bits_size=32,
                                                bits=(15, 0),
                                                size=4,
-                                               filter=lambda x: x & 0xFFFF) & 0xFFFF
+                                               filter=LabelFilter(0, 0xFFFF)) & 0xFFFF
         if high:
             return _high
         return _low
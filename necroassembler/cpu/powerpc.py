@@ -1,5 +1,5 @@
 from necroassembler import Assembler
-from necroassembler.utils import pack_be32u, pack_bits
+from necroassembler.utils import pack_be32u, pack_bits, LabelFilter
 
 GREGS = tuple(['r{0}'.format(n) for n in range(0, 32)])
 FREGS = tuple(['f{0}'.format(n) for n in range(0, 32)])
@@ -39,7 +39,7 @@ def _pcrel(token, assembler=None, bits=None):
                                                 bits_size=(
                                                     bits[0] - bits[1] + 1),
                                                 bits=bits,
-                                                filter=lambda x: x >> 2,
+                                                filter=LabelFilter(2),
                                                 relative=assembler.pc)
 
     return token not in GREGS+FREGS
@@ -52,7 +52,7 @@ def _baddr(token, assembler=None, bits=None):
                                                 bits_size=(
                                                     bits[0] - bits[1] + 1),
                                                 bits=bits,
-                                                filter=lambda x: x >> 2)
+                                                filter=LabelFilter(2))
     return token not in GREGS+FREGS
 
 
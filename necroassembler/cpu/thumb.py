@@ -1,5 +1,5 @@
 from necroassembler import Assembler, opcode
-from necroassembler.utils import pack_bits_le16u, pack_le16u, pack_bit
+from necroassembler.utils import pack_bits_le16u, pack_le16u, pack_bit, LabelFilter
 from necroassembler.exceptions import (
     AssemblerException, InvalidRegister, UnknownRegister, InvalideImmediateValue, NotInBitRange)
 
@@ -62,8 +62,7 @@ class AssemblerThumb(Assembler):
                                            bits_size=(
                                                bits[0] - bits[1]) + 1 + (alignment//2),
                                            bits=bits,
-                                           filter=lambda x: x >> (
-                                               alignment//2),
+                                           filter=LabelFilter(alignment // 2),
                                            alignment=alignment,
                                            relative=self.pc + 4)
 
@@ -79,7 +78,7 @@ class AssemblerThumb(Assembler):
                                            bits_size=8,
                                            bits=(7, 0),
                                            alignment=4,
-                                           filter=lambda x: x >> 2,
+                                           filter=LabelFilter(2),
                                            # bit 1 of pc must be turned off
                                            relative=(self.pc + 4) & ~(0b10))
 
@@ -382,7 +381,7 @@ class AssemblerThumb(Assembler):
                                    alignment=2,
                                    relative=self.pc + 4,
                                    # get high 11 bits (after >> 1)
-                                   filter=lambda x: x >> 12)
+                                   filter=LabelFilter(12))
         self.add_label_translation(label=offset,
                                    offset=2,
                                    size=2,
@@ -391,7 +390,7 @@ class AssemblerThumb(Assembler):
                                    alignment=2,
                                    relative=self.pc + 4,
                                    # get low 11 bits (after >> 1)
-                                   filter=lambda x: ((x >> 1) & 0x7FF))
+                                   filter=LabelFilter(1, 0x7FF))
 
         return pack_le16u(0b1111000000000000, 0b1111100000000000)
 
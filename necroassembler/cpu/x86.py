@@ -464,7 +464,7 @@ def _Jvds(instr, base, assembler, index, modrm):
             return 1, base, pack_le32u(assembler.parse_integer_or_label(
                 instr.tokens[index],
                 relative=assembler.pc + len(base) + 4,
-                size=2, bits_size=16, offset=len(base)))
+                size=4, bits_size=32, offset=len(base)))
 
 
 def _Eq(instr, base, assembler, index, modrm):
@@ -0,0 +1,45 @@
+'''Makefile/Ninja dependency files (the files read for building an output)'''
+
+
+def escape_path(path):
+    """Escapes a path for the make syntax (also understood by ninja)
+
+    :param str path: the path
+    :rtype: str
+    """
+    escaped = ''
+    for char in path:
+        if char in ' #\\':
+            escaped += '\\'
+        elif char == '$':
+            escaped += '$'
+        escaped += char
+    return escaped
+
+
+def format_depfile(target, dependencies):
+    """Builds the content of a dependency file
+
+    Every dependency gets an empty rule too (like gcc -MP),
+    so that removed files do not break the build.
+
+    :param str target: the generated file
+    :param list dependencies: the files read for generating it
+    :rtype: str
+    """
+    dependencies = [escape_path(dependency) for dependency in dependencies]
+    lines = [' \\\n  '.join([escape_path(target) + ':'] + dependencies)]
+    for dependency in dependencies:
+        lines.append('\n' + dependency + ':')
+    return '\n'.join(lines) + '\n'
+
+
+def write_depfile(filename, target, dependencies):
+    """Saves a dependency file
+
+    :param str filename: the dependency file
+    :param str target: the generated file
+    :param list dependencies: the files read for generating it
+    """
+    with open(filename, 'w') as handle:
+        handle.write(format_depfile(target, dependencies))
@@ -80,6 +80,18 @@ class NotInRepeatMode(AssemblerException):
     message = 'not in repeat mode'
 
 
+class NotInConditionalBlock(AssemblerException):
+    message = 'not in a conditional block (or .else already used)'
+
+
+class UnterminatedConditionalBlock(AssemblerException):
+    message = 'conditional block without .endif'
+
+
+class ConditionalNotAllowedInMacro(AssemblerException):
+    message = 'conditional directive not allowed in macro'
+
+
 class UnknownRegister(AssemblerException):
     message = 'unknown cpu register'
 
@@ -122,3 +134,11 @@ class InvalidDefine(AssemblerException):
 
 class LabelNotAllowed(AssemblerException):
     message = 'label not allowed here'
+
+
+class TooManyTiles(AssemblerException):
+    message = 'too many unique tiles for the tilemap format'
+
+
+class DataTooLargeForCodec(AssemblerException):
+    message = 'data too large for the compression format'
@@ -1,28 +1,126 @@
-from necroassembler.utils import pack
+import os
+from bisect import bisect_right
+from necroassembler.utils import pack, LabelFilter
 from necroassembler.exceptions import UnknownLabel, AssemblerException
 
 
 class RelocationNotImplemented(AssemblerException):
-    message = 'please subclass the ELF class and implement the \'relocate\' method'
+    message = 'relocation not supported (subclass the ELF class and override the \'relocate\' method)'
 
 
 class Dummy:
     def resolve_unknown_symbol(self, assembler, address, symbol_data):
         raise UnknownLabel(symbol_data.label)
 
+    def resolve_symbol(self, assembler, address, symbol_data, value):
+        return value
+
     def link(self, assembler):
         return assembler.assembled_bytes
 
 
+SHT_PROGBITS = 0x01
+SHT_SYMTAB = 0x02
+SHT_STRTAB = 0x03
+SHT_RELA = 0x04
+SHT_HASH = 0x05
+SHT_NOBITS = 0x08
+SHT_REL = 0x09
+SHT_GNU_HASH = 0x6ffffff6
+SHN_ABS = 0xfff1
+
+# machine -> (uses .rela, {(relative, size, bits, filter shift, filter mask): (type, field offset)})
+RELOCATION_TYPES = {
+    # i386
+    0x03: (False, {
+        (False, 4, None, 0, None): (1, 0),  # R_386_32
+        (True, 4, None, 0, None): (2, 0),  # R_386_PC32
+        (False, 2, None, 0, None): (20, 0),  # R_386_16
+        (True, 2, None, 0, None): (21, 0),  # R_386_PC16
+        (False, 1, None, 0, None): (22, 0),  # R_386_8
+        (True, 1, None, 0, None): (23, 0),  # R_386_PC8
+    }),
+    # x86_64
+    0x3E: (True, {
+        (False, 8, None, 0, None): (1, 0),  # R_X86_64_64
+        (True, 4, None, 0, None): (2, 0),  # R_X86_64_PC32
+        (False, 4, None, 0, None): (10, 0),  # R_X86_64_32
+        (False, 2, None, 0, None): (12, 0),  # R_X86_64_16
+        (True, 2, None, 0, None): (13, 0),  # R_X86_64_PC16
+        (False, 1, None, 0, None): (14, 0),  # R_X86_64_8
+        (True, 1, None, 0, None): (15, 0),  # R_X86_64_PC8
+    }),
+    # PowerPC (32 bit)
+    0x14: (True, {
+        (False, 4, None, 0, None): (1, 0),  # R_PPC_ADDR32
+        (False, 4, (25, 2), 2, None): (2, 0),  # R_PPC_ADDR24
+        (False, 4, (15, 0), 0, None): (3, 2),  # R_PPC_ADDR16 (low half of the word)
+        (False, 2, None, 0, None): (3, 0),  # R_PPC_ADDR16
+        (False, 4, (15, 2), 2, None): (7, 0),  # R_PPC_ADDR14
+        (True, 4, (25, 2), 2, None): (10, 0),  # R_PPC_REL24
+        (True, 4, (15, 2), 2, None): (11, 0),  # R_PPC_REL14
+    }),
+}
+
+
+def elf_hash(name):
+    """Returns the SysV ELF hash of a symbol name
+
+    :param bytes name: the symbol name
+    :rtype: int
+    """
+    value = 0
+    for char in name:
+        value = ((value << 4) + char) & 0xFFFFFFFF
+        high = value & 0xF0000000
+        if high:
+            value ^= high >> 24
+        value &= ~high
+    return value
+
+
+def gnu_hash(name):
+    """Returns the GNU hash (djb2) of a symbol name
+
+    :param bytes name: the symbol name
+    :rtype: int
+    """
+    value = 5381
+    for char in name:
+        value = (value * 33 + char) & 0xFFFFFFFF
+    return value
+
+
+def write_parts(handle, parts):
+    """Writes a list of buffers to a binary file, using gathered writes when available
+
+    :param handle: a binary file object
+    :param list parts: bytes-like objects
+    """
+    handle.flush()
+    if not hasattr(os, 'writev'):
+        handle.writelines(parts)
+        return
+    views = [memoryview(part) for part in parts if len(part) > 0]
+    while views:
+        written = os.writev(handle.fileno(), views)
+        # drop the fully written buffers, then slice the partially written one
+        while views and written >= len(views[0]):
+            written -= len(views[0])
+            views.pop(0)
+        if views and written:
+            views[0] = views[0][written:]
+
+
 class ELF:
 
     def __init__(self, bits, big_endian, e_type, machine, alignment=0):
-        self.header = b'\x7fELF' + \
+        self.ident = b'\x7fELF' + \
             pack('BBBB', 2 if bits == 64 else 1, 2 if big_endian else 1, 1, 0)
         self.bits = bits
         self.endianess_prefix = '>' if big_endian else '<'
-        self.header += bytes(8)
-        self.header += pack(self.endianess_prefix + 'HHI', e_type, machine, 1)
+        self.ident += bytes(8)
+        self.ident += pack(self.endianess_prefix + 'HHI', e_type, machine, 1)
         self.entry_point = 0
         if self.bits == 32:
             self.section_pack_format = self.endianess_prefix + 'IIIIIIIIII'
@@ -32,16 +130,23 @@ class ELF:
             self.section_pack_format = self.endianess_prefix + 'IIQQQQIIQQ'
             self.section_header_size = 64
             self.header_size = 64
+        self.machine = machine
         self.alignment = alignment
+        self.use_rela, self.relocation_types = RELOCATION_TYPES.get(machine, (False, {}))
+        # address -> (symbol data, is a section, target name, addend)
         self.relocations = {}
+        self._section_offsets = None
+        self.parts = []
 
-    def _build_null_section(self):
-        return pack(self.section_pack_format, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+    def _build_section_header(self, name_offset, sh_type, sh_flags, address, offset, size,
+                              link=0, info=0, alignment=0, entry_size=0):
+        return pack(self.section_pack_format, name_offset, sh_type, sh_flags, address,
+                    offset, size, link, info, alignment, entry_size)
 
-    def _build_section(self, section_data):
-        sh_type = 0x01
+    def _build_section(self, name_offset, section_data):
+        sh_type = SHT_PROGBITS
         if section_data['size'] == 0:
-            sh_type = 0x08
+            sh_type = SHT_NOBITS
         sh_flags = 0
         if 'R' in section_data['permissions']:
             sh_flags |= 0x02
@@ -52,88 +157,279 @@ class ELF:
         if 'E' in section_data['permissions']:
             sh_flags |= 0x04
 
-        return pack(self.section_pack_format, section_data['elf_string_offset'], sh_type, sh_flags, section_data['start'],
-                    self.file_base + section_data['offset'], section_data['size'], 0, 0, self.alignment, 0)
+        return self._build_section_header(name_offset, sh_type, sh_flags, section_data['start'],
+                                          self.file_base + section_data['offset'], section_data['size'],
+                                          alignment=self.alignment)
 
-    def _build_string_section(self, name_offset, offset, data):
-        return pack(self.section_pack_format, name_offset, 0x03, 0x20, 0, offset, len(data), 0, 0, 0, 0)
+    def _build_symbol(self, name_offset, value, st_info, section_index):
+        if self.bits == 32:
+            return pack(self.endianess_prefix + 'IIIBBH',
+                        name_offset, value, 0, st_info, 0, section_index)
+        return pack(self.endianess_prefix + 'IBBHQQ',
+                    name_offset, st_info, 0, section_index, value, 0)
 
-    def _build_symtab_section(self, name_offset, offset, data, link):
-        return pack(self.section_pack_format, name_offset, 0x02, 0, 0, offset, len(data), link, 0, 0, 16 if self.bits == 32 else 24)
+    def _build_hash(self, hashed_names, first_index, number_of_symbols):
+        # SysV hash table (32 bit words for both classes)
+        number_of_buckets = max(1, len(hashed_names) // 2 + 1)
+        buckets = [0] * number_of_buckets
+        chains = [0] * number_of_symbols
+        for index, name in enumerate(hashed_names, first_index):
+            bucket = elf_hash(name) % number_of_buckets
+            chains[index] = buckets[bucket]
+            buckets[bucket] = index
+        return pack(self.endianess_prefix + 'II' + 'I' * (number_of_buckets + number_of_symbols),
+                    number_of_buckets, number_of_symbols, *(buckets + chains))
 
-    def resolve_unknown_symbol(self, assembler, address, symbol_data):
-        self.relocations[address] = symbol_data
-        return 0
+    def _gnu_hash_layout(self, names):
+        # symbols must be sorted by bucket for .gnu.hash
+        number_of_buckets = max(1, len(names) // 4 + 1)
+        hashes = [gnu_hash(name) for name in names]
+        order = sorted(range(len(names)), key=lambda index: hashes[index] % number_of_buckets)
+        return number_of_buckets, order, hashes
+
+    def _build_gnu_hash(self, number_of_buckets, hashes, first_index):
+        # hashes must be already sorted by bucket
+        word_bits = self.bits
+        bloom_size = 1
+        while bloom_size * word_bits < len(hashes) * 2:
+            bloom_size *= 2
+        bloom_shift = 6
+        bloom = [0] * bloom_size
+        buckets = [0] * number_of_buckets
+        chains = []
+        for index, value in enumerate(hashes):
+            bloom[(value // word_bits) % bloom_size] |= (1 << (value % word_bits)) | \
+                (1 << ((value >> bloom_shift) % word_bits))
+            bucket = value % number_of_buckets
+            if buckets[bucket] == 0:
+                buckets[bucket] = first_index + index
+            last = index + 1 == len(hashes) or hashes[index + 1] % number_of_buckets != bucket
+            chains.append((value & ~1) | (1 if last else 0))
+        bloom_format = 'I' if self.bits == 32 else 'Q'
+        return pack(self.endianess_prefix + 'IIII', number_of_buckets, first_index, bloom_size, bloom_shift) + \
+            pack(self.endianess_prefix + bloom_format * bloom_size, *bloom) + \
+            pack(self.endianess_prefix + 'I' * (number_of_buckets + len(chains)), *(buckets + chains))
+
+    def _site_section(self, assembler, address):
+        # the name and data of the section containing an output offset
+        if self._section_offsets is None or len(self._section_offsets[0]) != len(assembler.sections):
+            offsets = sorted((section['offset'], name) for name, section in assembler.sections.items())
+            self._section_offsets = ([offset for offset, _ in offsets], [name for _, name in offsets])
+        index = bisect_right(self._section_offsets[0], address) - 1
+        if index < 0:
+            return None, None
+        name = self._section_offsets[1][index]
+        section = assembler.sections[name]
+        if address >= section['offset'] + section.get('size', 0):
+            return None, None
+        return name, section
 
     def relocate(self, address, symbol_data):
-        raise RelocationNotImplemented()
+        """Returns the relocation type and the offset of the field (from address) for a fixup
 
-    def link(self, assembler):
+        Override it for supporting more architectures or fixup kinds.
 
-        # first prepare the .shstrtab section
-        sh_string_table = b'\x00'
-        for section_name, section_data in assembler.sections.items():
-            section_data['elf_string_offset'] = len(sh_string_table)
-            sh_string_table += section_name.encode() + b'\0'
+        :param int address: the offset of the fixup in the assembled bytes
+        :param assembler.LabelData symbol_data: the fixup
+        :rtype: tuple
+        """
+        label_filter = symbol_data.filter
+        if label_filter is None:
+            shift, mask = 0, None
+        elif isinstance(label_filter, LabelFilter):
+            shift, mask = label_filter.shift, label_filter.mask
+        else:
+            raise RelocationNotImplemented(symbol_data.label)
+        if symbol_data.hook:
+            raise RelocationNotImplemented(symbol_data.label)
+        key = (symbol_data.relative is not None, symbol_data.size, symbol_data.bits, shift, mask)
+        if key not in self.relocation_types:
+            raise RelocationNotImplemented(symbol_data.label)
+        return self.relocation_types[key]
 
-        sh_string_table_name_offset = len(sh_string_table)
+    def _add_relocation(self, assembler, address, symbol_data, is_section, target, target_offset):
+        site_name, site_section = self._site_section(assembler, address)
+        if site_section is None:
+            raise RelocationNotImplemented(symbol_data.label)
+        _, field_offset = self.relocate(address, symbol_data)
+        addend = target_offset
+        if symbol_data.relative is not None:
+            # S + A - P == target - relative base
+            addend += site_section['start'] + address - site_section['offset'] + \
+                field_offset - symbol_data.relative
+        self.relocations[address] = (symbol_data, is_section, target, addend)
+        # .rel stores the addend in the field
+        return 0 if self.use_rela else addend
 
-        sh_string_table += '.shstrtab'.encode() + b'\0'
+    def resolve_unknown_symbol(self, assembler, address, symbol_data):
+        name, pre_formula, post_formula = assembler._get_math_formula(symbol_data.label)
+        if pre_formula or post_formula:
+            raise RelocationNotImplemented(symbol_data.label)
+        return self._add_relocation(assembler, address, symbol_data, False, name, 0)
 
-        # then build the symbols names table
-        string_table = b'\x00'
-        for symbol_name, symbol_data in assembler.labels.items():
-            if symbol_name not in assembler.exports:
-                continue
-            symbol_data['elf_string_offset'] = len(string_table)
-            string_table += symbol_name.encode() + b'\0'
+    def resolve_symbol(self, assembler, address, symbol_data, value):
+        name, pre_formula, post_formula = assembler._get_math_formula(symbol_data.label)
+        label = assembler.labels[name]
+        section = label.get('section')
+        if section is None or symbol_data.hook:
+            # absolute symbol (or patched by the hook), nothing to relocate
+            return value
+        site_name, _ = self._site_section(assembler, address)
+        if symbol_data.relative is not None and site_name == section:
+            return value
+        raw_value = assembler.get_label_absolute_address(label)
+        if symbol_data.relative is not None:
+            raw_value -= symbol_data.relative
+        # formulas adding a constant (like label+4) go in the addend
+        formula_offset = value - raw_value
+        if assembler.apply_math_formula(pre_formula, post_formula, raw_value + 0x10000) != value + 0x10000:
+            # the value does not move with the section, keep it as resolved
+            return value
+        # relocate against the section symbol
+        target_offset = label['offset'] - assembler.sections[section]['offset'] + formula_offset
+        try:
+            addend = self._add_relocation(assembler, address, symbol_data, True, section, target_offset)
+        except RelocationNotImplemented:
+            return value
+        return value if self.use_rela else addend
 
-        string_table_name_offset = len(sh_string_table)
-        sh_string_table += '.strtab'.encode() + b'\0'
+    def _build_relocation(self, offset, symbol_index, relocation_type, addend):
+        if self.bits == 32:
+            if self.use_rela:
+                return pack(self.endianess_prefix + 'IIi', offset, (symbol_index << 8) | relocation_type, addend)
+            return pack(self.endianess_prefix + 'II', offset, (symbol_index << 8) | relocation_type)
+        if self.use_rela:
+            return pack(self.endianess_prefix + 'QQq', offset, (symbol_index << 32) | relocation_type, addend)
+        return pack(self.endianess_prefix + 'QQ', offset, (symbol_index << 32) | relocation_type)
 
-        symtab_name_offset = len(sh_string_table)
-        sh_string_table += '.symtab'.encode() + b'\0'
+    def link(self, assembler):
+        return b''.join(self.link_parts(assembler))
 
-        self.file_base = self.header_size + \
-            self.section_header_size * (len(assembler.sections) + 4)
+    def link_parts(self, assembler):
+        """Computes the whole layout up front and returns the file as a list of parts (never joined)
 
-        sections = b''
-        sections += self._build_null_section()
-        for section_index, section_data in enumerate(assembler.sections.values()):
+        :param assembler.Assembler assembler: the assembler
+        :rtype: list
+        """
+        section_names = [b''] * len(assembler.sections)
+        for section_index, (section_name, section_data) in enumerate(assembler.sections.items()):
             section_data['elf_section_index'] = section_index
-            sections += self._build_section(section_data)
+            section_names[section_index] = section_name.encode()
+
+        # exported symbols (only defined labels), ordered for .gnu.hash
+        exported = [name for name in assembler.exports if name in assembler.labels]
+        encoded_names = [name.encode() for name in exported]
+        number_of_buckets, order, hashes = self._gnu_hash_layout(encoded_names)
+        exported = [exported[index] for index in order]
+        encoded_names = [encoded_names[index] for index in order]
+        hashes = [hashes[index] for index in order]
+
+        # null symbol, section symbols (local), undefined symbols, exported symbols
+        string_table = bytearray(b'\x00')
+        symtab = [self._build_symbol(0, 0, 0, 0)]
+        for section_index in range(0, len(assembler.sections)):
+            symtab.append(self._build_symbol(0, 0, 0x03, section_index + 1))
+        first_global = len(symtab)
 
-        symtab = b''
-        for symbol_name, symbol_data in assembler.labels.items():
-            if symbol_name not in assembler.exports:
-                continue
-            if self.bits == 32:
-                symtab += pack(self.endianess_prefix + 'IIIBBH',
-                               symbol_data['elf_string_offset'], symbol_data['base'], 0,
-                               0x10, 0, assembler.sections[symbol_data['section']]['elf_section_index'] + 1)
-            if self.bits == 64:
-                symtab += pack(self.endianess_prefix + 'IBBHQQ',
-                               symbol_data['elf_string_offset'], 0x10, 0,
-                               assembler.sections[symbol_data['section']]['elf_section_index'] + 1, symbol_data['base'], 0)
+        undefined = {}
+        for _, is_section, target, _ in self.relocations.values():
+            if not is_section and target not in undefined:
+                undefined[target] = len(symtab)
+                symtab.append(self._build_symbol(len(string_table), 0, 0x10, 0))
+                string_table += target.encode() + b'\0'
+        first_hashed = len(symtab)
 
-        code_size = len(assembler.assembled_bytes)
+        for name, encoded_name in zip(exported, encoded_names):
+            symbol_data = assembler.labels[name]
+            if symbol_data.get('section') in assembler.sections:
+                section_data = assembler.sections[symbol_data['section']]
+                section_index = section_data['elf_section_index'] + 1
+                value = symbol_data['offset'] - section_data['offset']
+            else:
+                section_index = SHN_ABS
+                value = assembler.get_label_absolute_address(symbol_data)
+            symtab.append(self._build_symbol(len(string_table), value, 0x10, section_index))
+            string_table += encoded_name + b'\0'
+        symtab = b''.join(symtab)
+        symbol_size = 16 if self.bits == 32 else 24
+        number_of_symbols = len(symtab) // symbol_size
 
-        sections += self._build_string_section(
-            sh_string_table_name_offset, self.file_base + code_size, sh_string_table)
+        hash_table = self._build_hash(encoded_names, first_hashed, number_of_symbols)
+        gnu_hash_table = self._build_gnu_hash(number_of_buckets, hashes, first_hashed)
 
-        sections += self._build_string_section(
-            string_table_name_offset, self.file_base + code_size + len(sh_string_table), string_table)
+        # relocations grouped by section
+        relocations = {}
+        for address in sorted(self.relocations):
+            symbol_data, is_section, target, addend = self.relocations[address]
+            section_name, section_data = self._site_section(assembler, address)
+            relocation_type, field_offset = self.relocate(address, symbol_data)
+            if is_section:
+                symbol_index = assembler.sections[target]['elf_section_index'] + 1
+            else:
+                symbol_index = undefined[target]
+            relocations.setdefault(section_name, []).append(self._build_relocation(
+                address - section_data['offset'] + field_offset, symbol_index, relocation_type, addend))
 
-        sections += self._build_symtab_section(
-            symtab_name_offset, self.file_base + code_size + len(sh_string_table) + len(string_table), symtab, len(assembler.sections) + 2)
+        sh_string_table = bytearray(b'\x00')
+
+        def _add_name(name):
+            offset = len(sh_string_table)
+            sh_string_table.extend(name + b'\0')
+            return offset
+
+        name_offsets = [_add_name(name) for name in section_names]
+        symtab_index = len(assembler.sections) + 3
+        # (name, type, flags, data, link, info, alignment, entry size)
+        extra_sections = [
+            (b'.shstrtab', SHT_STRTAB, 0x20, sh_string_table, 0, 0, 1, 0),
+            (b'.strtab', SHT_STRTAB, 0x20, string_table, 0, 0, 1, 0),
+            (b'.symtab', SHT_SYMTAB, 0, symtab, symtab_index - 1, first_global, self.bits // 8, symbol_size),
+            (b'.hash', SHT_HASH, 0, hash_table, symtab_index, 0, 4, 4),
+            (b'.gnu.hash', SHT_GNU_HASH, 0, gnu_hash_table, symtab_index, 0, self.bits // 8, 0)]
+        prefix = b'.rela' if self.use_rela else b'.rel'
+        relocation_size = (3 if self.use_rela else 2) * self.bits // 8
+        for section_name, entries in relocations.items():
+            section_data = assembler.sections[section_name]
+            extra_sections.append((prefix + section_name.encode(), SHT_RELA if self.use_rela else SHT_REL, 0x40,
+                                   b''.join(entries), symtab_index, section_data['elf_section_index'] + 1,
+                                   self.bits // 8, relocation_size))
+        extra_name_offsets = [_add_name(section[0]) for section in extra_sections]
+
+        number_of_sections = len(assembler.sections) + len(extra_sections) + 1
+        self.file_base = self.header_size + self.section_header_size * number_of_sections
+
+        section_headers = [self._build_section_header(0, 0, 0, 0, 0, 0)]
+        for name_offset, section_data in zip(name_offsets, assembler.sections.values()):
+            section_headers.append(self._build_section(name_offset, section_data))
+
+        payload = [assembler.assembled_bytes]
+        offset = self.file_base + len(assembler.assembled_bytes)
+        for name_offset, (_, sh_type, sh_flags, data, link, info, alignment, entry_size) in zip(extra_name_offsets, extra_sections):
+            padding = -offset % alignment
+            if padding:
+                payload.append(bytes(padding))
+                offset += padding
+            section_headers.append(self._build_section_header(
+                name_offset, sh_type, sh_flags, 0, offset, len(data), link, info, alignment, entry_size))
+            payload.append(data)
+            offset += len(data)
 
         if self.bits == 32:
-            self.header += pack(self.endianess_prefix + 'IIIIHHHHHH', self.entry_point,
-                                0, self.header_size, 0, self.header_size, 0, 0, self.section_header_size,
-                                len(assembler.sections) + 4, len(assembler.sections) + 1)
+            header = self.ident + pack(self.endianess_prefix + 'IIIIHHHHHH', self.entry_point,
+                                       0, self.header_size, 0, self.header_size, 0, 0, self.section_header_size,
+                                       number_of_sections, len(assembler.sections) + 1)
         elif self.bits == 64:
-            self.header += pack(self.endianess_prefix + 'QQQIHHHHHH', self.entry_point,
-                                0, self.header_size, 0, self.header_size, 0, 0, self.section_header_size,
-                                len(assembler.sections) + 4, len(assembler.sections) + 1)
+            header = self.ident + pack(self.endianess_prefix + 'QQQIHHHHHH', self.entry_point,
+                                       0, self.header_size, 0, self.header_size, 0, 0, self.section_header_size,
+                                       number_of_sections, len(assembler.sections) + 1)
+
+        self.parts = [header] + section_headers + payload
+        return self.parts
+
+    def save(self, filename):
+        """Writes the parts of the last linked file to filename with gathered writes
 
-        return self.header + sections + assembler.assembled_bytes + sh_string_table + string_table + symtab
+        :param str filename: the destination file
+        """
+        with open(filename, 'wb') as handle:
+            write_parts(handle, self.parts)
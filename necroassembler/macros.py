@@ -24,15 +24,22 @@ class Macro:
         """
         _, *args = tokens
         macro_args = self.args
-        for instr in self.instructions:
-            original_tokens = instr.tokens.copy()
-            # check for known macro args:
-            # first build a dictionary of arg: value
-            macro_dict = {}
-            for macro_arg_index, macro_arg in enumerate(macro_args):
-                macro_dict[macro_arg] = args[macro_arg_index]
-                
-            substitute_with_dict(instr.tokens, macro_dict, 0)
-
-            instr.assemble(assembler)
-            instr.tokens = original_tokens
+        previous_macro = assembler.current_macro
+        assembler.current_macro = self.name
+        try:
+            for instr in self.instructions:
+                original_tokens = instr.tokens.copy()
+                # check for known macro args:
+                # first build a dictionary of arg: value
+                macro_dict = {}
+                for macro_arg_index, macro_arg in enumerate(macro_args):
+                    macro_dict[macro_arg] = args[macro_arg_index]
+
+                substitute_with_dict(instr.tokens, macro_dict, 0)
+
+                try:
+                    instr.assemble(assembler)
+                finally:
+                    instr.tokens = original_tokens
+        finally:
+            assembler.current_macro = previous_macro
@@ -0,0 +1,334 @@
+'''necroassembler object files (a single assembled source with its unresolved fixups) and the objects linker'''
+import sys
+import importlib
+from necroassembler.assembler import LabelData
+from necroassembler.utils import LabelFilter
+from necroassembler.exceptions import (AssemblerException, LabelAlreadyDefined,
+                                       SectionAlreadyDefined)
+
+MAGIC = b'NECROBJ'
+VERSION = 1
+
+
+class InvalidObjectFile(AssemblerException):
+    message = 'invalid object file'
+
+
+class UnsupportedFixup(AssemblerException):
+    message = 'fixup can not be stored in an object file (hooks and lambda filters are not supported)'
+
+
+class IncompatibleObjects(AssemblerException):
+    message = 'objects generated by different assemblers'
+
+
+class _Writer:
+
+    def __init__(self):
+        self.blob = bytearray()
+
+    def uint(self, value):
+        # LEB128
+        while True:
+            byte = value & 0x7F
+            value >>= 7
+            if value:
+                self.blob.append(byte | 0x80)
+            else:
+                self.blob.append(byte)
+                return
+
+    def int(self, value):
+        # zigzag encoding for signed values
+        self.uint(value * 2 if value >= 0 else -value * 2 - 1)
+
+    def optional_int(self, value):
+        self.uint(0 if value is None else 1)
+        if value is not None:
+            self.int(value)
+
+    def bytes(self, value):
+        self.uint(len(value))
+        self.blob += value
+
+    def string(self, value):
+        self.bytes(value.encode())
+
+    def optional_string(self, value):
+        self.uint(0 if value is None else 1)
+        if value is not None:
+            self.string(value)
+
+
+class _Reader:
+
+    def __init__(self, blob):
+        self.blob = blob
+        self.position = 0
+
+    def uint(self):
+        value = 0
+        shift = 0
+        while True:
+            if self.position >= len(self.blob):
+                raise InvalidObjectFile()
+            byte = self.blob[self.position]
+            self.position += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value
+
+    def int(self):
+        value = self.uint()
+        return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+    def optional_int(self):
+        return self.int() if self.uint() else None
+
+    def bytes(self):
+        size = self.uint()
+        if self.position + size > len(self.blob):
+            raise InvalidObjectFile()
+        value = self.blob[self.position:self.position + size]
+        self.position += size
+        return value
+
+    def string(self):
+        return self.bytes().decode()
+
+    def optional_string(self):
+        return self.string() if self.uint() else None
+
+
+def _write_fixup(writer, index, data):
+    if data.hook is not None:
+        raise UnsupportedFixup(data.label)
+    writer.uint(index)
+    writer.string(data.label)
+    writer.uint(data.size)
+    writer.uint(data.bits_size)
+    writer.optional_int(data.relative)
+    writer.int(data.offset)
+    writer.uint(data.alignment)
+    writer.uint(0 if data.bits is None else 1)
+    if data.bits is not None:
+        writer.uint(data.bits[0])
+        writer.uint(data.bits[1])
+    if data.filter is None:
+        writer.uint(0)
+    elif isinstance(data.filter, LabelFilter):
+        writer.uint(1)
+        writer.uint(data.filter.shift)
+        writer.optional_int(data.filter.mask)
+    else:
+        raise UnsupportedFixup(data.label)
+
+
+def _read_fixup(reader):
+    index = reader.uint()
+    data = LabelData(reader.string(), reader.uint(), reader.uint(), reader.optional_int())
+    data.offset = reader.int()
+    data.alignment = reader.uint()
+    if reader.uint():
+        data.bits = (reader.uint(), reader.uint())
+    filter_kind = reader.uint()
+    if filter_kind == 1:
+        data.filter = LabelFilter(reader.uint(), reader.optional_int())
+    elif filter_kind != 0:
+        raise InvalidObjectFile()
+    return index, data
+
+
+def class_path(cls):
+    module_name = cls.__module__
+    if module_name == '__main__':
+        # executed with python -m, use the importable name
+        spec = getattr(sys.modules['__main__'], '__spec__', None)
+        if spec is not None:
+            module_name = spec.name
+    return '{0}:{1}'.format(module_name, cls.__qualname__)
+
+
+def load_class(path):
+    """Returns the assembler class from a 'module:qualname' string
+
+    :param str path: the class path (as stored in object files)
+    :rtype: type
+    """
+    module_name, _, qualname = path.partition(':')
+    obj = importlib.import_module(module_name)
+    for part in qualname.split('.'):
+        obj = getattr(obj, part)
+    return obj
+
+
+def relocatable(assembler):
+    # sources without .org (or padding depending on the address, like .align) continue
+    # at the address where the previous object ended
+    return not assembler.address_dependent
+
+
+def dump_object(assembler):
+    """Serializes an assembled (but not linked) Assembler
+
+    :param assembler.Assembler assembler: the assembler
+    :rtype: bytes
+    """
+    writer = _Writer()
+    writer.blob += MAGIC
+    writer.uint(VERSION)
+    writer.string(class_path(type(assembler)))
+    writer.uint(1 if relocatable(assembler) else 0)
+    writer.uint(assembler.pc)
+
+    attributes = [name for name in assembler.object_attributes if getattr(assembler, name)]
+    writer.uint(len(attributes))
+    for name in attributes:
+        writer.string(name)
+
+    writer.uint(len(assembler.sections))
+    for name, section in assembler.sections.items():
+        writer.string(name)
+        writer.uint(section['start'])
+        writer.uint(section['offset'])
+        writer.uint(section.get('size', 0))
+        writer.uint(section.get('end', section['start']))
+        writer.string(section['permissions'])
+
+    writer.uint(len(assembler.labels))
+    for name, label in assembler.labels.items():
+        writer.string(name)
+        writer.int(label['base'])
+        writer.uint(label['org'])
+        writer.optional_string(label['section'])
+        writer.uint(label['offset'])
+
+    writer.uint(len(assembler.labels_addresses))
+    for index, data in assembler.labels_addresses.items():
+        _write_fixup(writer, index, data)
+
+    writer.uint(len(assembler.exports))
+    for name in assembler.exports:
+        writer.string(name)
+
+    writer.bytes(assembler.assembled_bytes)
+    return bytes(writer.blob)
+
+
+def load_object(blob):
+    """Parses an object file
+
+    :param bytes blob: the content of the object file
+    :rtype: dict
+    """
+    if blob[0:len(MAGIC)] != MAGIC:
+        raise InvalidObjectFile()
+    reader = _Reader(blob)
+    reader.position = len(MAGIC)
+    if reader.uint() != VERSION:
+        raise InvalidObjectFile()
+    obj = {'class': reader.string(), 'relocatable': reader.uint() == 1, 'end': reader.uint()}
+    obj['attributes'] = [reader.string() for _ in range(reader.uint())]
+
+    obj['sections'] = {}
+    for _ in range(reader.uint()):
+        name = reader.string()
+        obj['sections'][name] = {'start': reader.uint(), 'offset': reader.uint(), 'size': reader.uint(),
+                                 'end': reader.uint(), 'permissions': reader.string()}
+
+    obj['labels'] = {}
+    for _ in range(reader.uint()):
+        name = reader.string()
+        obj['labels'][name] = {'base': reader.int(), 'org': reader.uint(),
+                               'section': reader.optional_string(), 'offset': reader.uint()}
+
+    obj['fixups'] = [_read_fixup(reader) for _ in range(reader.uint())]
+    obj['exports'] = [reader.string() for _ in range(reader.uint())]
+    obj['bytes'] = reader.bytes()
+    return obj
+
+
+def save_object(assembler, filename):
+    with open(filename, 'wb') as handle:
+        handle.write(dump_object(assembler))
+
+
+def link_objects(assembler, objects, names=None):
+    """Merges objects into an Assembler (then call link() on it)
+
+    Bytes are concatenated in order. Objects without .org (and without
+    padding depending on the address, like .align and .upto) are moved to
+    the address where the previous object ended (like sources assembled by
+    a single Assembler), the others keep their addresses.
+    Labels of all the objects share a single namespace.
+
+    :param assembler.Assembler assembler: a fresh Assembler
+    :param list objects: objects as returned by load_object()
+    :param list names: the name of each object (for size reports)
+    """
+    pc = assembler.pc
+    for index, obj in enumerate(objects):
+        if obj['class'] != class_path(type(assembler)):
+            raise IncompatibleObjects(obj['class'])
+        base_offset = len(assembler.assembled_bytes)
+        delta = pc if obj['relocatable'] else 0
+
+        for name in obj['attributes']:
+            setattr(assembler, name, True)
+
+        for name, section in obj['sections'].items():
+            if name in assembler.sections:
+                raise SectionAlreadyDefined(name)
+            section = dict(section)
+            section['offset'] += base_offset
+            section['start'] += delta
+            section['end'] += delta
+            assembler.sections[name] = section
+
+        for name, label in obj['labels'].items():
+            if name in assembler.labels:
+                raise LabelAlreadyDefined(name)
+            label = dict(label)
+            label['base'] += delta
+            label['offset'] += base_offset
+            assembler.add_label(name, label)
+
+        for fixup_index, data in obj['fixups']:
+            if data.relative is not None:
+                data.relative += delta
+            assembler.labels_addresses[fixup_index + base_offset] = data
+
+        for name in obj['exports']:
+            assembler.exports[name] = None
+
+        assembler.spans.append((base_offset, names[index] if names else None, None))
+        assembler.assembled_bytes += obj['bytes']
+        pc = obj['end'] + delta
+
+    assembler.current_org = 0
+    assembler.org_counter = pc
+
+
+def main():
+    import os
+    import argparse
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]))
+    parser.add_argument('objects', nargs='+', help='object files (generated with -c)')
+    parser.add_argument('destination', help='output file')
+    parser.add_argument('--size-report', metavar='FILE',
+                        help='write the size attribution report to FILE (JSON if ending with .json)')
+    parser.add_argument('--symbols', metavar='FILE',
+                        help='write the symbols map to FILE (JSON if ending with .json, CSV otherwise)')
+    args = parser.parse_args(sys.argv[1:])
+    objects = []
+    for filename in args.objects:
+        with open(filename, 'rb') as handle:
+            objects.append(load_object(handle.read()))
+    asm = load_class(objects[0]['class'])()
+    link_objects(asm, objects, args.objects)
+    asm.write_outputs(args.destination, args.size_report, args.symbols)
+
+
+if __name__ == '__main__':
+    main()
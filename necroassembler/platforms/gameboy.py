@@ -1,6 +1,13 @@
-from necroassembler import directive, post_link
+import os
+from necroassembler import directive, post_link, asset
 from necroassembler.cpu.lr35902 import AssemblerLR35902
-from necroassembler.exceptions import AssemblerException, InvalidArgumentsForDirective, LabelNotAllowed
+from necroassembler.exceptions import AssemblerException, InvalidArgumentsForDirective, LabelNotAllowed, TooManyTiles
+from necroassembler.tiles import (encode_planar_tiles, max_palette_index, open_image,
+                                  split_tiles, deduplicate_tiles, encode_planar_tiles_list,
+                                  quantize_pixels, parse_tiles_options, GRAYSCALE_PALETTE)
+from necroassembler.cache import asset_converter
+from necroassembler.symbols import SymWriter
+from necroassembler.utils import pack_be16u
 
 
 class InvalidCartidgeHeaderOffset(AssemblerException):
@@ -23,10 +30,49 @@ class InvalidImageSize(AssemblerException):
     message = 'image width and height size must be a multiple of 8'
 
 
+def _load_tiles_image(data, options):
+    image = open_image(data)
+    if image.mode != 'P' and 'QUANTIZE' not in options:
+        raise OnlyIndexedImagesAreSupported()
+    width, height = image.size
+    if (width % 8) != 0 or (height % 8) != 0:
+        raise InvalidImageSize()
+    if 'QUANTIZE' in options:
+        return quantize_pixels(image.convert('RGBA').tobytes(), GRAYSCALE_PALETTE), width
+    pixels = image.tobytes()
+    if max_palette_index(pixels) > 3:
+        raise InvalidPaletteEntry()
+    return pixels, width
+
+
+@asset_converter(2)
+def convert_tiles(data, options):
+    pixels, width = _load_tiles_image(data, options)
+    return encode_planar_tiles(pixels, width, 2)
+
+
+@asset_converter(2)
+def convert_unique_tiles(data, options):
+    pixels, width = _load_tiles_image(data, options)
+    unique, _ = deduplicate_tiles(split_tiles(pixels, width))
+    return encode_planar_tiles_list(unique, 2)
+
+
+@asset_converter(2)
+def convert_tilemap(data, options, base):
+    pixels, width = _load_tiles_image(data, options)
+    unique, entries = deduplicate_tiles(split_tiles(pixels, width))
+    if base + len(unique) > 256:
+        raise TooManyTiles()
+    return bytes([base + index for index, _, _ in entries])
+
+
 class AssemblerGameboy(AssemblerLR35902):
 
     cartridge_set = False
 
+    object_attributes = ('cartridge_set',)
+
     defines = {
         'VRAM': '$8000',
         'LCDC': '$FF40',
@@ -117,58 +163,38 @@ class AssemblerGameboy(AssemblerLR35902):
     def _set_cartridge_destination(self, instr):
         self._cartridge_fill(instr, 0x14A, 1)
 
-    @directive('tiles')
+    @asset('tiles')
     def _build_tiles(self, instr):
-        def _convert_cell(image, cell_x, cell_y):
-            planes = []
-            for y in range(0, 8):
-                byte0 = 0
-                byte1 = 0
-                for x in range(0, 8):
-                    pixel_x = cell_x * 8 + x
-                    pixel_y = cell_y * 8 + y
-                    pixel_value = image.getpixel((pixel_x, pixel_y))
-                    if not 0 <= pixel_value <= 3:
-                        raise InvalidPaletteEntry(instr)
-                    byte0 |= (pixel_value & 0x1) << (7 - x)
-                    byte1 |= (pixel_value >> 1) << (7 - x)
-                planes.append((byte0, byte1))
-            blob = b''
-            for plane in planes:
-                blob += bytes(plane)
-            return blob
-
-        if len(instr.tokens) != 2:
-            raise InvalidArgumentsForDirective(instr)
-        filename = self.stringify(instr.tokens[1])
-        from PIL import Image
-        image = Image.open(filename)
-        if image.mode != 'P':
-            raise OnlyIndexedImagesAreSupported(instr)
-        width, height = image.size
-        if (width % 8) != 0 or (height % 8) != 0:
-            raise InvalidImageSize(instr)
-        for cell_y in range(0, height // 8):
-            for cell_x in range(0, width // 8):
-                blob = _convert_cell(image, cell_x, cell_y)
-                self.append_assembled_bytes(blob)
+        filename, options, _ = parse_tiles_options(self, instr, ('QUANTIZE',))
+        return filename, convert_tiles, (tuple(sorted(options)),)
+
+    @asset('tiles_unique')
+    def _build_unique_tiles(self, instr):
+        filename, options, _ = parse_tiles_options(self, instr, ('QUANTIZE',))
+        return filename, convert_unique_tiles, (tuple(sorted(options)),)
+
+    @asset('tilemap')
+    def _build_tilemap(self, instr):
+        filename, options, base = parse_tiles_options(
+            self, instr, ('QUANTIZE',), 8)
+        return filename, convert_tilemap, (tuple(sorted(options)), base)
+
+    def symbol_writers(self, destination):
+        # switchable banks are mapped at $4000-$7FFF
+        return [SymWriter(os.path.splitext(destination)[0] + '.sym',
+                          bank=lambda address, label: label['offset'] // 0x4000 if address < 0x8000 else 0)]
 
     @post_link
     def _fix(self):
+        checksum = self.get_checksum()
+
         # header checksum
-        header_checksum = 0
-        for i in range(0x134, 0x14d):
-            header_checksum = header_checksum - \
-                int(self.assembled_bytes[i]) - 1
-        self.assembled_bytes[0x14d] = header_checksum & 0xFF
-
-        # global checksum
-        global_checksum = 0
-        for byte in self.assembled_bytes:
-            global_checksum += int(byte)
-
-        self.assembled_bytes[0x14e] = (global_checksum >> 8) & 0xFF
-        self.assembled_bytes[0x14f] = global_checksum & 0xFF
+        header_checksum = -checksum.sum8(0x134, 0x14d) - (0x14d - 0x134)
+        checksum.write(0x14d, bytes((header_checksum & 0xFF,)))
+
+        # global checksum (the checksum bytes are excluded)
+        global_checksum = checksum.sum8() - checksum.sum8(0x14e, 0x150)
+        checksum.write(0x14e, pack_be16u(global_checksum & 0xFFFF))
 
 
 if __name__ == '__main__':
@@ -1,21 +1,20 @@
+from necroassembler import post_link
 from necroassembler.cpu.thumb import AssemblerThumb
 
 
-def main():
-    import sys
-    asm = AssemblerThumb()
-    asm.assemble_file(sys.argv[1])
-    asm.link()
+class AssemblerGBA(AssemblerThumb):
+
+    @post_link
+    def _fix(self):
+        checksum = self.get_checksum()
 
-    # fix checksums
+        # header checksum
+        header_checksum = -checksum.sum8(0xA0, 0xBD)
+        checksum.write(0xBD, bytes(((header_checksum - 0x19) & 0xFF,)))
 
-    # header checksum
-    header_checksum = 0
-    for i in range(0xA0, 0xBD):
-        header_checksum = header_checksum - int(asm.assembled_bytes[i])
-    asm.assembled_bytes[0xBD] = (header_checksum - 0x19) & 0xFF
 
-    asm.save(sys.argv[2])
+def main():
+    AssemblerGBA.main()
 
 
 if __name__ == '__main__':
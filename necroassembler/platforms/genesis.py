@@ -1,24 +1,21 @@
+from necroassembler import post_link
 from necroassembler.cpu.mc68000 import AssemblerMC68000
+from necroassembler.utils import pack_be16u
+
+
+class AssemblerGenesis(AssemblerMC68000):
+
+    @post_link
+    def _fix(self):
+        checksum = self.get_checksum()
+
+        # header checksum
+        header_checksum = checksum.sum16_be(0x200)
+        checksum.write(0x18e, pack_be16u(header_checksum & 0xFFFF))
 
 
 def main():
-    import sys
-    asm = AssemblerMC68000()
-    asm.assemble_file(sys.argv[1])
-    asm.link()
-
-    # fix checksums
-
-    # header checksum
-    header_checksum = 0
-    for i in range(0x200, len(asm.assembled_bytes), 2):
-        high = asm.assembled_bytes[i]
-        low = asm.assembled_bytes[i+1]
-        header_checksum += (high << 8) | low
-    asm.assembled_bytes[0x18e] = (header_checksum >> 8) & 0xFF
-    asm.assembled_bytes[0x18f] = header_checksum & 0xFF
-
-    asm.save(sys.argv[2])
+    AssemblerGenesis.main()
 
 
 if __name__ == '__main__':
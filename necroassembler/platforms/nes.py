@@ -1,6 +1,12 @@
-from necroassembler import directive
+import os
+from necroassembler import directive, asset
 from necroassembler.cpu.mos6502 import AssemblerMOS6502
-from necroassembler.exceptions import AssemblerException, InvalidArgumentsForDirective, LabelNotAllowed
+from necroassembler.exceptions import AssemblerException, InvalidArgumentsForDirective, LabelNotAllowed, TooManyTiles
+from necroassembler.tiles import (encode_planar_tiles, max_palette_index, open_image,
+                                  split_tiles, deduplicate_tiles, encode_planar_tiles_list,
+                                  quantize_pixels, parse_tiles_options, GRAYSCALE_PALETTE)
+from necroassembler.cache import asset_converter
+from necroassembler.symbols import FCEUXWriter, MesenWriter
 
 
 class InvalidCartidgeHeaderOffset(AssemblerException):
@@ -23,10 +29,60 @@ class InvalidPaletteEntry(AssemblerException):
     message = 'only values between 0 and 3 are allowed for pixel colors'
 
 
+class InvalidTilesImageSize(AssemblerException):
+    message = 'image width and height size must be a multiple of 8'
+
+
+def _load_indexed_image(data, options):
+    image = open_image(data)
+    if 'QUANTIZE' in options:
+        return image, quantize_pixels(image.convert('RGBA').tobytes(), GRAYSCALE_PALETTE)
+    if image.mode != 'P':
+        raise OnlyIndexedImagesAreSupported()
+    pixels = image.tobytes()
+    if max_palette_index(pixels) > 3:
+        raise InvalidPaletteEntry()
+    return image, pixels
+
+
+@asset_converter(2)
+def convert_tiles(data, options):
+    image, pixels = _load_indexed_image(data, options)
+    width, height = image.size
+    if width != 128 or height != 128:
+        raise InvalidImageSize()
+    return encode_planar_tiles(pixels, width, 2, interleave=False)
+
+
+def _unique_tiles(data, options):
+    image, pixels = _load_indexed_image(data, options)
+    width, height = image.size
+    if (width % 8) != 0 or (height % 8) != 0:
+        raise InvalidTilesImageSize()
+    return deduplicate_tiles(split_tiles(pixels, width))
+
+
+@asset_converter(2)
+def convert_unique_tiles(data, options):
+    unique, _ = _unique_tiles(data, options)
+    return encode_planar_tiles_list(unique, 2, interleave=False)
+
+
+@asset_converter(2)
+def convert_tilemap(data, options, base):
+    unique, entries = _unique_tiles(data, options)
+    # a pattern table contains 256 tiles
+    if base + len(unique) > 256:
+        raise TooManyTiles()
+    return bytes([base + index for index, _, _ in entries])
+
+
 class AssemblerNES(AssemblerMOS6502):
 
     cartridge_set = False
 
+    object_attributes = ('cartridge_set',)
+
     defines = {
         'PPUCTRL': '$2000',
         'PPUMASK': '$2001',
@@ -75,69 +131,33 @@ class AssemblerNES(AssemblerMOS6502):
     def _set_cartridge_license(self, instr):
         self._cartridge_fill(instr, 0x06, 1)
 
-    @directive('chr_pattern_table')
+    @asset('chr_pattern_table')
     def _build_chr_pattern_table(self, instr):
-        def _convert_cell(image, cell_x, cell_y):
-            plane0 = []
-            plane1 = []
-            for y in range(0, 8):
-                byte0 = 0
-                byte1 = 0
-                for x in range(0, 8):
-                    pixel_x = cell_x * 8 + x
-                    pixel_y = cell_y * 8 + y
-                    pixel_value = image.getpixel((pixel_x, pixel_y))
-                    if not 0 <= pixel_value <= 3:
-                        raise InvalidPaletteEntry(instr)
-                    byte0 |= (pixel_value & 0x1) << (7 - x)
-                    byte1 |= (pixel_value >> 1) << (7 - x)
-                plane0.append(byte0)
-                plane1.append(byte1)
-            blob = b''
-            for byte in plane0:
-                blob += bytes((byte,))
-            for byte in plane1:
-                blob += bytes((byte,))
-            return blob
-
-        if len(instr.tokens) != 2:
-            raise InvalidArgumentsForDirective(instr)
-        filename = self.stringify(instr.tokens[1])
-        from PIL import Image
-        image = Image.open(filename)
-        if image.mode != 'P':
-            raise OnlyIndexedImagesAreSupported(instr)
-        width, height = image.size
-        if width != 128 or height != 128:
-            raise InvalidImageSize(instr)
-        for cell_y in range(0, 16):
-            for cell_x in range(0, 16):
-                blob = _convert_cell(image, cell_x, cell_y)
-                self.append_assembled_bytes(blob)
+        filename, options, _ = parse_tiles_options(self, instr, ('QUANTIZE',))
+        return filename, convert_tiles, (tuple(sorted(options)),)
+
+    @asset('tiles_unique')
+    def _build_unique_tiles(self, instr):
+        filename, options, _ = parse_tiles_options(self, instr, ('QUANTIZE',))
+        return filename, convert_unique_tiles, (tuple(sorted(options)),)
+
+    @asset('tilemap')
+    def _build_tilemap(self, instr):
+        filename, options, base = parse_tiles_options(
+            self, instr, ('QUANTIZE',), 8)
+        return filename, convert_tilemap, (tuple(sorted(options)), base)
+
+    def symbol_writers(self, destination):
+        header_size = 16 if self.cartridge_set else 0
+        return [FCEUXWriter(destination + '.0.nl', 0x8000, 0xFFFF),
+                FCEUXWriter(destination + '.ram.nl', 0x0000, 0x7FF),
+                MesenWriter(os.path.splitext(destination)[0] + '.mlb',
+                            ((0x0000, 0x7FF, 'R', None),
+                             (0x8000, 0xFFFF, 'P', lambda address, label: label['offset'] - header_size)))]
 
 
 def main():
-    import sys
-    asm = AssemblerNES()
-    asm.assemble_file(sys.argv[1])
-    asm.link()
-    asm.save(sys.argv[2])
-
-    # rom debug symbols
-    with open(sys.argv[2] + '.0.nl', 'wb') as nl_file:
-        for label in asm.labels:
-            address = asm.get_label_absolute_address_by_name(label)
-            if 0x8000 <= address <= 0xFFFF:
-                nl_file.write('${0:04X}#{1}#\x0D\x0A'.format(
-                    address, label).encode('ascii'))
-
-    # ram debug symbols
-    with open(sys.argv[2] + '.ram.nl', 'wb') as nl_file:
-        for label in asm.labels:
-            address = asm.get_label_absolute_address_by_name(label)
-            if 0x0000 <= address <= 0x7FF:
-                nl_file.write('${0:04X}#{1}#\x0D\x0A'.format(
-                    address, label).encode('ascii'))
+    AssemblerNES.main()
 
 
 if __name__ == '__main__':
@@ -1,6 +1,13 @@
-from necroassembler import directive, post_link
+import os
+from necroassembler import directive, post_link, asset
 from necroassembler.cpu.z80 import AssemblerZ80
-from necroassembler.exceptions import AssemblerException, InvalidArgumentsForDirective, LabelNotAllowed
+from necroassembler.exceptions import AssemblerException, InvalidArgumentsForDirective, LabelNotAllowed, TooManyTiles
+from necroassembler.tiles import (encode_planar_tiles, max_palette_index, open_image,
+                                  split_tiles, deduplicate_tiles, encode_planar_tiles_list,
+                                  quantize_pixels, unique_colors, parse_tiles_options)
+from necroassembler.utils import pack_le16u
+from necroassembler.cache import asset_converter
+from necroassembler.symbols import SymWriter
 
 
 class OnlyIndexedImagesAreSupported(AssemblerException):
@@ -15,6 +22,81 @@ class InvalidImageSize(AssemblerException):
     message = 'image width and height size must be a multiple of 8'
 
 
+class TooManyColors(AssemblerException):
+    message = 'images can use at most 16 colors'
+
+
+def _sms_palette(image):
+    # reduce to the 2 bits per channel color space of the VDP,
+    # colors are indexed in order of appearance (0 is reserved for transparency)
+    # (opaque black gets its own entry)
+    rgba = image.convert('RGBA').tobytes()
+    colors = unique_colors(rgba)
+    first_index = 0
+    if any([alpha < 128 for _, _, _, alpha in colors]):
+        first_index = 1
+    palette = [(0, 0, 0)] * first_index
+    for red, green, blue, alpha in colors:
+        if alpha < 128:
+            continue
+        color = (round(red / 85) * 85, round(green / 85) * 85, round(blue / 85) * 85)
+        if color not in palette[first_index:]:
+            palette.append(color)
+    if len(palette) > 16:
+        raise TooManyColors()
+    return rgba, palette, first_index
+
+
+def _load_tiles_image(data, options):
+    image = open_image(data)
+    if image.mode != 'P' and 'QUANTIZE' not in options:
+        raise OnlyIndexedImagesAreSupported()
+    width, height = image.size
+    if (width % 8) != 0 or (height % 8) != 0:
+        raise InvalidImageSize()
+    if 'QUANTIZE' in options:
+        rgba, palette, first_index = _sms_palette(image)
+        return quantize_pixels(rgba, palette, first_index=first_index), width
+    pixels = image.tobytes()
+    if max_palette_index(pixels) > 15:
+        raise InvalidPaletteEntry()
+    return pixels, width
+
+
+@asset_converter(3)
+def convert_tiles(data, options):
+    pixels, width = _load_tiles_image(data, options)
+    return encode_planar_tiles(pixels, width, 4)
+
+
+@asset_converter(3)
+def convert_unique_tiles(data, options):
+    pixels, width = _load_tiles_image(data, options)
+    unique, _ = deduplicate_tiles(
+        split_tiles(pixels, width), 'FLIP' in options)
+    return encode_planar_tiles_list(unique, 4)
+
+
+@asset_converter(3)
+def convert_tilemap(data, options, base):
+    pixels, width = _load_tiles_image(data, options)
+    unique, entries = deduplicate_tiles(
+        split_tiles(pixels, width), 'FLIP' in options)
+    # tile index is 9 bits
+    if base + len(unique) > 512:
+        raise TooManyTiles()
+    return pack_le16u(*[(base + index) | (horizontal << 9) | (vertical << 10)
+                        for index, horizontal, vertical in entries])
+
+
+@asset_converter(2)
+def convert_palette(data):
+    _, palette, _ = _sms_palette(open_image(data))
+    # CRAM format is --BBGGRR
+    return bytes([(red // 85) | ((green // 85) << 2) | ((blue // 85) << 4)
+                  for red, green, blue in palette])
+
+
 class AssemblerSegaMasterSystem(AssemblerZ80):
 
     defines = {
@@ -30,45 +112,33 @@ class AssemblerSegaMasterSystem(AssemblerZ80):
 
     }
 
-    @directive('tiles')
+    @asset('tiles')
     def _build_tiles(self, instr):
-        def _convert_cell(image, cell_x, cell_y):
-            planes = []
-            for y in range(0, 8):
-                byte0 = 0
-                byte1 = 0
-                byte2 = 0
-                byte3 = 0
-                for x in range(0, 8):
-                    pixel_x = cell_x * 8 + x
-                    pixel_y = cell_y * 8 + y
-                    pixel_value = image.getpixel((pixel_x, pixel_y))
-                    if not 0 <= pixel_value <= 15:
-                        raise InvalidPaletteEntry(instr)
-                    byte0 |= (pixel_value & 0x1) << (7 - x)
-                    byte1 |= ((pixel_value >> 1) & 0x1) << (7 - x)
-                    byte2 |= ((pixel_value >> 2) & 0x1) << (7 - x)
-                    byte3 |= ((pixel_value >> 3) & 0x1) << (7 - x)
-                planes.append((byte0, byte1, byte2, byte3))
-            blob = b''
-            for plane in planes:
-                blob += bytes(plane)
-            return blob
+        filename, options, _ = parse_tiles_options(self, instr, ('QUANTIZE',))
+        return filename, convert_tiles, (tuple(sorted(options)),)
+
+    @asset('tiles_unique')
+    def _build_unique_tiles(self, instr):
+        filename, options, _ = parse_tiles_options(
+            self, instr, ('FLIP', 'QUANTIZE'))
+        return filename, convert_unique_tiles, (tuple(sorted(options)),)
 
+    @asset('tilemap')
+    def _build_tilemap(self, instr):
+        filename, options, base = parse_tiles_options(
+            self, instr, ('FLIP', 'QUANTIZE'), 9)
+        return filename, convert_tilemap, (tuple(sorted(options)), base)
+
+    @asset('tiles_palette')
+    def _build_tiles_palette(self, instr):
         if len(instr.tokens) != 2:
             raise InvalidArgumentsForDirective(instr)
-        filename = self.stringify(instr.tokens[1])
-        from PIL import Image
-        image = Image.open(filename)
-        if image.mode != 'P':
-            raise OnlyIndexedImagesAreSupported(instr)
-        width, height = image.size
-        if (width % 8) != 0 or (height % 8) != 0:
-            raise InvalidImageSize(instr)
-        for cell_y in range(0, height // 8):
-            for cell_x in range(0, width // 8):
-                blob = _convert_cell(image, cell_x, cell_y)
-                self.append_assembled_bytes(blob)
+        return self.stringify(instr.tokens[1]), convert_palette, ()
+
+    def symbol_writers(self, destination):
+        # rom banks are mapped in the $0000-$BFFF slots
+        return [SymWriter(os.path.splitext(destination)[0] + '.sym',
+                          bank=lambda address, label: label['offset'] // 0x4000 if address < 0xC000 else 0)]
 
 
 if __name__ == '__main__':
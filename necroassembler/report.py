@@ -0,0 +1,90 @@
+'''Size attribution reports (which labels, files, macros and sections use the bytes)'''
+import json
+
+NO_CONTEXT = '<input>'
+
+
+def size_report(assembler):
+    """Builds a dictionary describing how the assembled bytes are distributed
+
+    Labels own the bytes up to the next label (by offset in the output),
+    files and macros own the bytes generated by their statements
+    (bytes generated by a macro are accounted to both the macro and the file).
+
+    :param assembler.Assembler assembler: an already assembled Assembler
+    :rtype: dict
+    """
+    total = len(assembler.assembled_bytes)
+
+    labels = []
+    symbols = assembler.get_symbols_by_offset()
+    for index, (offset, name) in enumerate(symbols):
+        if index + 1 < len(symbols):
+            end = symbols[index + 1][0]
+        else:
+            end = total
+        labels.append({'name': name,
+                       'address': assembler.get_label_absolute_address(assembler.labels[name]),
+                       'offset': offset,
+                       'size': end - offset})
+
+    files = {}
+    macros = {}
+    if assembler.spans and assembler.spans[0][0] > 0:
+        files[NO_CONTEXT] = assembler.spans[0][0]
+    for index, (offset, context, macro) in enumerate(assembler.spans):
+        if index + 1 < len(assembler.spans):
+            end = assembler.spans[index + 1][0]
+        else:
+            end = total
+        context = context if context is not None else NO_CONTEXT
+        files[context] = files.get(context, 0) + end - offset
+        if macro is not None:
+            macros[macro] = macros.get(macro, 0) + end - offset
+
+    sections = {}
+    for name, section in assembler.sections.items():
+        sections[name] = section.get('size', 0)
+
+    return {'total': total, 'labels': labels, 'files': files,
+            'macros': macros, 'sections': sections}
+
+
+def format_size_report(report):
+    """Builds the text version of a size report
+
+    :param dict report: a report generated by size_report()
+    :rtype: str
+    """
+    lines = ['total: {0} bytes'.format(report['total'])]
+
+    def _table(title, items):
+        lines.append('')
+        lines.append(title)
+        for name, size in sorted(items, key=lambda item: -item[1]):
+            lines.append('  {0:>8} {1}'.format(size, name))
+
+    _table('sections:', report['sections'].items())
+    _table('files:', report['files'].items())
+    _table('macros:', report['macros'].items())
+
+    lines.append('')
+    lines.append('labels:')
+    for label in report['labels']:
+        lines.append('  ${0:08X} {1:>8} {2}'.format(
+            label['address'], label['size'], label['name']))
+    return '\n'.join(lines) + '\n'
+
+
+def write_size_report(assembler, filename):
+    """Saves the size report of an assembler (JSON if filename ends with .json)
+
+    :param assembler.Assembler assembler: an already assembled Assembler
+    :param str filename: the destination file
+    """
+    report = size_report(assembler)
+    with open(filename, 'w') as handle:
+        if filename.lower().endswith('.json'):
+            json.dump(report, handle, indent=2)
+        else:
+            handle.write(format_size_report(report))
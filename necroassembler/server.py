@@ -0,0 +1,245 @@
+'''Assembler server: runs assembly jobs (JSON lines) with warm assembler instances, and its client'''
+import os
+import sys
+import json
+import base64
+import threading
+from necroassembler.assembler import Assembler
+from necroassembler.exceptions import AssemblerException
+from necroassembler.objects import load_class
+
+# assembler instances (per thread) already built by this process
+_INSTANCES = threading.local()
+
+# modules (besides the necroassembler ones) the clients can load assemblers from (see --allow)
+ALLOWED_MODULES = set()
+
+
+class NotAnAssembler(AssemblerException):
+    message = 'not an assembler class'
+
+
+def get_assembler(path):
+    """Returns a reset instance of an assembler class, every thread builds its instance only once
+
+    :param str path: the class path ('module:qualname', like 'necroassembler.platforms.gameboy:AssemblerGameboy')
+    :rtype: assembler.Assembler
+    """
+    instances = _INSTANCES.__dict__.setdefault('instances', {})
+    if path not in instances:
+        # never import arbitrary modules or call arbitrary objects sent by the clients
+        module_name = path.partition(':')[0]
+        if not module_name.startswith('necroassembler.') and module_name not in ALLOWED_MODULES:
+            raise NotAnAssembler(path)
+        cls = load_class(path)
+        if not isinstance(cls, type) or not issubclass(cls, Assembler):
+            raise NotAnAssembler(path)
+        instances[path] = cls()
+    else:
+        instances[path].reset()
+    return instances[path]
+
+
+def run_job(job):
+    """Assembles a job and returns the response
+
+    Jobs are dictionaries with the 'assembler' class path, the code to
+    assemble ('source' text or 'path' of a file), optional 'defines',
+    'output' (the file to write, otherwise the bytes are returned base64
+    encoded in the response), 'cwd' (the directory for relative paths,
+    the working directory of the process is never changed) and the
+    optional 'id' copied to the response.
+    Errors are reported in the 'error' field of the response.
+
+    :param dict job: the job
+    :rtype: dict
+    """
+    response = {'id': job.get('id')}
+    try:
+        asm = get_assembler(job['assembler'])
+        asm.directory = job.get('cwd')
+        for name, value in job.get('defines', {}).items():
+            asm.register_define(name, str(value))
+        if 'path' in job:
+            asm.assemble_file(job['path'])
+        else:
+            asm.assemble(job['source'], job.get('context'))
+        asm.link()
+        if 'output' in job:
+            asm.save(asm.input_path(job['output']))
+            response['output'] = job['output']
+        else:
+            response['bytes'] = base64.b64encode(asm.assembled_bytes).decode()
+        response['ok'] = True
+    except Exception as exc:
+        response['ok'] = False
+        response['error'] = str(exc)
+        response['exception'] = type(exc).__name__
+    return response
+
+
+def _parse_job(line):
+    try:
+        job = json.loads(line)
+    except ValueError as exc:
+        return None, {'id': None, 'ok': False, 'error': str(exc), 'exception': type(exc).__name__}
+    if not isinstance(job, dict):
+        return None, {'id': None, 'ok': False, 'error': 'jobs must be JSON objects', 'exception': 'ValueError'}
+    return job, None
+
+
+def serve_stream(rfile, wfile, pool=None):
+    """Reads jobs (one JSON object per line) from rfile and writes the responses (in completion order) to wfile
+
+    :param file rfile: the text stream of jobs
+    :param file wfile: the text stream for responses
+    :param concurrent.futures.Executor pool: the worker pool (None for running jobs in this thread)
+    """
+    lock = threading.Lock()
+
+    def _respond(response):
+        with lock:
+            wfile.write(json.dumps(response) + '\n')
+            wfile.flush()
+
+    def _callback(future, written):
+        try:
+            _respond(future.result())
+        finally:
+            written.set()
+
+    # callbacks run after the futures are marked as done,
+    # so wait for the responses to be written before returning
+    pending = []
+    for line in rfile:
+        if not line.strip():
+            continue
+        job, error = _parse_job(line)
+        if error is not None:
+            _respond(error)
+        elif pool is None:
+            _respond(run_job(job))
+        else:
+            written = threading.Event()
+            pool.submit(run_job, job).add_done_callback(
+                lambda future, written=written: _callback(future, written))
+            pending.append(written)
+    for written in pending:
+        written.wait()
+
+
+def serve_unix(path, pool=None):
+    """Accepts connections on a Unix socket, every connection is a stream of jobs
+
+    :param str path: the socket path
+    :param concurrent.futures.Executor pool: the worker pool (None for running jobs in the threads serving the connections)
+    """
+    import socketserver
+    class Handler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            serve_stream(_lines(self.rfile), _TextWriter(self.wfile), pool)
+
+    if os.path.exists(path):
+        os.unlink(path)
+    # servers are context managers only from python 3.6
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+def _lines(rfile):
+    for line in rfile:
+        yield line.decode()
+
+
+class _TextWriter:
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, text):
+        self.wfile.write(text.encode())
+
+    def flush(self):
+        self.wfile.flush()
+
+
+def submit(path, job):
+    """Runs a job on the server listening on a Unix socket
+
+    :param str path: the socket path
+    :param dict job: the job
+    :rtype: dict
+    """
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        connection.sendall((json.dumps(job) + '\n').encode())
+        connection.shutdown(socket.SHUT_WR)
+        with connection.makefile('rb') as rfile:
+            return json.loads(rfile.readline().decode())
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]))
+    parser.add_argument('--socket', metavar='PATH',
+                        help='listen on a Unix socket (jobs are read from stdin otherwise)')
+    parser.add_argument('-j', '--jobs', type=int, default=0, metavar='N',
+                        help='run jobs using N processes')
+    parser.add_argument('--allow', action='append', default=[], metavar='MODULE',
+                        help='allow assemblers defined in MODULE (only necroassembler modules are allowed by default)')
+    args = parser.parse_args(sys.argv[1:])
+    ALLOWED_MODULES.update(args.allow)
+    import signal
+    # exit cleanly (removing the socket) when terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    pool = None
+    if args.jobs > 0:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(args.jobs)
+    try:
+        if args.socket:
+            serve_unix(args.socket, pool)
+        else:
+            serve_stream(sys.stdin, sys.stdout, pool)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def client_main():
+    import argparse
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]))
+    parser.add_argument('assembler', help="assembler class path (like 'necroassembler.cpu.z80:AssemblerZ80')")
+    parser.add_argument('source', help='assembly source file')
+    parser.add_argument('destination', help='output file')
+    parser.add_argument('-D', '--define', action='append', default=[], metavar='NAME=VALUE',
+                        help='add a define')
+    parser.add_argument('--socket', metavar='PATH', default=os.environ.get('NECROASSEMBLER_SOCKET'),
+                        help='the server socket (assemble in this process if not available)')
+    args = parser.parse_args(sys.argv[1:])
+    job = {'assembler': args.assembler, 'path': args.source, 'output': args.destination, 'cwd': os.getcwd(),
+           'defines': dict([define.partition('=')[0::2] for define in args.define])}
+    response = None
+    if args.socket:
+        try:
+            response = submit(args.socket, job)
+        except OSError:
+            # no server running
+            pass
+    if response is None:
+        response = run_job(job)
+    if not response['ok']:
+        print('{0}: {1}'.format(response['exception'], response['error']), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -113,10 +113,11 @@ class Label(Statement):
             raise InvalidLabel(self)
         if assembler.parse_integer(key, 64, False) is not None:
             raise InvalidLabel(self)
-        assembler.labels[key] = {
+        assembler.add_label(key, {
             'base': assembler.org_counter,
             'org': assembler.current_org,
-            'section': assembler.current_section}
+            'section': assembler.current_section,
+            'offset': len(assembler.assembled_bytes)})
 
 
 class Directive(Statement):
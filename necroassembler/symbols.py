@@ -0,0 +1,152 @@
+'''Debug symbols exporters (emulators and generic maps)'''
+import json
+
+BUFFER_SIZE = 64 * 1024
+
+
+class SymbolWriter:
+    '''Base class for symbols writers, subclasses override format_symbol()
+    (the default format is a plain "address name" map)'''
+
+    def __init__(self, filename, start=0, end=0xFFFFFFFFFFFFFFFF):
+        self.filename = filename
+        self.start = start
+        self.end = end
+        self.handle = None
+
+    def open(self):
+        self.handle = open(self.filename, 'w', buffering=BUFFER_SIZE,
+                           encoding='ascii', newline='')
+        self.write_header()
+
+    def close(self):
+        self.write_footer()
+        self.handle.close()
+        self.handle = None
+
+    def write_header(self):
+        pass
+
+    def write_footer(self):
+        pass
+
+    def write(self, address, name, label):
+        if self.start <= address <= self.end:
+            line = self.format_symbol(address, name, label)
+            if line is not None:
+                self.handle.write(line)
+
+    def format_symbol(self, address, name, label):
+        return '{0:08X} {1}\n'.format(address, name)
+
+
+class FCEUXWriter(SymbolWriter):
+    '''FCEUX .nl files (one file per address window)'''
+
+    def format_symbol(self, address, name, label):
+        return '${0:04X}#{1}#\r\n'.format(address, name)
+
+
+class MesenWriter(SymbolWriter):
+    '''Mesen .mlb files, regions is a list of (start, end, memory_type, mapper)
+
+    mapper is a callable (address, label) returning the address in the
+    specified memory type (None means the address is used as is)
+    '''
+
+    def __init__(self, filename, regions):
+        super().__init__(filename,
+                         min([region[0] for region in regions]),
+                         max([region[1] for region in regions]))
+        self.regions = regions
+
+    def format_symbol(self, address, name, label):
+        for start, end, memory_type, mapper in self.regions:
+            if start <= address <= end:
+                if mapper is not None:
+                    address = mapper(address, label)
+                return '{0}:{1:04X}:{2}\n'.format(memory_type, address, name)
+        return None
+
+
+class SymWriter(SymbolWriter):
+    '''no$gmb/BGB (and wla-dx) .sym files, bank is a callable (address, label) returning the bank'''
+
+    def __init__(self, filename, start=0, end=0xFFFF, bank=None):
+        super().__init__(filename, start, end)
+        self.bank = bank
+
+    def write_header(self):
+        self.handle.write('; generated by necroassembler\n')
+
+    def format_symbol(self, address, name, label):
+        bank = self.bank(address, label) if self.bank else 0
+        return '{0:02X}:{1:04X} {2}\n'.format(bank, address, name)
+
+
+class CSVWriter(SymbolWriter):
+    '''Generic name,address,offset,section map'''
+
+    def write_header(self):
+        self.handle.write('name,address,offset,section\n')
+
+    def format_symbol(self, address, name, label):
+        section = label.get('section')
+        return '{0},0x{1:X},{2},{3}\n'.format(name, address, label.get('offset', ''),
+                                              section if section is not None else '')
+
+
+class JSONWriter(SymbolWriter):
+    '''Generic JSON map (a list of objects)'''
+
+    def __init__(self, filename, start=0, end=0xFFFFFFFFFFFFFFFF):
+        super().__init__(filename, start, end)
+        self.first = True
+
+    def write_header(self):
+        self.handle.write('[')
+        self.first = True
+
+    def write_footer(self):
+        self.handle.write('\n]\n')
+
+    def format_symbol(self, address, name, label):
+        line = '' if self.first else ','
+        self.first = False
+        return line + '\n  ' + json.dumps({'name': name, 'address': address,
+                                            'offset': label.get('offset'),
+                                            'section': label.get('section')})
+
+
+def map_writer(filename):
+    """Returns the generic writer for filename (JSON if it ends with .json, CSV otherwise)
+
+    :param str filename: the destination file
+    :rtype: SymbolWriter
+    """
+    if filename.lower().endswith('.json'):
+        return JSONWriter(filename)
+    return CSVWriter(filename)
+
+
+def export_symbols(assembler, writers):
+    """Streams the labels of an assembler to multiple writers with a single sweep
+    (in address order)
+
+    :param assembler.Assembler assembler: an already assembled Assembler
+    :param list writers: SymbolWriter instances
+    """
+    if not writers:
+        return
+    for writer in writers:
+        writer.open()
+    try:
+        start = min([writer.start for writer in writers])
+        end = max([writer.end for writer in writers])
+        for address, name in assembler.get_symbols_in_range(start, end):
+            label = assembler.labels[name]
+            for writer in writers:
+                writer.write(address, name, label)
+    finally:
+        for writer in writers:
+            writer.close()
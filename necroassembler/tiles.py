@@ -0,0 +1,221 @@
+'''Conversion of indexed images to planar 8x8 tiles'''
+import io
+import sys
+from array import array
+from necroassembler.exceptions import InvalidArgumentsForDirective
+
+# multiplying a 64 bit value made of 0/1 bytes by this constant
+# gathers the 8 bits in the most significant byte
+_GATHER_BITS = 0x0102040810204080
+
+
+def _plane_table(plane):
+    return bytes([(value >> plane) & 0x01 for value in range(256)])
+
+
+_PLANE_TABLES = [_plane_table(plane) for plane in range(8)]
+
+
+def encode_planar_tiles(pixels, width, bpp, interleave=True):
+    """Converts the pixels (one palette index per byte, row major) of an image to 8x8 planar tiles
+
+    Tiles are generated from left to right and top to bottom.
+    With interleave each row of a tile is stored as one byte per plane
+    (Game Boy and Master System), otherwise each plane is stored as
+    8 consecutive bytes (NES).
+
+    :param bytes pixels: the image data (as returned by PIL's tobytes() for 'P' images)
+    :param int width: the width of the image (must be a multiple of 8)
+    :param int bpp: the number of planes
+    :param bool interleave: interleave planes for each row
+    :rtype: bytes
+    """
+    planes = [pixels.translate(_PLANE_TABLES[plane]) for plane in range(bpp)]
+    height = len(pixels) // width
+    blob = []
+    for cell_y in range(0, height, 8):
+        for cell_x in range(0, width, 8):
+            offsets = [(cell_y + y) * width + cell_x for y in range(0, 8)]
+            rows = [[(int.from_bytes(plane[offset:offset+8], 'big') * _GATHER_BITS >> 56) & 0xFF
+                     for offset in offsets] for plane in planes]
+            if interleave:
+                for values in zip(*rows):
+                    blob.extend(values)
+            else:
+                for row in rows:
+                    blob.extend(row)
+    return bytes(blob)
+
+
+def max_palette_index(pixels):
+    """Returns the highest palette index used by the pixels (0 for empty images)
+
+    :param bytes pixels: the image data
+    :rtype: int
+    """
+    if not pixels:
+        return 0
+    return max(pixels)
+
+
+def open_image(data):
+    """Loads an image (requires PIL) from the content of a file
+
+    :param bytes data: the content of the image file
+    :rtype: PIL.Image.Image
+    """
+    from PIL import Image
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+def split_tiles(pixels, width):
+    """Splits the pixels of an image in 8x8 cells (64 bytes each, left to right and top to bottom)
+
+    :param bytes pixels: the image data
+    :param int width: the width of the image (must be a multiple of 8)
+    :rtype: list
+    """
+    height = len(pixels) // width
+    tiles = []
+    for cell_y in range(0, height, 8):
+        for cell_x in range(0, width, 8):
+            offset = cell_y * width + cell_x
+            tiles.append(b''.join([pixels[offset + y * width:offset + y * width + 8]
+                                   for y in range(0, 8)]))
+    return tiles
+
+
+def flip_tile(tile, horizontal, vertical):
+    """Mirrors an 8x8 cell
+
+    :param bytes tile: the 64 pixels of the cell
+    :param bool horizontal: mirror left to right
+    :param bool vertical: mirror top to bottom
+    :rtype: bytes
+    """
+    rows = [tile[y * 8:y * 8 + 8] for y in range(0, 8)]
+    if horizontal:
+        rows = [row[::-1] for row in rows]
+    if vertical:
+        rows.reverse()
+    return b''.join(rows)
+
+
+def deduplicate_tiles(tiles, flip=False):
+    """Removes duplicated cells, returns the unique cells and a map entry for each original cell
+
+    Map entries are (index, horizontal_flip, vertical_flip) tuples,
+    flips are only detected when flip is True.
+
+    :param list tiles: the cells as returned by split_tiles()
+    :param bool flip: detect mirrored cells
+    :rtype: tuple
+    """
+    unique = []
+    entries = []
+    known = {}
+    for tile in tiles:
+        if tile in known:
+            entries.append(known[tile])
+            continue
+        index = len(unique)
+        unique.append(tile)
+        entry = (index, False, False)
+        known[tile] = entry
+        entries.append(entry)
+        if flip:
+            # register the mirrored versions too, so that lookups stay O(1)
+            for horizontal, vertical in ((True, False), (False, True), (True, True)):
+                known.setdefault(flip_tile(tile, horizontal, vertical),
+                                 (index, horizontal, vertical))
+    return unique, entries
+
+
+def encode_planar_tiles_list(tiles, bpp, interleave=True):
+    """Converts a list of 8x8 cells to planar tiles
+
+    :param list tiles: the cells (64 bytes each)
+    :param int bpp: the number of planes
+    :param bool interleave: interleave planes for each row
+    :rtype: bytes
+    """
+    # a list of cells is just an 8 pixels wide image
+    return encode_planar_tiles(b''.join(tiles), 8, bpp, interleave)
+
+
+# from lightest to darkest (Game Boy and NES)
+GRAYSCALE_PALETTE = ((0xFF, 0xFF, 0xFF), (0xAA, 0xAA, 0xAA),
+                     (0x55, 0x55, 0x55), (0x00, 0x00, 0x00))
+
+
+def _rgba_colors(rgba):
+    # one integer per pixel, built in C
+    colors = array('I')
+    colors.frombytes(rgba)
+    return colors
+
+
+def _unpack_color(color):
+    return tuple(color.to_bytes(4, sys.byteorder))
+
+
+def unique_colors(rgba):
+    """Returns the (r, g, b, a) colors used by an RGBA image, in order of appearance
+
+    :param bytes rgba: the image data (4 bytes per pixel)
+    :rtype: list
+    """
+    return [_unpack_color(color) for color in dict.fromkeys(_rgba_colors(rgba))]
+
+
+def quantize_pixels(rgba, palette, transparent_index=0, first_index=0):
+    """Maps every pixel of an RGBA image to the index of the nearest palette color
+
+    The nearest color is searched only once for each distinct color of the
+    image, pixels are then translated with a single lookup.
+    Pixels with alpha lower than 128 are mapped to transparent_index.
+
+    :param bytes rgba: the image data (4 bytes per pixel)
+    :param tuple palette: (r, g, b) tuples
+    :param int transparent_index: the index for transparent pixels
+    :param int first_index: the first index used for opaque pixels (1 when 0 is reserved for transparency)
+    :rtype: bytes
+    """
+    colors = _rgba_colors(rgba)
+    lookup = {}
+    for color in set(colors):
+        red, green, blue, alpha = _unpack_color(color)
+        if alpha < 128:
+            lookup[color] = transparent_index
+            continue
+        distances = [(red - r) ** 2 + (green - g) ** 2 + (blue - b) ** 2
+                     for r, g, b in palette[first_index:]]
+        lookup[color] = first_index + distances.index(min(distances))
+    return bytes(map(lookup.__getitem__, colors))
+
+
+def parse_tiles_options(assembler, instr, flags=(), base_bits=None):
+    """Parses the arguments of image directives: filename followed by flags and (optionally) a base tile index
+
+    :param assembler.Assembler assembler: the assembler
+    :param statements.Directive instr: the directive
+    :param tuple flags: the allowed (uppercase) flags
+    :param int base_bits: size of the base tile index (None if not allowed)
+    :rtype: tuple
+    """
+    if len(instr.tokens) < 2:
+        raise InvalidArgumentsForDirective(instr)
+    options = set()
+    base = 0
+    for token in instr.tokens[2:]:
+        if token.upper() in flags:
+            options.add(token.upper())
+            continue
+        if base_bits is None:
+            raise InvalidArgumentsForDirective(instr)
+        base = assembler.parse_integer(token, base_bits, False)
+        if base is None:
+            raise InvalidArgumentsForDirective(instr)
+    return assembler.stringify(instr.tokens[1]), options, base
@@ -1,6 +1,56 @@
 '''Exposes the assembly source code tokenization features'''
+import re
 from necroassembler.statements import Instruction, Directive, Label
 
+# brackets are tokens, spaces separate tokens
+_OPERAND_SPLITTER = re.compile(r'([()\[\]{}])|\s+')
+
+CONDITIONAL_DIRECTIVES = ('if', 'ifdef', 'ifndef', 'else', 'endif')
+
+_CONDITIONAL_LINE = re.compile(r'^[ \t]*\.(?:{0})\b.*$'.format('|'.join(CONDITIONAL_DIRECTIVES)),
+                               re.IGNORECASE | re.MULTILINE)
+
+
+def split_conditionals(code, line=1):
+    """Splits code in blocks of lines at the conditional directives (.if, .ifdef, .ifndef, .else, .endif)
+
+    Conditional directives are found with a regular expression (they must
+    be the first token of their line), so blocks can be skipped without
+    tokenizing them. Returns (first_line, code, is_conditional) tuples.
+
+    :param str code: the source code
+    :param int line: the line number of the first line of code
+    :rtype: list
+    """
+    blocks = []
+    position = 0
+    for match in _CONDITIONAL_LINE.finditer(code):
+        if match.start() > position:
+            blocks.append((line, code[position:match.start()], False))
+            line += code.count('\n', position, match.start())
+        blocks.append((line, match.group(0), True))
+        position = match.end()
+    if position < len(code) or not blocks:
+        blocks.append((line, code[position:], False))
+    return blocks
+
+
+def split_operands(operands):
+    """Splits already separated operands in tokens (like the Tokenizer would do)
+
+    :param tuple operands: the operands (strings are kept as is when quoted, other values are converted with str())
+    :rtype: list
+    """
+    tokens = []
+    for operand in operands:
+        if not isinstance(operand, str):
+            tokens.append(str(operand))
+        elif operand[0:1] in ('"', '\''):
+            tokens.append(operand)
+        else:
+            tokens.extend([token for token in _OPERAND_SPLITTER.split(operand) if token])
+    return tokens
+
 
 class InvalidLabel(Exception):
     '''Raised when a label is specified after other tokens'''
@@ -0,0 +1,93 @@
+'''Assembler tracing (used by the .log directive)'''
+import sys
+from collections import deque
+
+STATEMENT = 0
+FIXUP = 1
+
+
+class Trace:
+    '''Base trace sink, every event is silently discarded'''
+
+    def statement(self, context, line, address, blob, tokens):
+        """Called after a statement has been assembled
+
+        :param str context: the source file (or None)
+        :param int line: the line of the statement
+        :param int address: the offset of the statement in the assembled bytes
+        :param bytes blob: the generated bytes (can be empty)
+        :param tuple tokens: the tokens of the statement (defines already substituted)
+        """
+
+    def fixup(self, label, address, blob):
+        """Called after a label has been resolved by the linker
+
+        :param str label: the label (math formula included)
+        :param int address: the offset of the fixup in the assembled bytes
+        :param bytes blob: the patched bytes
+        """
+
+    def dump(self, output=None):
+        """Writes the recorded events in human readable form
+
+        :param output: a text file object (defaults to stdout)
+        """
+
+
+class TraceCallback(Trace):
+    '''Forwards every event (as a tuple) to a callable'''
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def statement(self, context, line, address, blob, tokens):
+        self.callback((STATEMENT, context, line, address, blob, tokens))
+
+    def fixup(self, label, address, blob):
+        self.callback((FIXUP, label, address, blob))
+
+
+class TraceBuffer(Trace):
+    '''Records events as tuples in a ring buffer (unbounded if size is None)'''
+
+    def __init__(self, size=None):
+        self.events = deque(maxlen=size)
+
+    def statement(self, context, line, address, blob, tokens):
+        self.events.append((STATEMENT, context, line, address, blob, tokens))
+
+    def fixup(self, label, address, blob):
+        self.events.append((FIXUP, label, address, blob))
+
+    def clear(self):
+        self.events.clear()
+
+    def __len__(self):
+        return len(self.events)
+
+    def dump(self, output=None):
+        if output is None:
+            output = sys.stdout
+        for event in self.events:
+            output.write(format_event(event) + '\n')
+
+
+def format_event(event):
+    """Builds the human readable representation of a trace event
+
+    :param tuple event: the event as recorded by a trace sink
+    :rtype: str
+    """
+    if event[0] == FIXUP:
+        _, label, address, blob = event
+        return 'label "{0}" translated to ({1}) at address 0x{2:x}'.format(
+            label, ','.join(['0x{0:02x}'.format(x) for x in blob]), address)
+    _, context, line, address, blob, tokens = event
+    if context is not None:
+        where = 'at line {0} of {1}: {2}'.format(line, context, list(tokens))
+    else:
+        where = 'at line {0}: {1}'.format(line, list(tokens))
+    if not blob:
+        return 'not assembled {0}'.format(where)
+    return 'assembled {0} -> ({1}) at 0x{2:x}'.format(
+        where, ','.join(['0x{0:02x}'.format(x) for x in blob]), address)
@@ -72,6 +72,27 @@ def pack(fmt, *args):
     return struct.pack(fmt, *[n if n is not None else 0 for n in args])
 
 
+class LabelFilter:
+    '''Label filter computing (value >> shift) & mask
+
+    Use it instead of lambdas, so linkers can inspect the filter
+    (for choosing relocation types).
+    '''
+
+    def __init__(self, shift=0, mask=None):
+        self.shift = shift
+        self.mask = mask
+
+    def __call__(self, value):
+        value >>= self.shift
+        if self.mask is not None:
+            value &= self.mask
+        return value
+
+    def __repr__(self):
+        return 'LabelFilter({0}, {1})'.format(self.shift, self.mask)
+
+
 def pack_bits(base, *args):
     for arg in args:
         (end, start), value = arg
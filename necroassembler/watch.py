@@ -0,0 +1,82 @@
+'''Watch mode: builds again every time one of the files read by the previous build changes'''
+import os
+import time
+from necroassembler.cache import MemoryAssetCache, TokenCache
+
+# seconds between checks of the modification times
+POLL_INTERVAL = 0.5
+
+
+def file_mtime(filename):
+    """Returns the modification time of a file (None if it does not exist)
+
+    :param str filename: the file
+    :rtype: int
+    """
+    try:
+        return os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
+
+
+def changed_files(mtimes):
+    """Returns the files whose modification time is different from the recorded one
+
+    :param dict mtimes: the modification time of each file (as returned by file_mtime())
+    :rtype: list
+    """
+    return [filename for filename, mtime in mtimes.items() if file_mtime(filename) != mtime]
+
+
+def watch(assembler, build, interval=POLL_INTERVAL, max_builds=None):
+    """Runs build() now and every time one of the files read by the assembler changes
+
+    The assembler is reset() before every build. Unchanged code is not
+    tokenized again and converted assets are kept in memory (unless
+    the assembler already has an asset cache).
+    Build errors are printed and the files read until the error are watched.
+
+    :param assembler.Assembler assembler: the assembler used by build()
+    :param callable build: the function assembling and saving the output
+    :param float interval: seconds between checks
+    :param int max_builds: stop after this number of builds (None for running until interrupted)
+    """
+    assembler.token_cache = TokenCache()
+    if assembler.asset_cache is None:
+        assembler.asset_cache = MemoryAssetCache()
+    mtimes = {}
+    builds = 0
+    try:
+        while True:
+            # files modified during the build must trigger another build
+            previous = {filename: file_mtime(filename) for filename in mtimes}
+            assembler.reset()
+            # same unit of file_mtime() (time.time_ns() requires python 3.7)
+            start_time = int(time.time() * 1000000000)
+            start = time.perf_counter()
+            try:
+                build()
+                print('build completed in {0:.3f}s ({1}, {2})'.format(
+                    time.perf_counter() - start, assembler.token_cache.stats(), assembler.asset_cache.stats()))
+            except Exception as exc:
+                print('build failed in {0:.3f}s: {1}'.format(time.perf_counter() - start, exc))
+            assembler.token_cache.prune()
+            mtimes = {}
+            for filename in assembler.input_files:
+                if filename in previous:
+                    mtimes[filename] = previous[filename]
+                else:
+                    mtime = file_mtime(filename)
+                    # new dependency modified after the start of the build
+                    mtimes[filename] = mtime if mtime is None or mtime < start_time else -1
+            builds += 1
+            if max_builds is not None and builds >= max_builds:
+                return
+            while True:
+                changed = changed_files(mtimes)
+                if changed:
+                    print('changed: {0}'.format(', '.join(changed)))
+                    break
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
@@ -1,7 +1,13 @@
+import os
+import re
 from setuptools import setup
 
+# the version is defined only in the package (it is part of the build cache keys)
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'necroassembler', '__init__.py')) as handle:
+    version = re.search(r"^__version__ = '([^']+)'", handle.read(), re.M).group(1)
+
 setup(name='necroassembler',
-      version='0.8',
+      version=version,
       description='framework for building assemblers',
       url='https://github.com/rdeioris/necroassembler/',
       author='Roberto De Ioris',
@@ -22,7 +28,10 @@ setup(name='necroassembler',
               'necro_z80=necroassembler.cpu.z80:AssemblerZ80.main',
               'necro_m68k=necroassembler.cpu.mc68000:AssemblerMC68000.main',
               'necro_8086=necroassembler.cpu.intel8086:AssemblerIntel8086.main',
-              'necro_genesis=necroassembler.platforms.genesis:main'
+              'necro_genesis=necroassembler.platforms.genesis:main',
+              'necro_link=necroassembler.objects:main',
+              'necro_server=necroassembler.server:main',
+              'necro_client=necroassembler.server:client_main'
           ],
       },
       test_suite='tests',
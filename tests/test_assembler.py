@@ -1,7 +1,13 @@
+import os
+import tempfile
 import unittest
 from necroassembler import Assembler, opcode
 from necroassembler.utils import pack_be32u, pack_bits
-from necroassembler.exceptions import UnsupportedNestedMacro, LabelNotAllowedInMacro, NotInBitRange, UnknownLabel
+from necroassembler.exceptions import (UnsupportedNestedMacro, LabelNotAllowedInMacro, NotInBitRange, UnknownLabel,
+                                       UnknownInstruction, InvalidArgumentsForDirective, NotInConditionalBlock, UnterminatedConditionalBlock,
+                                       ConditionalNotAllowedInMacro)
+from necroassembler.trace import TraceBuffer, format_event, STATEMENT, FIXUP
+from necroassembler.report import size_report
 
 
 class TestAssembler(unittest.TestCase):
@@ -96,6 +102,13 @@ class TestAssembler(unittest.TestCase):
         """
         self.assertRaises(LabelNotAllowedInMacro, self.asm.assemble, code)
 
+    def test_macro_error(self):
+        self.asm.assemble('.macro WRONG value\nLOAD value\nUNKNOWN\n.endmacro')
+        self.assertRaises(UnknownInstruction, self.asm.assemble, 'WRONG 1')
+        self.assertIsNone(self.asm.current_macro)
+        self.assertEqual([instr.tokens for instr in self.asm.macros['WRONG'].instructions],
+                         [['LOAD', 'value'], ['UNKNOWN']])
+
     def test_pack_bits(self):
         self.assertEqual(pack_bits(0b00000000000,
                                    ((2, 0), 3),
@@ -225,3 +238,358 @@ class TestAssembler(unittest.TestCase):
     def test_upto_after_goto(self):
         self.asm.assemble('.org 1\n.db 0\n.org 10\n.upto 100')
         self.assertEqual(len(self.asm.assembled_bytes), 101)
+
+    def test_log_trace(self):
+        self.asm.assemble('.log\nstart:\nLOAD start\n.log off\nLOAD 0x17')
+        self.asm.link()
+        self.assertEqual(list(self.asm.trace.events), [
+            (STATEMENT, None, 1, 0, b'', ('.log',)),
+            (STATEMENT, None, 2, 0, b'', ('start',)),
+            (STATEMENT, None, 3, 0, b'\xAA\xBB\xCC\xDD\x00\x00\x00\x00', ('LOAD', 'start'))])
+        self.assertEqual(format_event(self.asm.trace.events[2]),
+                         "assembled at line 3: ['LOAD', 'start'] -> "
+                         "(0xaa,0xbb,0xcc,0xdd,0x00,0x00,0x00,0x00) at 0x0")
+
+    def test_log_trace_ring_buffer(self):
+        self.asm.trace = TraceBuffer(2)
+        self.asm.assemble('.log\n.db 1\n.db 2\nstart:\n.dd start')
+        self.asm.link()
+        self.assertEqual(list(self.asm.trace.events), [
+            (STATEMENT, None, 5, 2, b'\x00\x00\x00\x00', ('.dd', 'start')),
+            (FIXUP, 'start', 2, b'\x00\x00\x00\x02')])
+        self.assertEqual(format_event(self.asm.trace.events[1]),
+                         'label "start" translated to (0x00,0x00,0x00,0x02) at address 0x2')
+
+    def test_size_report(self):
+        self.asm.assemble("""
+        .macro TWICE
+        LOAD 1
+        LOAD 2
+        .endmacro
+        .section code RX
+        start:
+        TWICE
+        .db 1
+        data:
+        .db 2, 3
+        """, context='main.S')
+        report = size_report(self.asm)
+        self.assertEqual(report['total'], 19)
+        self.assertEqual(report['labels'], [
+            {'name': 'start', 'address': 0, 'offset': 0, 'size': 17},
+            {'name': 'data', 'address': 17, 'offset': 17, 'size': 2}])
+        self.assertEqual(report['files'], {'main.S': 19})
+        self.assertEqual(report['macros'], {'TWICE': 16})
+        self.assertEqual(report['sections'], {'code': 19})
+
+    def test_symbols_index(self):
+        self.asm.assemble('.org 0x10\nfirst:\n.db 1\nsecond: .db 2\n.org 0x100\nthird:\n')
+        self.assertEqual(self.asm.get_symbol_at(0x11), (0x11, 'second'))
+        self.assertEqual(self.asm.get_symbol_at(0x50), (0x11, 'second'))
+        self.assertIsNone(self.asm.get_symbol_at(0x0F))
+        self.assertEqual(self.asm.get_symbols_in_range(0x10, 0x100),
+                         [(0x10, 'first'), (0x11, 'second'), (0x100, 'third')])
+        # the index is updated incrementally
+        self.asm.assemble('.org 0x50\nmiddle:\n')
+        self.assertEqual(self.asm.get_symbols_in_range(0x11, 0x50),
+                         [(0x11, 'second'), (0x50, 'middle')])
+        # replaced labels and direct changes invalidate the index
+        self.asm.add_label('middle', dict(self.asm.labels['second']))
+        self.assertEqual(self.asm.get_symbols_in_range(0x11, 0x50), [(0x11, 'middle'), (0x11, 'second')])
+        del self.asm.labels['middle']
+        self.asm.invalidate_symbols()
+        self.assertEqual(self.asm.get_symbol_at(0x50), (0x11, 'second'))
+
+    def test_size_report_index(self):
+        self.asm.assemble('.org 0x100\nhigh:\n.db 1, 2\n.org 0x10\nlow:\n.db 3')
+        self.assertEqual(self.asm.get_symbols_by_offset(), [(0, 'high'), (2, 'low')])
+        self.assertEqual(size_report(self.asm)['labels'], [
+            {'name': 'high', 'address': 0x100, 'offset': 0, 'size': 2},
+            {'name': 'low', 'address': 0x10, 'offset': 2, 'size': 1}])
+        # the report follows the incrementally updated index
+        self.asm.assemble('end:\n.db 4')
+        self.assertEqual(size_report(self.asm)['labels'][-1],
+                         {'name': 'end', 'address': 0x11, 'offset': 3, 'size': 1})
+
+    def _write_temp(self, content):
+        handle, filename = tempfile.mkstemp()
+        with os.fdopen(handle, 'w') as temp:
+            temp.write(content)
+        self.addCleanup(os.unlink, filename)
+        return filename
+
+    def test_inccsv_size_endianness(self):
+        filename = self._write_temp('1,2,0x0304\n-1\n')
+        self.asm.assemble('.inccsv "{0}", 2, le'.format(filename))
+        self.assertEqual(self.asm.assembled_bytes,
+                         b'\x01\x00\x02\x00\x04\x03\xff\xff')
+
+    def test_inccsv_default_endianness(self):
+        filename = self._write_temp('1,2\n')
+        self.asm.assemble('.inccsv "{0}", 4'.format(filename))
+        self.assertEqual(self.asm.assembled_bytes,
+                         b'\x00\x00\x00\x01\x00\x00\x00\x02')
+
+    def test_inccsv_columns(self):
+        filename = self._write_temp('1,2,3\n\n4,5,6,\n  \n')
+        self.asm.assemble('.inccsv "{0}", 1, le, 2, 0'.format(filename))
+        self.assertEqual(self.asm.assembled_bytes, b'\x03\x01\x06\x04')
+
+    def test_inccsv_columns_keyword(self):
+        filename = self._write_temp('1,2,3\r\n4,5,6\r\n')
+        self.asm.assemble('.inccsv "{0}", columns, 2\n.inccsv "{0}", 2, COLUMNS, 1'.format(filename))
+        self.assertEqual(self.asm.assembled_bytes, b'\x03\x06\x00\x02\x00\x05')
+        self.assertRaises(InvalidArgumentsForDirective, self.asm.assemble, '.inccsv "{0}", columns'.format(filename))
+
+    def test_inccsv_out_of_range(self):
+        filename = self._write_temp('1,256\n')
+        self.assertRaises(NotInBitRange, self.asm.assemble, '.inccsv "{0}"'.format(filename))
+
+    def test_incjson_size(self):
+        filename = self._write_temp('{"level": {"data": [1, "0x0203", 65535]}}')
+        self.asm.assemble('.incjson "{0}", level.data, 2'.format(filename))
+        self.assertEqual(self.asm.assembled_bytes, b'\x00\x01\x02\x03\xff\xff')
+
+    def test_incjson_not_integer(self):
+        for values in ('[1, 2.5]', '[2.0]', '["1", 2.5]', '[true]', '[[1]]'):
+            filename = self._write_temp('{{"data": {0}}}'.format(values))
+            self.asm.reset()
+            self.assertRaises(InvalidArgumentsForDirective, self.asm.assemble, '.incjson "{0}", data'.format(filename))
+
+    def _write_temp_binary(self, content):
+        handle, filename = tempfile.mkstemp()
+        with os.fdopen(handle, 'wb') as temp:
+            temp.write(content)
+        self.addCleanup(os.unlink, filename)
+        return filename
+
+    def test_incbin(self):
+        filename = self._write_temp_binary(bytes(range(0, 16)))
+        self.asm.assemble('.incbin "{0}"\n.incbin "{0}", 14'.format(filename))
+        self.assertEqual(self.asm.assembled_bytes, bytes(range(0, 16)) + b'\x0e\x0f')
+        self.assertEqual(len(self.asm.mapped_files), 1)
+        self.asm.link()
+        self.assertEqual(self.asm.mapped_files, {})
+
+    def test_incbin_slice_stride(self):
+        filename = self._write_temp_binary(bytes(range(0, 16)))
+        self.asm.assemble('.incbin "{0}", 2, 3\n.incbin "{0}", 1, 4, 4'.format(filename))
+        self.assertEqual(self.asm.assembled_bytes, b'\x02\x03\x04\x01\x05\x09\x0d')
+        self.asm.close_mapped_files()
+
+    def test_incbin_out_of_range(self):
+        filename = self._write_temp_binary(bytes(range(0, 16)))
+        self.assertRaises(InvalidArgumentsForDirective, self.asm.assemble,
+                          '.incbin "{0}", 1, 4, 5'.format(filename))
+        self.asm.close_mapped_files()
+
+    def test_incbin_empty(self):
+        filename = self._write_temp_binary(b'')
+        self.asm.assemble('.incbin "{0}"'.format(filename))
+        self.assertEqual(self.asm.assembled_bytes, b'')
+
+    def test_reset(self):
+        self.asm.assemble('.define VALUE 1\n.org 0x100\nstart:\n.db VALUE\n.macro test\n.endmacro')
+        self.asm.bits = 16
+        self.asm.reset()
+        self.assertEqual(self.asm.assembled_bytes, b'')
+        self.assertEqual(self.asm.labels, {})
+        self.assertEqual(self.asm.macros, {})
+        self.assertEqual(self.asm.pc, 0)
+        self.assertNotIn('VALUE', self.asm.defines)
+        self.assertFalse(hasattr(self.asm, 'bits'))
+        self.asm.assemble('start:\n.dw start')
+        self.asm.link()
+        self.assertEqual(self.asm.assembled_bytes, b'\x00\x00')
+
+    def test_assemble_many(self):
+        self.assertEqual(self.asm.assemble_many(['.db 1\nend:', '.db 2, 3\nend:\n.db end']),
+                         [b'\x01', b'\x02\x03\x02'])
+
+    def test_assemble_many_log(self):
+        self.asm.assemble_many(['.log\n.db 1', '.db 2'])
+        # logging is enabled only for the first snippet
+        self.assertFalse(self.asm.log)
+        self.assertIsNone(self.asm.trace)
+
+    def test_emit(self):
+        self.asm.emit_directive('org', '0x10', '0x17')
+        self.asm.emit_label('start')
+        self.asm.emit('LOAD', 'start')
+        self.asm.emit_directive('.db', '"a"', 1)
+        self.asm.link()
+        code = '.org 0x10 0x17\nstart:\nLOAD start\n.db "a", 1'
+        asm = self.AssemblerDumb()
+        asm.assemble(code)
+        asm.link()
+        self.assertEqual(self.asm.assembled_bytes, asm.assembled_bytes)
+        self.assertEqual(self.asm.labels, asm.labels)
+
+    def test_emit_error_context(self):
+        with self.assertRaises(InvalidArgumentsForDirective) as context:
+            self.asm.emit_directive('org', line=17, context='generator')
+        self.assertIn('at line 17 of generator', str(context.exception))
+
+    def _reassemble_source(self):
+        lines = ['.define BASE 0x10', '.macro TWICE', 'LOAD 1', 'LOAD 2', '.endmacro']
+        for index in range(0, 40):
+            lines.append('label{0}: LOAD label{1}'.format(index, (index * 7) % 40))
+            lines.append('  .db BASE, {0} ; comment'.format(index))
+            if index % 10 == 0:
+                lines.append('TWICE')
+            if index % 10 == 5:
+                lines += ['.if BASE == 0x10', '.db 0x10', '.else', '.db 0x20', '.endif']
+        return lines
+
+    def _check_reassemble(self, lines, new_lines, line):
+        self.asm.checkpoint_interval = 8
+        self.asm.assemble('\n'.join(lines))
+        self.asm.link()
+        self.asm.reassemble('\n'.join(new_lines), line)
+        self.asm.link()
+        asm = self.AssemblerDumb()
+        asm.assemble('\n'.join(new_lines))
+        asm.link()
+        self.assertEqual(self.asm.assembled_bytes, asm.assembled_bytes)
+        self.assertEqual(self.asm.labels, asm.labels)
+        self.assertEqual(self.asm.defines, asm.defines)
+
+    def test_reassemble_edit(self):
+        lines = self._reassemble_source()
+        for line in (1, 6, 30, 57, len(lines)):
+            new_lines = list(lines)
+            new_lines[line - 1] += '\nedit{0}: .db 0xff\n.define BASE 0x20'.format(line)
+            self.setUp()
+            self._check_reassemble(lines, new_lines, line)
+            self.assertGreater(len(self.asm.checkpoints), 5)
+
+    def test_reassemble_delete(self):
+        lines = self._reassemble_source()
+        self._check_reassemble(lines, lines[0:41] + lines[42:], 42)
+
+    def test_reassemble_append(self):
+        lines = self._reassemble_source()
+        self._check_reassemble(lines, lines + ['end: LOAD end'], len(lines) + 1)
+
+    def test_reassemble_without_checkpoints(self):
+        self.asm.assemble('LOAD 1')
+        self.asm.reassemble('LOAD 2', 1)
+        self.assertEqual(self.asm.assembled_bytes, b'\xAA\xBB\xCC\xDD\x00\x00\x00\x02')
+
+    def test_ifdef(self):
+        self.asm.assemble('''
+        .define DEBUG 1
+        .ifdef DEBUG
+        .db 1
+        .else
+        .db 2
+        .endif
+        .ifndef DEBUG
+        .db 3
+        .else
+        .db 4
+        .endif
+        ''')
+        self.assertEqual(self.asm.assembled_bytes, b'\x01\x04')
+
+    def test_if_expression(self):
+        self.asm.assemble('''
+        .define LEVEL 3
+        .if LEVEL
+        .db 1
+        .endif
+        .if LEVEL >= 4
+        .db 2
+        .endif
+        .if LEVEL+1 == 4
+        .db 3
+        .endif
+        .if 0
+        .db 4
+        .else
+        .db 5
+        .endif
+        ''')
+        self.assertEqual(self.asm.assembled_bytes, b'\x01\x03\x05')
+
+    def test_if_nested(self):
+        self.asm.assemble('''
+        .if 0
+          .if 1
+          .db 1
+          .else
+          .db 2
+          .endif
+        .else
+          .if 1
+          .db 3
+          .else
+          .db 4
+          .endif
+        .endif
+        ''')
+        self.assertEqual(self.asm.assembled_bytes, b'\x03')
+
+    def test_if_disabled_not_tokenized(self):
+        self.asm.assemble('''
+        .ifdef DEBUG
+        LOAD invalid: label
+        UNKNOWN 1, 2
+        .define OTHER 1
+        .else
+        start: .db 0x17
+        .endif''')
+        self.assertEqual(self.asm.assembled_bytes, b'\x17')
+        self.assertNotIn('OTHER', self.asm.defines)
+        self.assertIn('start', self.asm.labels)
+
+    def test_if_same_line_of_label(self):
+        self.asm.assemble('start: .if 0\n.db 1\nnext:\n.endif\n.db 2')
+        self.assertEqual(self.asm.assembled_bytes, b'\x02')
+        self.assertNotIn('next', self.asm.labels)
+
+    def test_if_emit(self):
+        self.asm.emit_directive('if', 0)
+        self.asm.emit('LOAD', 1)
+        self.asm.emit_directive('endif')
+        self.asm.emit_directive('db', 1)
+        self.asm.link()
+        self.assertEqual(self.asm.assembled_bytes, b'\x01')
+
+    def test_if_errors(self):
+        self.assertRaises(NotInConditionalBlock, self.asm.assemble, '.endif')
+        self.asm.reset()
+        self.assertRaises(ConditionalNotAllowedInMacro, self.asm.assemble,
+                          '.macro TEST\n.ifdef DEBUG\nLOAD 1\n.endif\n.endmacro')
+        self.asm.reset()
+        self.asm.assemble('.ifdef DEBUG\n.macro TEST\nLOAD 1\n.endmacro\n.else\n.macro TEST\n.endmacro\n.endif\nTEST')
+        self.assertEqual(self.asm.assembled_bytes, b'')
+        self.asm.reset()
+        self.assertRaises(NotInConditionalBlock, self.asm.assemble, '.else')
+        self.asm.reset()
+        self.assertRaises(NotInConditionalBlock, self.asm.assemble, '.if 1\n.else\n.else')
+        self.asm.reset()
+        self.assertRaises(InvalidArgumentsForDirective, self.asm.assemble, '.if UNKNOWN')
+        self.asm.reset()
+        self.assertRaises(InvalidArgumentsForDirective, self.asm.assemble, '.if 1 = 1')
+        self.asm.reset()
+        self.asm.assemble('.if 1')
+        self.assertRaises(UnterminatedConditionalBlock, self.asm.link)
+
+    def test_include_once(self):
+        filename = self._write_temp('.define HEADER 0x17\n.db HEADER')
+        alias = os.path.join(os.path.dirname(filename), '.', os.path.basename(filename))
+        self.asm.assemble('.include_once "{0}"\n.include_once "{1}"\n.db HEADER'.format(filename, alias))
+        self.assertEqual(self.asm.assembled_bytes, b'\x17\x17')
+        self.assertEqual(list(self.asm.input_files), [filename])
+
+    def test_include_cached(self):
+        filename = self._write_temp('.db 1\n.ifdef TWICE\n.db 2\n.endif')
+        self.asm.assemble('.include "{0}"\n.define TWICE 1\n.include "{0}"\n.include_once "{0}"'.format(filename))
+        self.assertEqual(self.asm.assembled_bytes, b'\x01\x01\x02')
+        # the file is read once, every block is tokenized once
+        self.assertEqual(list(self.asm.include_sources), [os.path.realpath(filename)])
+        self.assertEqual(self.asm.include_tokens.misses, 4)
+        self.assertEqual(self.asm.include_tokens.hits, 3)
+        self.asm.reset()
+        self.assertEqual(self.asm.include_sources, {})
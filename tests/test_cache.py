@@ -0,0 +1,159 @@
+import os
+import tempfile
+import unittest
+from necroassembler import Assembler, asset
+from necroassembler.cache import BaseAssetCache, AssetCache, MemoryAssetCache, BuildCache, asset_converter
+from necroassembler.exceptions import LabelNotAllowed
+
+
+@asset_converter(1)
+def convert_reverse(data, repeat):
+    return data[::-1] * repeat
+
+
+class AssemblerReverse(Assembler):
+
+    @asset('reverse')
+    def _reverse(self, instr):
+        return self.stringify(instr.tokens[1]), convert_reverse, (int(instr.tokens[2]),)
+
+
+class TestAssetCache(unittest.TestCase):
+
+    class AssemblerDumb(Assembler):
+        hex_prefixes = ('0x',)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.csv = os.path.join(self.directory.name, 'data.csv')
+        with open(self.csv, 'w') as handle:
+            handle.write('1,2,0x03\n4,5,6\n')
+        self.cache = AssetCache(os.path.join(self.directory.name, 'cache'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _assemble(self, code):
+        asm = self.AssemblerDumb()
+        asm.asset_cache = self.cache
+        asm.assemble(code.format(self.csv))
+        return asm.assembled_bytes
+
+    def test_hit(self):
+        self.assertEqual(self._assemble('.inccsv "{0}"'), b'\x01\x02\x03\x04\x05\x06')
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+        self.assertEqual(self._assemble('.inccsv "{0}"'), b'\x01\x02\x03\x04\x05\x06')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_directive_in_key(self):
+        self._assemble('.inccsv "{0}"')
+        self.assertEqual(self._assemble('.inccsv_le16 "{0}"'),
+                         b'\x01\x00\x02\x00\x03\x00\x04\x00\x05\x00\x06\x00')
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+
+    def test_memory(self):
+        self.cache = MemoryAssetCache()
+        self._assemble('.inccsv "{0}"')
+        self.assertEqual(self._assemble('.inccsv "{0}"'), b'\x01\x02\x03\x04\x05\x06')
+        self.assertEqual(self.cache.stats(), 'asset cache: 1 hits, 1 misses')
+
+    def test_abstract(self):
+        self.assertRaises(TypeError, BaseAssetCache)
+
+    def test_content_change(self):
+        self._assemble('.inccsv "{0}"')
+        with open(self.csv, 'w') as handle:
+            handle.write('7\n')
+        self.assertEqual(self._assemble('.inccsv "{0}"'), b'\x07')
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+
+    def test_error_context(self):
+        with open(self.csv, 'w') as handle:
+            handle.write('label\n')
+        with self.assertRaises(LabelNotAllowed) as context:
+            self._assemble('.inccsv "{0}"')
+        self.assertIn('at line 1', str(context.exception))
+
+    def test_process_pool(self):
+        asm = AssemblerReverse()
+        asm.asset_workers = 2
+        files = []
+        for index in range(0, 4):
+            files.append(os.path.join(self.directory.name, 'file{0}'.format(index)))
+            with open(files[-1], 'wb') as handle:
+                handle.write(bytes([index, index + 1]))
+        code = '\n'.join(['.db 255\n.reverse "{0}" {1}'.format(filename, index + 1)
+                          for index, filename in enumerate(files)])
+        asm.assemble(code)
+        self.assertIsNotNone(asm.asset_pool)
+        self.assertEqual(len(asm.pending_assets), 0)
+        asm.shutdown_asset_pool()
+        self.assertEqual(asm.assembled_bytes,
+                         b'\xff\x01\x00\xff\x02\x01\x02\x01\xff' +
+                         b'\x03\x02' * 3 + b'\xff' + b'\x04\x03' * 4)
+
+
+class TestBuildCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.include = self._path('include.S')
+        self.source = self._path('main.S')
+        self.output = self._path('out.bin')
+        self._write(self.include, '.db 2')
+        self._write(self.source, '.db 1\n.include "{0}"'.format(self.include))
+        self.cache = BuildCache(self._path('cache'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def _write(self, filename, content):
+        with open(filename, 'w') as handle:
+            handle.write(content)
+
+    def _build(self, args=('main.S', 'out.bin')):
+        asm = Assembler()
+        key = self.cache.key(asm, list(args))
+        if self.cache.restore(key) is not None:
+            return None
+        asm.assemble_file(self.source)
+        self.cache.store(key, asm.input_files, asm.write_outputs(self.output))
+        return asm
+
+    def _output(self):
+        with open(self.output, 'rb') as handle:
+            return handle.read()
+
+    def test_input_files(self):
+        asm = self._build()
+        self.assertEqual(list(asm.input_files), [self.source, self.include])
+
+    def test_hit(self):
+        self.assertIsNotNone(self._build())
+        os.unlink(self.output)
+        self.assertIsNone(self._build())
+        self.assertEqual(self._output(), b'\x01\x02')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_include_change(self):
+        self._build()
+        self._write(self.include, '.db 3')
+        self.assertIsNotNone(self._build())
+        self.assertEqual(self._output(), b'\x01\x03')
+        # both versions are stored
+        self._write(self.include, '.db 2')
+        self.assertIsNone(self._build())
+        self.assertEqual(self._output(), b'\x01\x02')
+
+    def test_args_change(self):
+        self._build()
+        self.assertIsNotNone(self._build(('main.S', 'out.bin', '--symbols', 'out.csv')))
+
+    def test_evict(self):
+        self.cache.max_size = 0
+        self._build()
+        self.assertIsNotNone(self._build())
+        self.assertEqual(self.cache.hits, 0)
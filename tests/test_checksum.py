@@ -0,0 +1,76 @@
+import unittest
+from necroassembler.checksum import Checksum
+from necroassembler.platforms.gameboy import AssemblerGameboy
+from necroassembler.platforms.genesis import AssemblerGenesis
+from necroassembler.platforms.gba import AssemblerGBA
+
+
+def _rom(size):
+    return bytearray([(index * 31 + 7) & 0xFF for index in range(size)])
+
+
+class TestChecksum(unittest.TestCase):
+
+    def test_sum8(self):
+        rom = _rom(1000)
+        checksum = Checksum(rom, 64)
+        self.assertEqual(checksum.sum8(), sum(rom))
+        self.assertEqual(checksum.sum8(10, 500), sum(rom[10:500]))
+
+    def test_sum16_be(self):
+        rom = _rom(1001)
+        checksum = Checksum(rom, 64)
+        words = sum([(rom[i] << 8) | (rom[i + 1] if i + 1 < len(rom) else 0)
+                     for i in range(0x20, len(rom), 2)])
+        self.assertEqual(checksum.sum16_be(0x20), words)
+
+    def test_incremental(self):
+        rom = _rom(1024)
+        checksum = Checksum(rom, 64)
+        checksum.sum8()
+        self.assertEqual(len(checksum.blocks), 16)
+        checksum.write(100, b'\x00\x00')
+        self.assertEqual(len(checksum.blocks), 15)
+        self.assertEqual(checksum.sum8(), sum(rom))
+
+    def test_resize(self):
+        rom = _rom(100)
+        checksum = Checksum(rom, 64)
+        checksum.sum8()
+        rom += b'\x01\x02'
+        self.assertEqual(checksum.sum8(), sum(rom))
+
+    def test_write_outside(self):
+        checksum = Checksum(_rom(10))
+        self.assertRaises(IndexError, checksum.write, 9, b'\x00\x00')
+
+
+class TestPlatformChecksums(unittest.TestCase):
+
+    def test_gameboy(self):
+        asm = AssemblerGameboy()
+        asm.assembled_bytes = _rom(0x8000)
+        asm._fix()
+        rom = asm.assembled_bytes
+        self.assertEqual(rom[0x14d], (-sum(rom[0x134:0x14d]) - 25) & 0xFF)
+        self.assertEqual((rom[0x14e] << 8) | rom[0x14f],
+                         (sum(rom) - rom[0x14e] - rom[0x14f]) & 0xFFFF)
+
+    def test_genesis(self):
+        asm = AssemblerGenesis()
+        asm.assembled_bytes = _rom(0x1000)
+        asm._fix()
+        rom = asm.assembled_bytes
+        words = sum([(rom[i] << 8) | rom[i + 1] for i in range(0x200, len(rom), 2)])
+        self.assertEqual((rom[0x18e] << 8) | rom[0x18f], words & 0xFFFF)
+
+    def test_gba(self):
+        asm = AssemblerGBA()
+        asm.assembled_bytes = _rom(0x200)
+        asm._fix()
+        rom = asm.assembled_bytes
+        self.assertEqual(rom[0xBD], (-sum(rom[0xA0:0xBD]) - 0x19) & 0xFF)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+from necroassembler import Assembler
+from necroassembler.cache import AssetCache
+from necroassembler.compression import CODECS, DECOMPRESSORS, compress_lz77_gba, compress_rle_gba
+from necroassembler.exceptions import InvalidArgumentsForDirective
+
+
+class TestCompression(unittest.TestCase):
+
+    samples = (b'', b'A', b'ABABABABABABABAB', b'\x00' * 1000,
+               bytes(range(256)) * 3, b'hello hello hello world, hello world!' * 20,
+               bytes([(index * 7) % 13 for index in range(5000)]))
+
+    def test_round_trip(self):
+        for name in ('lz77', 'rle', 'lzss'):
+            for sample in self.samples:
+                blob = CODECS[name](sample)
+                self.assertEqual(DECOMPRESSORS[name](blob), sample, name)
+
+    def test_lz77_header(self):
+        blob = compress_lz77_gba(b'\x00' * 1000)
+        self.assertEqual(blob[0:4], b'\x10\xe8\x03\x00')
+        self.assertEqual(len(blob) % 4, 0)
+        self.assertLess(len(blob), 200)
+
+    def test_lz77_vram_safe(self):
+        # every match must reference at least 2 bytes back
+        blob = compress_lz77_gba(b'\x00' * 100)
+        self.assertEqual(blob[4:9], b'\x3f\x00\x00\xf0\x01')
+
+    def test_rle(self):
+        self.assertEqual(compress_rle_gba(b'\x01\x02\x03\x03\x03\x03'),
+                         b'\x30\x06\x00\x00\x01\x01\x02\x81\x03\x00\x00\x00')
+
+
+class TestIncbinCompressed(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'data.bin')
+        with open(self.filename, 'wb') as handle:
+            handle.write(b'ABCABCABCABC')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_directive(self):
+        asm = Assembler()
+        asm.assemble('.incbin_compressed "{0}", lzss'.format(self.filename))
+        self.assertEqual(DECOMPRESSORS['lzss'](asm.assembled_bytes), b'ABCABCABCABC')
+
+    def test_cached(self):
+        cache = AssetCache(os.path.join(self.directory.name, 'cache'))
+        for _ in range(0, 2):
+            asm = Assembler()
+            asm.asset_cache = cache
+            asm.assemble('.incbin_compressed "{0}", rle'.format(self.filename))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_unknown_codec(self):
+        asm = Assembler()
+        self.assertRaises(InvalidArgumentsForDirective, asm.assemble,
+                          '.incbin_compressed "{0}", zip'.format(self.filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
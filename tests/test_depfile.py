@@ -0,0 +1,31 @@
+import os
+import tempfile
+import unittest
+from necroassembler import Assembler
+from necroassembler.depfile import escape_path, format_depfile
+
+
+class TestDepfile(unittest.TestCase):
+
+    def test_escape(self):
+        self.assertEqual(escape_path('my file$1#.S'), 'my\\ file$$1\\#.S')
+
+    def test_format(self):
+        self.assertEqual(format_depfile('out.gb', ['main.S', 'tiles.png']),
+                         'out.gb: \\\n  main.S \\\n  tiles.png\n\nmain.S:\n\ntiles.png:\n')
+
+    def test_no_dependencies(self):
+        self.assertEqual(format_depfile('out.gb', []), 'out.gb:\n')
+
+    def test_input_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            binary = os.path.join(directory, 'data.bin')
+            csv = os.path.join(directory, 'data.csv')
+            with open(binary, 'wb') as handle:
+                handle.write(b'\x01')
+            with open(csv, 'w') as handle:
+                handle.write('2')
+            asm = Assembler()
+            asm.assemble('.incbin "{0}"\n.inccsv "{1}"\n.incbin "{0}"'.format(binary, csv))
+            asm.close_mapped_files()
+            self.assertEqual(list(asm.input_files), [binary, csv])
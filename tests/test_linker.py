@@ -0,0 +1,207 @@
+import os
+import struct
+import tempfile
+import unittest
+from necroassembler import Assembler
+from necroassembler.linker import ELF, elf_hash, gnu_hash
+from necroassembler.exceptions import SymbolAlreadyExported
+from necroassembler.utils import pack_le32u
+
+
+def _sections(blob):
+    # (name, type, offset, size, link, info) for every section of an ELF64 little endian file
+    shoff, = struct.unpack_from('<Q', blob, 0x28)
+    shnum, shstrndx = struct.unpack_from('<HH', blob, 0x3C)
+    headers = [struct.unpack_from('<IIQQQQIIQQ', blob, shoff + index * 64) for index in range(shnum)]
+    strings = headers[shstrndx][4]
+    sections = {}
+    for header in headers:
+        name = blob[strings + header[0]:blob.index(b'\x00', strings + header[0])].decode()
+        sections[name] = (header[1], header[4], header[5], header[6], header[7])
+    return sections
+
+
+class TestELF(unittest.TestCase):
+
+    def setUp(self):
+        self.asm = Assembler()
+        self.asm.assemble('''
+.section ".text" RX
+.export "foo"
+.export "bar"
+.export "undefined"
+foo:
+.db 1
+bar:
+.db 2, 3
+''')
+        self.asm.link(linker=ELF(64, False, 0x01, 0x3E))
+        self.blob = bytes(self.asm.assembled_bytes)
+        self.sections = _sections(self.blob)
+
+    def _symbols(self):
+        _, offset, size, link, _ = self.sections['.symtab']
+        strings = self.sections['.strtab'][1]
+        symbols = []
+        for index in range(0, size // 24):
+            name, info, _, shndx, value, _ = struct.unpack_from('<IBBHQQ', self.blob, offset + index * 24)
+            symbols.append((self.blob[strings + name:self.blob.index(b'\x00', strings + name)], value))
+        return symbols
+
+    def test_hashes(self):
+        self.assertEqual(elf_hash(b'printf'), 0x077905a6)
+        self.assertEqual(gnu_hash(b'printf'), 0x156b2bb8)
+
+    def test_symtab(self):
+        symbols = self._symbols()
+        self.assertEqual(symbols[0], (b'', 0))
+        # section symbol
+        self.assertEqual(symbols[1], (b'', 0))
+        self.assertEqual(sorted(symbols[2:]), [(b'bar', 1), (b'foo', 0)])
+        self.assertEqual(self.sections['.symtab'][4], 2)
+
+    def test_sysv_hash_lookup(self):
+        symbols = self._symbols()
+        offset = self.sections['.hash'][1]
+        nbucket, nchain = struct.unpack_from('<II', self.blob, offset)
+        self.assertEqual(nchain, len(symbols))
+        for name, _ in symbols[2:]:
+            index, = struct.unpack_from('<I', self.blob, offset + 8 + (elf_hash(name) % nbucket) * 4)
+            while symbols[index][0] != name:
+                self.assertNotEqual(index, 0)
+                index, = struct.unpack_from('<I', self.blob, offset + 8 + (nbucket + index) * 4)
+
+    def test_gnu_hash_lookup(self):
+        symbols = self._symbols()
+        offset = self.sections['.gnu.hash'][1]
+        nbuckets, symoffset, bloom_size, _ = struct.unpack_from('<IIII', self.blob, offset)
+        buckets = offset + 16 + bloom_size * 8
+        chains = buckets + nbuckets * 4
+        self.assertEqual(symoffset, 2)
+        for name, _ in symbols[2:]:
+            value = gnu_hash(name)
+            index, = struct.unpack_from('<I', self.blob, buckets + (value % nbuckets) * 4)
+            while True:
+                chain, = struct.unpack_from('<I', self.blob, chains + (index - symoffset) * 4)
+                if (chain | 1) == (value | 1) and symbols[index][0] == name:
+                    break
+                self.assertEqual(chain & 1, 0)
+                index += 1
+
+    def test_save(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'out.o')
+            self.asm.save(filename)
+            with open(filename, 'rb') as handle:
+                self.assertEqual(handle.read(), self.blob)
+
+    def test_link_to_file(self):
+        asm = Assembler()
+        asm.assemble('.section ".text" RX\n.export "foo"\nfoo:\n.db 1\n.dd foo')
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'out.o')
+            asm.link_to_file(filename, linker=ELF(64, False, 0x01, 0x3E))
+            # the parts are written without joining them
+            self.assertEqual(asm.assembled_bytes, b'\x01\x00\x00\x00\x00')
+            with open(filename, 'rb') as handle:
+                blob = handle.read()
+        asm.reset()
+        asm.assemble('.section ".text" RX\n.export "foo"\nfoo:\n.db 1\n.dd foo')
+        asm.link(linker=ELF(64, False, 0x01, 0x3E))
+        self.assertEqual(blob, asm.assembled_bytes)
+
+    def _relocations(self, name):
+        _, offset, size, _, _ = self.sections[name]
+        return [struct.unpack_from('<QQq', self.blob, offset + index * 24) for index in range(0, size // 24)]
+
+    def test_relocations(self):
+        asm = Assembler()
+        asm.assemble('''
+.section ".text" RX
+.db 0
+.dd external
+.section ".data" RW
+.db 0, 0
+data:
+.section ".text2" RX
+.dd data
+''')
+        asm.link(linker=ELF(64, False, 0x01, 0x3E))
+        self.blob = bytes(asm.assembled_bytes)
+        self.sections = _sections(self.blob)
+        # undefined symbol after the 3 section symbols
+        self.assertEqual(self._relocations('.rela.text'), [(1, (4 << 32) | 10, 0)])
+        # relative to the .data section symbol
+        self.assertEqual(self._relocations('.rela.text2'), [(0, (2 << 32) | 10, 2)])
+        self.assertEqual(self.sections['.rela.text'][4], 1)
+        self.assertEqual(self.sections['.rela.text2'][4], 3)
+
+    def test_relocation_relative(self):
+        class AssemblerRelative(Assembler):
+            def directive_rel32(self, instr):
+                self.append_assembled_bytes(pack_le32u(self.parse_integer_or_label(
+                    instr.tokens[1], size=4, bits_size=32, relative=self.pc + 4)))
+
+            def register_directives(self):
+                self.register_directive('rel32', self.directive_rel32)
+
+        asm = AssemblerRelative()
+        asm.assemble('.section ".text" RX\n.db 0\n.rel32 external\n')
+        asm.link(linker=ELF(64, False, 0x01, 0x3E))
+        self.blob = bytes(asm.assembled_bytes)
+        self.sections = _sections(self.blob)
+        self.assertEqual(self._relocations('.rela.text'), [(1, (2 << 32) | 2, -4)])
+
+    def test_relocation_rel(self):
+        asm = Assembler()
+        asm.assemble('.section ".pad" R\n.db 0, 0\n.section ".text" RX\n.db 0\nlabel:\n'
+                     '.section ".data" RW\n.dd label\n')
+        linker = ELF(32, False, 0x01, 0x03)
+        asm.link(linker=linker)
+        field = linker.file_base + asm.sections['.data']['offset']
+        # the addend (offset of the label in .text) is stored in the field
+        self.assertEqual(asm.assembled_bytes[field:field + 4], b'\x01\x00\x00\x00')
+
+    def test_relocation_formula(self):
+        asm = Assembler()
+        asm.assemble('.section ".data" RW\n.db 0, 0\ndata:\n.section ".text" RX\n.dd data+4\n.dd data*2')
+        asm.link(linker=ELF(64, False, 0x01, 0x3E))
+        self.blob = bytes(asm.assembled_bytes)
+        self.sections = _sections(self.blob)
+        # the formula offset is in the addend, data*2 can not be relocated and is kept as resolved
+        self.assertEqual(self._relocations('.rela.text'), [(0, (1 << 32) | 10, 6)])
+        field = asm.linker.file_base + asm.sections['.text']['offset']
+        self.assertEqual(self.blob[field + 4:field + 8], b'\x04\x00\x00\x00')
+
+    def test_relocation_hook(self):
+        asm = Assembler()
+        asm.assemble('.section ".data" RW\n.db 0, 0\ndata:\n.section ".text" RX\n.db_to_ascii data')
+        asm.link(linker=ELF(64, False, 0x01, 0x3E))
+        field = asm.linker.file_base + asm.sections['.text']['offset']
+        self.assertEqual(asm.assembled_bytes[field:field + 3], b'002')
+        self.assertNotIn('.rela.text', _sections(bytes(asm.assembled_bytes)))
+
+    def test_export_twice(self):
+        asm = Assembler()
+        self.assertRaises(SymbolAlreadyExported, asm.assemble, '.export "foo"\n.export "foo"')
+
+
+class TestCustomLinker(unittest.TestCase):
+
+    class LinkerMinimal:
+        # no resolve_symbol()
+        def resolve_unknown_symbol(self, assembler, address, symbol_data):
+            return 0xFF
+
+        def link(self, assembler):
+            return assembler.assembled_bytes
+
+    def test_without_resolve_symbol(self):
+        asm = Assembler()
+        asm.assemble('.org 16\nstart:\n.db start, unknown')
+        asm.link(linker=self.LinkerMinimal())
+        self.assertEqual(asm.assembled_bytes, b'\x10\xff')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+from necroassembler import Assembler, opcode
+from necroassembler.objects import dump_object, load_object, link_objects, InvalidObjectFile, UnsupportedFixup
+from necroassembler.exceptions import LabelAlreadyDefined
+from necroassembler.utils import pack_be16u, LabelFilter
+
+
+class AssemblerObjects(Assembler):
+
+    hex_prefixes = ('0x',)
+
+    big_endian = True
+
+    @opcode('JMP')
+    def _jmp(self, instr):
+        return pack_be16u(self.parse_integer_or_label(instr.tokens[1], size=2, bits_size=16))
+
+    @opcode('BRA')
+    def _bra(self, instr):
+        return bytes((self.parse_integer_or_label(instr.tokens[1], size=1, bits_size=8,
+                                                  relative=self.pc + 1) & 0xFF,))
+
+    @opcode('HIGH')
+    def _high(self, instr):
+        return bytes((self.parse_integer_or_label(instr.tokens[1], size=1, bits_size=16,
+                                                  filter=LabelFilter(8)) & 0xFF,))
+
+
+class TestObjects(unittest.TestCase):
+
+    sources = ('start:\nJMP other\nBRA start\n.db 1',
+               'other:\nBRA other\nHIGH start\nJMP start')
+
+    def _object(self, code):
+        asm = AssemblerObjects()
+        asm.assemble(code)
+        return load_object(dump_object(asm))
+
+    def test_round_trip(self):
+        obj = self._object(self.sources[1])
+        self.assertEqual(obj['class'], 'tests.test_objects:AssemblerObjects')
+        self.assertEqual(list(obj['labels']), ['other'])
+        self.assertEqual(len(obj['fixups']), 3)
+        index, data = obj['fixups'][1]
+        self.assertEqual((index, data.label, data.bits_size, data.filter.shift), (1, 'start', 16, 8))
+        self.assertEqual(obj['bytes'], b'\x00\x00\x00\x00')
+
+    def test_link_equals_single_assembler(self):
+        single = AssemblerObjects()
+        for source in self.sources:
+            single.assemble(source)
+        single.link()
+
+        asm = AssemblerObjects()
+        link_objects(asm, [self._object(source) for source in self.sources])
+        asm.link()
+        self.assertEqual(asm.assembled_bytes, single.assembled_bytes)
+        self.assertEqual(asm.labels['other']['base'], 4)
+
+    def test_org_kept(self):
+        asm = AssemblerObjects()
+        link_objects(asm, [self._object('JMP label\n'), self._object('.org 0x1000\nlabel:\n.db 0')])
+        asm.link()
+        self.assertEqual(asm.assembled_bytes, b'\x10\x00\x00')
+
+    def test_not_relocatable(self):
+        self.assertTrue(self._object('.db 1')['relocatable'])
+        for code in ('.org 0\n.db 1', '.db 1\n.align 4', '.db 1\n.upto 4'):
+            self.assertFalse(self._object(code)['relocatable'])
+        # the alignment computed at assembly time is kept
+        asm = AssemblerObjects()
+        link_objects(asm, [self._object('.db 1, 2, 3'), self._object('.db 1\n.align 4\nlabel:\nJMP label')])
+        asm.link()
+        self.assertEqual(asm.assembled_bytes, b'\x01\x02\x03\x01\x00\x00\x00\x00\x04')
+
+    def test_duplicated_label(self):
+        asm = AssemblerObjects()
+        self.assertRaises(LabelAlreadyDefined, link_objects, asm,
+                          [self._object('start:'), self._object('start:')])
+
+    def test_unsupported_fixup(self):
+        asm = AssemblerObjects()
+        asm.assemble('JMP start')
+        asm.labels_addresses[0].filter = lambda x: x
+        self.assertRaises(UnsupportedFixup, dump_object, asm)
+
+    def test_invalid(self):
+        self.assertRaises(InvalidObjectFile, load_object, b'NOTANOBJECT')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import io
+import os
+import json
+import base64
+import tempfile
+import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from necroassembler import server
+from necroassembler.server import run_job, serve_stream
+
+Z80 = 'necroassembler.cpu.z80:AssemblerZ80'
+
+
+class TestServer(unittest.TestCase):
+
+    def test_source(self):
+        response = run_job({'id': 1, 'assembler': Z80, 'source': 'NOP\nINC BC'})
+        self.assertTrue(response['ok'])
+        self.assertEqual(response['id'], 1)
+        self.assertEqual(base64.b64decode(response['bytes']), b'\x00\x03')
+
+    def test_defines(self):
+        response = run_job({'assembler': Z80, 'source': '.db VALUE', 'defines': {'VALUE': 17}})
+        self.assertEqual(base64.b64decode(response['bytes']), b'\x11')
+
+    def test_reuse(self):
+        run_job({'assembler': Z80, 'source': '.define OTHER 1\nstart:\nNOP', 'defines': {'VALUE': 1}})
+        response = run_job({'assembler': Z80, 'source': 'start:\n.db VALUE'})
+        self.assertFalse(response['ok'])
+        self.assertEqual(run_job({'assembler': Z80, 'source': 'start:\nJP start'})['bytes'],
+                         base64.b64encode(b'\xc3\x00\x00').decode())
+
+    def test_path_and_output(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'main.S'), 'w') as handle:
+                handle.write('NOP\n.include "included.S"\n.incbin "data.bin"')
+            with open(os.path.join(directory, 'included.S'), 'w') as handle:
+                handle.write('INC BC')
+            with open(os.path.join(directory, 'data.bin'), 'wb') as handle:
+                handle.write(b'\x17')
+            response = run_job({'assembler': Z80, 'path': 'main.S',
+                                'output': 'out.bin', 'cwd': directory})
+            self.assertTrue(response['ok'])
+            with open(os.path.join(directory, 'out.bin'), 'rb') as handle:
+                self.assertEqual(handle.read(), b'\x00\x03\x17')
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_concurrent_cwd(self):
+        with tempfile.TemporaryDirectory() as first, tempfile.TemporaryDirectory() as second:
+            jobs = []
+            for index in range(0, 16):
+                directory = (first, second)[index % 2]
+                with open(os.path.join(directory, 'main.S'), 'w') as handle:
+                    handle.write('.db {0}'.format(index % 2))
+                jobs.append({'id': index, 'assembler': Z80, 'path': 'main.S', 'cwd': directory})
+            with ThreadPoolExecutor(4) as pool:
+                responses = list(pool.map(run_job, jobs))
+        for response in responses:
+            self.assertEqual(base64.b64decode(response['bytes']), bytes([response['id'] % 2]))
+
+    def test_not_an_assembler(self):
+        response = run_job({'assembler': 'necroassembler.utils:pack', 'source': ''})
+        self.assertFalse(response['ok'])
+        self.assertEqual(response['exception'], 'NotAnAssembler')
+
+    def test_module_not_allowed(self):
+        with mock.patch('necroassembler.objects.importlib.import_module') as import_module:
+            response = run_job({'assembler': 'os:getcwd', 'source': ''})
+            self.assertEqual(response['exception'], 'NotAnAssembler')
+            self.assertFalse(import_module.called)
+        with mock.patch.object(server, 'ALLOWED_MODULES', {'tests.test_objects'}):
+            response = run_job({'assembler': 'tests.test_objects:AssemblerObjects', 'source': '.db 1'})
+            self.assertEqual(base64.b64decode(response['bytes']), b'\x01')
+
+    def test_error(self):
+        response = run_job({'assembler': Z80, 'source': 'JP unknown'})
+        self.assertFalse(response['ok'])
+        self.assertEqual(response['exception'], 'UnknownLabel')
+
+    def test_stream(self):
+        jobs = [{'id': index, 'assembler': Z80, 'source': '.db {0}'.format(index)} for index in range(0, 8)]
+        rfile = io.StringIO('\n'.join([json.dumps(job) for job in jobs]) + '\n\nnot json\n')
+        wfile = io.StringIO()
+        with ThreadPoolExecutor(2) as pool:
+            serve_stream(rfile, wfile, pool)
+        responses = [json.loads(line) for line in wfile.getvalue().splitlines()]
+        self.assertEqual(len(responses), 9)
+        self.assertEqual(len([response for response in responses if not response['ok']]), 1)
+        for response in responses:
+            if response['ok']:
+                self.assertEqual(base64.b64decode(response['bytes']), bytes([response['id']]))
@@ -0,0 +1,52 @@
+import json
+import os
+import tempfile
+import unittest
+from necroassembler.cpu.mos6502 import AssemblerMOS6502
+from necroassembler.symbols import export_symbols, FCEUXWriter, MesenWriter, SymWriter, CSVWriter, JSONWriter, SymbolWriter
+
+
+class TestSymbols(unittest.TestCase):
+
+    def setUp(self):
+        self.asm = AssemblerMOS6502()
+        self.asm.assemble(
+            '.org $0000\nzp: .ram 1\n.org $8000\nreset: NOP\nloop: JMP loop\n.org $C000\nlast:')
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _read(self, filename):
+        with open(os.path.join(self.directory.name, filename), newline='') as handle:
+            return handle.read()
+
+    def test_export_multiple_formats(self):
+        export_symbols(self.asm, [
+            FCEUXWriter(os.path.join(self.directory.name, 'rom.nl'), 0x8000, 0xFFFF),
+            MesenWriter(os.path.join(self.directory.name, 'rom.mlb'),
+                        ((0x0000, 0x7FF, 'R', None),
+                         (0x8000, 0xFFFF, 'P', lambda address, label: label['offset']))),
+            SymWriter(os.path.join(self.directory.name, 'rom.sym'),
+                      bank=lambda address, label: address >> 14),
+            CSVWriter(os.path.join(self.directory.name, 'rom.csv'))])
+        self.assertEqual(self._read('rom.nl'),
+                         '$8000#reset#\r\n$8001#loop#\r\n$C000#last#\r\n')
+        self.assertEqual(self._read('rom.mlb'),
+                         'R:0000:zp\nP:0000:reset\nP:0001:loop\nP:0004:last\n')
+        self.assertEqual(self._read('rom.sym'),
+                         '; generated by necroassembler\n00:0000 zp\n02:8000 reset\n02:8001 loop\n03:C000 last\n')
+        self.assertEqual(self._read('rom.csv'),
+                         'name,address,offset,section\nzp,0x0,0,\nreset,0x8000,0,\nloop,0x8001,1,\nlast,0xC000,4,\n')
+
+    def test_export_default_and_json(self):
+        json_writer = JSONWriter(os.path.join(self.directory.name, 'rom.json'), 0x8000, 0x8001)
+        export_symbols(self.asm, [
+            SymbolWriter(os.path.join(self.directory.name, 'rom.map'), 0x8000),
+            json_writer])
+        self.assertEqual(self._read('rom.map'), '00008000 reset\n00008001 loop\n0000C000 last\n')
+        self.assertEqual([symbol['name'] for symbol in json.loads(self._read('rom.json'))],
+                         ['reset', 'loop'])
+        # writers can be reused
+        export_symbols(self.asm, [json_writer])
+        self.assertEqual(len(json.loads(self._read('rom.json'))), 2)
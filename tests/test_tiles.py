@@ -0,0 +1,134 @@
+import unittest
+import random
+from unittest import mock
+from necroassembler.tiles import (encode_planar_tiles, max_palette_index, split_tiles,
+                                  flip_tile, deduplicate_tiles, quantize_pixels, unique_colors,
+                                  GRAYSCALE_PALETTE)
+from necroassembler.platforms import sms
+
+
+class FakeImage:
+
+    def __init__(self, pixels, size, mode='P'):
+        self.pixels = pixels
+        self.size = size
+        self.mode = mode
+
+    def tobytes(self):
+        return self.pixels
+
+    def convert(self, mode):
+        # only RGBA images can be converted
+        return self
+
+
+def _reference_tile(pixels, width, cell_x, cell_y, bpp):
+    rows = []
+    for y in range(0, 8):
+        planes = [0] * bpp
+        for x in range(0, 8):
+            value = pixels[(cell_y * 8 + y) * width + cell_x * 8 + x]
+            for plane in range(0, bpp):
+                planes[plane] |= ((value >> plane) & 0x1) << (7 - x)
+        rows.append(planes)
+    return rows
+
+
+class TestTiles(unittest.TestCase):
+
+    def setUp(self):
+        generator = random.Random(17)
+        self.width = 24
+        self.height = 16
+        self.pixels = bytes([generator.randrange(16)
+                             for _ in range(self.width * self.height)])
+
+    def test_interleaved(self):
+        expected = b''
+        for cell_y in range(0, 2):
+            for cell_x in range(0, 3):
+                for row in _reference_tile(self.pixels, self.width, cell_x, cell_y, 4):
+                    expected += bytes(row)
+        self.assertEqual(encode_planar_tiles(
+            self.pixels, self.width, 4), expected)
+
+    def test_not_interleaved(self):
+        pixels = bytes([value & 0x3 for value in self.pixels])
+        expected = b''
+        for cell_y in range(0, 2):
+            for cell_x in range(0, 3):
+                rows = _reference_tile(pixels, self.width, cell_x, cell_y, 2)
+                expected += bytes([row[0] for row in rows])
+                expected += bytes([row[1] for row in rows])
+        self.assertEqual(encode_planar_tiles(
+            pixels, self.width, 2, interleave=False), expected)
+
+    def test_gameboy_tile(self):
+        # first row of the classic "A" tile example
+        pixels = bytes([0, 2, 3, 3, 3, 3, 2, 0]) + bytes(56)
+        self.assertEqual(encode_planar_tiles(pixels, 8, 2)[0:2], b'\x3C\x7E')
+
+    def test_max_palette_index(self):
+        self.assertEqual(max_palette_index(self.pixels), 15)
+        self.assertEqual(max_palette_index(b''), 0)
+
+    def test_split_tiles(self):
+        tiles = split_tiles(self.pixels, self.width)
+        self.assertEqual(len(tiles), 6)
+        self.assertEqual(tiles[4][8:16], self.pixels[9 * 24 + 8:9 * 24 + 16])
+
+    def test_deduplicate(self):
+        tiles = split_tiles(self.pixels, self.width)
+        unique, entries = deduplicate_tiles(tiles + [tiles[1], tiles[0]])
+        self.assertEqual(unique, tiles)
+        self.assertEqual(entries[6:], [(1, False, False), (0, False, False)])
+
+    def test_deduplicate_flip(self):
+        tiles = split_tiles(self.pixels, self.width)
+        mirrored = [flip_tile(tiles[2], True, False),
+                    flip_tile(tiles[3], False, True),
+                    flip_tile(tiles[0], True, True)]
+        unique, entries = deduplicate_tiles(tiles + mirrored, flip=True)
+        self.assertEqual(unique, tiles)
+        self.assertEqual(entries[6:], [(2, True, False), (3, False, True), (0, True, True)])
+        # without flip detection mirrored tiles are unique
+        unique, _ = deduplicate_tiles(tiles + mirrored)
+        self.assertEqual(len(unique), 9)
+
+    def test_sms_tilemap(self):
+        tiles = split_tiles(self.pixels, self.width)
+        pixels = b''.join(tiles[0:2] + [flip_tile(tiles[0], True, False)])
+        with mock.patch.object(sms, 'open_image', return_value=FakeImage(pixels, (8, 24))):
+            self.assertEqual(sms.convert_tilemap(b'', ('FLIP',), 256),
+                             b'\x00\x01\x01\x01\x00\x03')
+            self.assertEqual(sms.convert_unique_tiles(b'', ('FLIP',)),
+                             encode_planar_tiles(b''.join(tiles[0:2]), 8, 4))
+
+    def test_quantize(self):
+        rgba = bytes([250, 250, 250, 255,
+                      0, 10, 0, 255,
+                      100, 90, 80, 255,
+                      160, 180, 170, 255,
+                      0, 0, 0, 0])
+        self.assertEqual(quantize_pixels(rgba, GRAYSCALE_PALETTE), b'\x00\x03\x02\x01\x00')
+
+    def test_unique_colors(self):
+        rgba = bytes([1, 2, 3, 4, 5, 6, 7, 8, 1, 2, 3, 4])
+        self.assertEqual(unique_colors(rgba), [(1, 2, 3, 4), (5, 6, 7, 8)])
+
+    def test_sms_quantize(self):
+        rgba = bytes([0, 0, 0, 0]) + bytes([255, 0, 0, 255]) + \
+            bytes([0, 90, 250, 255]) * 62
+        with mock.patch.object(sms, 'open_image', return_value=FakeImage(rgba, (8, 8), 'RGBA')):
+            self.assertEqual(sms.convert_palette(b''), b'\x00\x03\x34')
+            self.assertEqual(sms.convert_tiles(b'', ('QUANTIZE',)),
+                             encode_planar_tiles(bytes([0, 1]) + bytes([2] * 62), 8, 4))
+
+    def test_sms_quantize_opaque_black(self):
+        rgba = bytes([0, 0, 0, 0]) + bytes([255, 255, 255, 255]) + \
+            bytes([0, 0, 0, 255]) + bytes([10, 5, 0, 255]) * 61
+        with mock.patch.object(sms, 'open_image', return_value=FakeImage(rgba, (8, 8), 'RGBA')):
+            # transparency slot, white, opaque black
+            self.assertEqual(sms.convert_palette(b''), b'\x00\x3f\x00')
+            self.assertEqual(sms.convert_tiles(b'', ('QUANTIZE',)),
+                             encode_planar_tiles(bytes([0, 1, 2]) + bytes([2] * 61), 8, 4))
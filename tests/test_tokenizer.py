@@ -1,5 +1,5 @@
 import unittest
-from necroassembler.tokenizer import Tokenizer
+from necroassembler.tokenizer import Tokenizer, split_operands, split_conditionals
 
 
 class TestTokenizer(unittest.TestCase):
@@ -14,3 +14,26 @@ class TestTokenizer(unittest.TestCase):
     def test_parser_string(self):
         self.tokenizer.parse('.ascii "hell\\"o",1,2,3')
         self.assertEqual(self.tokenizer.statements[0].tokens, ['.ascii', '"hell"o"', '1', '2', '3'])
+
+    def test_split_operands(self):
+        self.tokenizer.parse('LD (IX + 5), A\n.db "a b", 3')
+        self.assertEqual(split_operands(('LD', '(IX + 5)', 'A')), self.tokenizer.statements[0].tokens)
+        self.assertEqual(split_operands(('.db', '"a b"', 3)), self.tokenizer.statements[1].tokens)
+
+    def test_split_conditionals(self):
+        blocks = split_conditionals('.db 1\n  .IFDEF X ; comment\n.db 2\n.db 3\n.endif\n.ifx\n.include "a"', 10)
+        self.assertEqual(blocks, [(10, '.db 1\n', False), (11, '  .IFDEF X ; comment', True),
+                                  (11, '\n.db 2\n.db 3\n', False), (14, '.endif', True),
+                                  (14, '\n.ifx\n.include "a"', False)])
+
+    def test_split_conditionals_lines(self):
+        code = 'a\n.if 1\nb\n\n.else\nc\n.endif\nd'
+        tokenizer = Tokenizer()
+        tokenizer.parse(code)
+        lines = []
+        for line, block, _ in split_conditionals(code):
+            block_tokenizer = Tokenizer()
+            block_tokenizer.line = line
+            block_tokenizer.parse(block)
+            lines += [(statement.line, statement.tokens) for statement in block_tokenizer.statements]
+        self.assertEqual(lines, [(statement.line, statement.tokens) for statement in tokenizer.statements])
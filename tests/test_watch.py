@@ -0,0 +1,57 @@
+import os
+import time
+import tempfile
+import unittest
+from necroassembler import Assembler
+from necroassembler.watch import watch, changed_files, file_mtime
+
+
+class TestWatch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.include = self._write('include.S', '.db 2')
+        self.source = self._write('main.S', '.db 1\n.include "{0}"'.format(self.include))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _write(self, name, content, mtime=None):
+        filename = os.path.join(self.directory.name, name)
+        with open(filename, 'w') as handle:
+            handle.write(content)
+        if mtime is not None:
+            os.utime(filename, ns=(mtime, mtime))
+        return filename
+
+    def test_changed_files(self):
+        mtimes = {self.source: file_mtime(self.source), self.include: 0,
+                  os.path.join(self.directory.name, 'missing'): None}
+        self.assertEqual(changed_files(mtimes), [self.include])
+
+    def test_rebuild(self):
+        asm = Assembler()
+        outputs = []
+
+        def build():
+            asm.assemble_file(self.source)
+            outputs.append(bytes(asm.assembled_bytes))
+            if len(outputs) == 1:
+                self._write('include.S', '.db 3', int(time.time() * 1000000000) + 1000000000)
+
+        watch(asm, build, 0.01, 2)
+        self.assertEqual(outputs, [b'\x01\x02', b'\x01\x03'])
+        self.assertEqual(list(asm.input_files), [self.source, self.include])
+        # only the include is tokenized again
+        self.assertEqual((asm.token_cache.hits, asm.token_cache.misses), (1, 3))
+        self.assertEqual(len(asm.token_cache.entries), 2)
+
+    def test_error(self):
+        asm = Assembler()
+        self._write('include.S', 'unknown')
+
+        def build():
+            asm.assemble_file(self.source)
+
+        watch(asm, build, 0.01, 1)
+        self.assertEqual(list(asm.input_files), [self.source, self.include])